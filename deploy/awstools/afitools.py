@@ -4,8 +4,14 @@ from __future__ import annotations
 
 from absl import logging
 import boto3
+from concurrent.futures import ThreadPoolExecutor
+import multiprocessing
+import os
+import time
 from awstools.awstools import depaginated_boto_query
 
+from typing import Dict, Tuple
+
 
 def get_fpga_regions():
     """Get list of all regions with F1 support"""
@@ -25,6 +31,28 @@ def get_current_region():
     return boto_session.region_name
 
 
+def region_client(region):
+    """EC2 client for region. The default boto3 session is not thread safe,
+    so clients used by region operations running concurrently get their own
+    session."""
+    return boto3.session.Session().client("ec2", region_name=region)
+
+
+def run_in_regions(fn, regions):
+    """Call fn(region) for every region concurrently and return the results
+    by region. Raises the first exception raised by a call, after all calls
+    finished."""
+    if not regions:
+        return {}
+    with ThreadPoolExecutor(max_workers=len(regions)) as pool:
+        futures = {region: pool.submit(fn, region) for region in regions}
+    return {region: future.result() for region, future in futures.items()}
+
+
+# AFIs of AGFIs by (agfi, region), they never change once they exist
+_afi_for_agfi: Dict[Tuple[str, str], str] = {}
+
+
 def get_afi_for_agfi(agfi_id, region=None):
     """Get the AFI for the AGFI in the specified region.
     region = None means use default region
@@ -34,7 +62,10 @@ def get_afi_for_agfi(agfi_id, region=None):
     logging.debug(region)
     region = region if region is not None else get_current_region()
 
-    client = boto3.client("ec2", region_name=region)
+    if (agfi_id, region) in _afi_for_agfi:
+        return _afi_for_agfi[(agfi_id, region)]
+
+    client = region_client(region)
     operation_params = {
         "Filters": [
             {"Name": "fpga-image-global-id", "Values": [agfi_id]},
@@ -44,12 +75,17 @@ def get_afi_for_agfi(agfi_id, region=None):
         client, "describe_fpga_images", operation_params, "FpgaImages"
     )
     logging.debug(fpga_images_all)
-    return fpga_images_all[0]["FpgaImageId"]
+    afi_id = fpga_images_all[0]["FpgaImageId"]
+    _afi_for_agfi[(agfi_id, region)] = afi_id
+    return afi_id
 
 
-def copy_afi_to_all_regions(afi_id, starting_region=None):
+def copy_afi_to_all_regions(afi_id, starting_region=None, wait=False):
     """Copies an AFI to all regions, excluding the specified region.
-    starting_region=None makes starting region = to the default region."""
+    starting_region=None makes starting region = to the default region.
+    The copies are requested in all regions concurrently. With wait, also
+    wait until all copies are available. Returns the AFIs of the copies by
+    region."""
     starting_region = (
         starting_region if starting_region is not None else get_current_region()
     )
@@ -65,18 +101,242 @@ def copy_afi_to_all_regions(afi_id, starting_region=None):
     logging.info("""Regions to copy to: {}""".format(copy_to_regions))
     logging.info("""Copying AFI: {}""".format(afi_id))
 
-    for region in copy_to_regions:
-        client = boto3.client("ec2", region_name=region)
+    def copy_to_region(region):
+        client = region_client(region)
         result = client.copy_fpga_image(
             DryRun=False, SourceFpgaImageId=afi_id, SourceRegion=starting_region
         )
         logging.debug(result)
         logging.info("Copy result: " + str(result["FpgaImageId"]))
+        return result["FpgaImageId"]
+
+    copies = run_in_regions(copy_to_region, copy_to_regions)
+    if wait:
+        wait_on_afis_available(copies)
+    return copies
+
+
+def wait_on_afis_available(afis_by_region, poll_interval=10):
+    """Wait until the AFIs in afis_by_region (region -> AFI id) are
+    available. All regions are polled concurrently, see poll_afi_until_done.
+    Raises if an AFI fails."""
+
+    def wait_in_region(region):
+        afi_id = afis_by_region[region]
+        image = poll_afi_until_done(afi_id, region, poll_interval=poll_interval)
+        state = image["State"]["Code"]
+        if state != "available":
+            raise Exception(
+                f"{afi_id} in {region} is {state}: {image['State'].get('Message')}"
+            )
+        logging.info(f"{afi_id} is available in {region}")
+        return state
+
+    logging.info(f"Waiting for AFIs to become available in {list(afis_by_region)}")
+    return run_in_regions(wait_in_region, list(afis_by_region))
+
+
+def describe_afi(afi_id, region=None):
+    """Return the description of an AFI (as in describe_fpga_images)."""
+    region = region if region is not None else get_current_region()
+    client = region_client(region)
+    return client.describe_fpga_images(FpgaImageIds=[afi_id])["FpgaImages"][0]
+
+
+# seconds to wait for an AFI to leave the pending state. generation usually
+# takes about an hour
+AFI_GENERATION_TIMEOUT = 6 * 60 * 60
+# consecutive polls an AFI can fail to be described in before its build fails
+AFI_DESCRIBE_ATTEMPTS = 3
+# seconds since its last poll after which a build gives up on the poller
+AFI_POLLER_STALE_TIMEOUT = 15 * 60
+
+
+def _describe_failed(afi_id, region, failures, error):
+    """Log that afi_id could not be described in failures polls in a row.
+    Returns True if it should be given up on."""
+    logging.warning(
+        f"Unable to get the state of {afi_id} in {region} ({failures}/{AFI_DESCRIBE_ATTEMPTS}): {error}"
+    )
+    return failures >= AFI_DESCRIBE_ATTEMPTS
+
+
+def poll_afi_until_done(
+    afi_id, region, timeout=AFI_GENERATION_TIMEOUT, poll_interval=10
+):
+    """Poll afi_id in region until it is no longer pending and return its
+    description. Errors describing it (e.g. throttling, or a copy that does
+    not show up right after copy_fpga_image) are retried, until
+    AFI_DESCRIBE_ATTEMPTS polls in a row failed. Raises if it is still
+    pending after timeout seconds."""
+    client = region_client(region)
+    deadline = time.time() + timeout
+    failures = 0
+    while True:
+        try:
+            images = client.describe_fpga_images(FpgaImageIds=[afi_id])["FpgaImages"]
+            if not images:
+                raise Exception(f"{afi_id} does not exist (yet)")
+        except Exception as e:
+            failures += 1
+            if _describe_failed(afi_id, region, failures, e):
+                raise Exception(f"Unable to get the state of {afi_id} in {region}: {e}")
+        else:
+            failures = 0
+            state = images[0]["State"]["Code"]
+            logging.debug(f"{afi_id} in {region}: {state}")
+            if state != "pending":
+                return images[0]
+        if time.time() > deadline:
+            raise Exception(
+                f"{afi_id} in {region} is still pending after {timeout} seconds."
+            )
+        time.sleep(poll_interval)
+
+
+class AFIStatusTracker:
+    """Tracks the AFIs being generated by concurrent builds with one
+    describe_fpga_images call per region and poll interval, instead of every
+    build polling its own AFI.
+
+    Builds run in processes forked by fabric, so the tracker must be entered
+    before they are forked. The pending AFIs and the final descriptions live
+    in a multiprocessing manager, and the polling runs in its own process.
+    """
+
+    def __init__(self, poll_interval=10, timeout=AFI_GENERATION_TIMEOUT):
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.manager = None
+        self.poller = None
+
+    def __enter__(self):
+        global _active_tracker
+        context = multiprocessing.get_context("fork")
+        self.manager = context.Manager()
+        # afi id -> region, of AFIs that are still pending
+        self.pending = self.manager.dict()
+        # afi id -> description, of AFIs that are no longer pending
+        self.done = self.manager.dict()
+        # afi id -> error, of AFIs that could not be described
+        self.failed = self.manager.dict()
+        # afi id -> consecutive polls that failed to describe it
+        self.describe_failures = self.manager.dict()
+        self.last_poll = self.manager.Value("d", time.time())
+        self.stop = self.manager.Event()
+        self.owner_pid = os.getpid()
+        self.poller = context.Process(
+            target=self._poll, name="afi-status-tracker", daemon=True
+        )
+        self.poller.start()
+        _active_tracker = self
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global _active_tracker
+        _active_tracker = None
+        self.stop.set()
+        self.poller.join()
+        self.manager.shutdown()
+
+    def _describe(self, region, afi_ids):
+        return depaginated_boto_query(
+            region_client(region),
+            "describe_fpga_images",
+            {"FpgaImageIds": afi_ids},
+            "FpgaImages",
+        )
+
+    def _describe_each(self, region, afi_ids):
+        """Describe afi_ids one by one, so that one AFI that cannot be
+        described does not hold up the others. AFIs that fail
+        AFI_DESCRIBE_ATTEMPTS polls in a row are given up on."""
+        images = []
+        for afi_id in afi_ids:
+            try:
+                images += self._describe(region, [afi_id])
+            except Exception as e:
+                failures = self.describe_failures.get(afi_id, 0) + 1
+                self.describe_failures[afi_id] = failures
+                if _describe_failed(afi_id, region, failures, e):
+                    self.failed[afi_id] = str(e)
+                    self.pending.pop(afi_id, None)
+        return images
+
+    def _poll(self):
+        while not self.stop.wait(self.poll_interval):
+            self.last_poll.value = time.time()
+            by_region = {}
+            for afi_id, region in self.pending.items():
+                by_region.setdefault(region, []).append(afi_id)
+            for region, afi_ids in by_region.items():
+                try:
+                    images = self._describe(region, afi_ids)
+                except Exception as e:
+                    # e.g. throttling, or an id that does not exist
+                    logging.warning(f"Unable to get the state of AFIs in {region}: {e}")
+                    images = self._describe_each(region, afi_ids)
+                logging.debug(
+                    f"AFI states in {region}: "
+                    + ", ".join(
+                        f"{i['FpgaImageId']}: {i['State']['Code']}" for i in images
+                    )
+                )
+                for image in images:
+                    self.describe_failures.pop(image["FpgaImageId"], None)
+                    if image["State"]["Code"] != "pending":
+                        self.done[image["FpgaImageId"]] = image
+                        self.pending.pop(image["FpgaImageId"], None)
+
+    def _poller_alive(self):
+        if os.getpid() == self.owner_pid:
+            return self.poller.is_alive()
+        # builds run in forked processes, which cannot check on the poller
+        # process directly
+        return time.time() - self.last_poll.value < AFI_POLLER_STALE_TIMEOUT
+
+    def wait_for(self, afi_id, region=None):
+        """Block until afi_id is no longer pending and return its
+        description. Raises if it is still pending after the timeout of the
+        tracker, or if its state cannot be polled."""
+        region = region if region is not None else get_current_region()
+        deadline = time.time() + self.timeout
+        self.pending[afi_id] = region
+        while afi_id not in self.done:
+            if afi_id in self.failed:
+                raise Exception(
+                    f"Unable to get the state of {afi_id}: {self.failed.pop(afi_id)}"
+                )
+            if not self._poller_alive():
+                self.pending.pop(afi_id, None)
+                raise Exception(
+                    f"AFI status tracker stopped polling while waiting for {afi_id}."
+                )
+            if time.time() > deadline:
+                self.pending.pop(afi_id, None)
+                raise Exception(
+                    f"{afi_id} is still pending after {self.timeout} seconds."
+                )
+            time.sleep(1)
+        return self.done.pop(afi_id)
+
+
+# tracker entered by the current manager task, if any
+_active_tracker = None
+
+
+def wait_on_afi_generation(afi_id, region=None):
+    """Wait until afi_id is no longer pending and return its description.
+    Uses the active AFIStatusTracker if there is one."""
+    if _active_tracker is not None:
+        return _active_tracker.wait_for(afi_id, region)
+    region = region if region is not None else get_current_region()
+    return poll_afi_until_done(afi_id, region)
 
 
 def share_afi_with_users(afi_id, region, useridlist):
     """share the AFI in Region region with users in userlist."""
-    client = boto3.client("ec2", region_name=region)
+    client = region_client(region)
     if "public" in useridlist:
         logging.info("Sharing AGFI publicly.")
         result = client.modify_fpga_image_attribute(
@@ -104,11 +364,13 @@ def get_afi_sharing_ids_from_conf(conf):
 def share_agfi_in_all_regions(agfi_id, useridlist):
     """For the given AGFI, for each fpga region, get the AFI, then share
     with the users in useridlist"""
-    all_fpga_regions = get_fpga_regions()
-    for region in all_fpga_regions:
+
+    def share_in_region(region):
         afi_id = get_afi_for_agfi(agfi_id, region)
         share_afi_with_users(afi_id, region, useridlist)
 
+    run_in_regions(share_in_region, get_fpga_regions())
+
 
 def firesim_tags_to_description(
     build_quintuplet,
@@ -6,11 +6,13 @@ import random
 from absl import logging
 import os
 
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from itertools import chain
 import time
 import sys
 import json
+import socket
 
 import boto3
 import botocore
@@ -18,7 +20,7 @@ from botocore import exceptions
 from fabric.api import local, hide, settings  # type: ignore
 
 # imports needed for python type checking
-from typing import Any, Dict, Optional, List, Sequence
+from typing import Any, Callable, Dict, Iterator, Optional, List, Sequence, Tuple
 from mypy_boto3_ec2.service_resource import Instance as EC2InstanceResource
 from mypy_boto3_ec2.type_defs import FilterTypeDef
 from mypy_boto3_s3.literals import BucketLocationConstraintType
@@ -113,21 +115,24 @@ def valid_aws_configure_creds() -> bool:
     return True
 
 
-def get_localhost_instance_info(url_ext: str) -> Optional[str]:
+def get_localhost_instance_info(
+    url_ext: str, curl_connection_timeout: float = 10
+) -> Optional[str]:
     """Obtain latest instance info from instance metadata service. See
     https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/ec2-instance-metadata.html
     for more info on what can be accessed.
 
     Args:
         url_ext: Part of URL after 169.254.169.254/latest/
+        curl_connection_timeout: Seconds to wait for the metadata service to
+            accept the connection. This takes multiple minutes without a timeout
+            from the CI container. In practice it should resolve nearly instantly
+            on an initialized EC2 instance.
 
     Returns:
         Data obtained in string form or None
     """
     res = None
-    # This takes multiple minutes without a timeout from the CI container. In
-    # practice it should resolve nearly instantly on an initialized EC2 instance.
-    curl_connection_timeout = 10
     with settings(ok_ret_codes=[0, 7, 28]), hide("everything"):
         res = local(
             f"curl -s --connect-timeout {curl_connection_timeout} http://169.254.169.254/latest/{url_ext}",
@@ -467,6 +472,105 @@ def construct_instance_market_options(
         assert False, "INVALID INSTANCE MARKET TYPE."
 
 
+# seconds to wait after a round of launch requests in which no subnet had
+# capacity, doubled after every such round up to LAUNCH_BACKOFF_MAX
+LAUNCH_BACKOFF_INITIAL = 2.0
+LAUNCH_BACKOFF_MAX = 60.0
+
+
+def new_ec2_resource() -> Any:
+    """Return a new EC2 service resource in its own session."""
+    return boto3.session.Session().resource("ec2")
+
+
+def split_launch_count(count: int, num_subnets: int) -> List[int]:
+    """Split count instances as evenly as possible across the first
+    num_subnets subnets. Earlier subnets get the extra instances, subnets that
+    would get none are left out."""
+    base, extra = divmod(count, num_subnets)
+    shares = [base + (1 if i < extra else 0) for i in range(num_subnets)]
+    return [share for share in shares if share > 0]
+
+
+def create_instances_in_subnet(
+    ec2: Any,
+    instance_args: Dict[str, Any],
+    securitygroup: str,
+    subnet_id: str,
+    max_count: int,
+) -> List[EC2InstanceResource]:
+    """Request up to max_count instances in subnet_id with a single call. EC2
+    launches as many as it has capacity for, and raises a ClientError if it
+    can't launch any."""
+    return ec2.create_instances(
+        **instance_args,
+        MinCount=1,
+        MaxCount=max_count,
+        NetworkInterfaces=[
+            {
+                "SubnetId": subnet_id,
+                "DeviceIndex": 0,
+                "AssociatePublicIpAddress": True,
+                "Groups": [securitygroup],
+            }
+        ],
+    )
+
+
+def launch_instances_in_subnets(
+    instance_args: Dict[str, Any],
+    securitygroup: str,
+    subnet_ids: List[str],
+    count: int,
+    ec2_factory: Callable[[], Any] = new_ec2_resource,
+) -> Tuple[List[EC2InstanceResource], List[str]]:
+    """One round of launch requests for count instances: request all of them
+    in the first subnet, then spread what it could not launch across the other
+    subnets, requesting from those concurrently.
+
+    Args:
+        instance_args: Arguments to `ec2.create_instances()`, except for the
+            counts and network interfaces.
+        securitygroup: Security group id of the instances.
+        subnet_ids: Subnets to try, in order.
+        count: Number of instances to launch.
+        ec2_factory: Returns a new EC2 service resource. Resources are not
+            thread safe, so every request gets its own. Tests can pass a
+            stand-in here.
+
+    Returns:
+        The launched instances, and the subnets that had no capacity.
+    """
+    exhausted: List[str] = []
+
+    def launch(subnet_id: str, max_count: int) -> List[EC2InstanceResource]:
+        try:
+            return create_instances_in_subnet(
+                ec2_factory(), instance_args, securitygroup, subnet_id, max_count
+            )
+        except exceptions.ClientError as e:
+            logging.debug(e)
+            logging.debug(
+                f"No capacity for {max_count} instances in {subnet_id}. This probably means there was no more capacity in this availability zone."
+            )
+            exhausted.append(subnet_id)
+            return []
+
+    launched = launch(subnet_ids[0], count)
+
+    shortfall = count - len(launched)
+    others = subnet_ids[1:]
+    if shortfall > 0 and others:
+        shares = split_launch_count(shortfall, len(others))
+        with ThreadPoolExecutor(max_workers=len(shares)) as pool:
+            results = list(pool.map(launch, others[: len(shares)], shares))
+        for result in results:
+            launched += result
+
+    # keep the order of subnet_ids
+    return launched, [s for s in subnet_ids if s in exhausted]
+
+
 def launch_instances(
     instancetype: str,
     count: int,
@@ -487,8 +591,9 @@ def launch_instances(
     Using `instancemarket`, `spotinterruptionbehavior` and `spotmaxprice` to define instance market conditions
     (see also: construct_market_conditions)
 
-    This will launch instances in avail zone 0, then once capacity runs out, zone 1, then zone 2, etc.
-    The ordering of availablility zones can be randomized by passing`randomsubnet=True`
+    This will request all instances in avail zone 0, then spread the ones it could not launch across the other zones,
+    requesting from those concurrently. When no zone has capacity left, requests are retried with exponential backoff
+    until `timeout`. The ordering of availablility zones can be randomized by passing`randomsubnet=True`
 
     Args:
         instancetype: String acceptable by `boto3.ec2.create_instances()` `InstanceType` parameter
@@ -552,9 +657,6 @@ def launch_instances(
     if not blockdevices:
         blockdevices = []
 
-    # starting with the first subnet, keep trying until you get the instances you need
-    startsubnet = 0
-
     if tags and not always_expand:
         instances = instances_sorted_by_avail_ip(
             get_instances_by_tag_type(tags, instancetype)
@@ -575,102 +677,143 @@ def launch_instances(
                 )
             )
 
+    instance_args = {
+        "ImageId": f1_image_id,
+        "EbsOptimized": True,
+        "BlockDeviceMappings": (
+            blockdevices
+            + [
+                {
+                    "DeviceName": "/dev/sdb",
+                    "NoDevice": "",
+                },
+            ]
+        ),
+        "InstanceType": instancetype,
+        "KeyName": keyname,
+        "TagSpecifications": (
+            []
+            if tags is None
+            else [
+                {
+                    "ResourceType": "instance",
+                    "Tags": [{"Key": k, "Value": v} for k, v in tags.items()],
+                },
+            ]
+        ),
+        "InstanceMarketOptions": marketconfig,
+    }
+    if user_data_file:
+        with open(user_data_file, "r") as f:
+            instance_args["UserData"] = "".join(f.readlines())
+
+    return launch_remaining_instances(
+        instance_args,
+        firesimsecuritygroup,
+        [subnet.subnet_id for subnet in subnets],
+        instances,
+        count,
+        instancetype,
+        timeout,
+    )
+
+
+def launch_remaining_instances(
+    instance_args: Dict[str, Any],
+    securitygroup: str,
+    subnet_ids: List[str],
+    instances: List[EC2InstanceResource],
+    count: int,
+    instancetype: str,
+    timeout: timedelta,
+    ec2_factory: Callable[[], Any] = new_ec2_resource,
+) -> List[EC2InstanceResource]:
+    """Launch instances until there are count of them, in rounds of
+    `launch_instances_in_subnets`. Rounds that launch nothing are retried with
+    exponential backoff until timeout.
+
+    Args:
+        instance_args: See `launch_instances_in_subnets`.
+        securitygroup: Security group id of the instances.
+        subnet_ids: Subnets to try, in order.
+        instances: Instances that already exist.
+        count: Total number of instances wanted, including instances.
+        instancetype: Instance type, for log messages.
+        timeout: How long to keep retrying once all subnets are out of capacity.
+        ec2_factory: See `launch_instances_in_subnets`.
+
+    Returns:
+        instances, extended with the instances launched.
+    """
+    # subnets are tried in this order, subnets that ran out of capacity move
+    # to the back
     first_subnet_wraparound = None
+    backoff = LAUNCH_BACKOFF_INITIAL
 
     while len(instances) < count:
-        chosensubnet = subnets[startsubnet].subnet_id
-        try:
-            instance_args = {
-                "ImageId": f1_image_id,
-                "EbsOptimized": True,
-                "BlockDeviceMappings": (
-                    blockdevices
-                    + [
-                        {
-                            "DeviceName": "/dev/sdb",
-                            "NoDevice": "",
-                        },
-                    ]
-                ),
-                "InstanceType": instancetype,
-                "MinCount": 1,
-                "MaxCount": 1,
-                "NetworkInterfaces": [
-                    {
-                        "SubnetId": chosensubnet,
-                        "DeviceIndex": 0,
-                        "AssociatePublicIpAddress": True,
-                        "Groups": [firesimsecuritygroup],
-                    }
-                ],
-                "KeyName": keyname,
-                "TagSpecifications": (
-                    []
-                    if tags is None
-                    else [
-                        {
-                            "ResourceType": "instance",
-                            "Tags": [{"Key": k, "Value": v} for k, v in tags.items()],
-                        },
-                    ]
-                ),
-                "InstanceMarketOptions": marketconfig,
-            }
-            if user_data_file:
-                with open(user_data_file, "r") as f:
-                    instance_args["UserData"] = "".join(f.readlines())
+        launched, exhausted = launch_instances_in_subnets(
+            instance_args,
+            securitygroup,
+            subnet_ids,
+            count - len(instances),
+            ec2_factory,
+        )
+        instances += launched
+        subnet_ids = [s for s in subnet_ids if s not in exhausted] + exhausted
 
-            instance = ec2.create_instances(**instance_args)
-            instances += instance
+        if len(instances) >= count:
+            break
 
-        except client.exceptions.ClientError as e:
-            logging.debug(e)
-            startsubnet += 1
-            if startsubnet < len(subnets):
-                logging.debug(
-                    "This probably means there was no more capacity in this availability zone. Trying the next one."
-                )
-            else:
-                logging.info(
-                    "Tried all subnets, but there was insufficient capacity to launch your instances"
+        if launched:
+            # some subnets still had capacity, ask again right away
+            logging.info(
+                "Launched {} of {} {} instances, requesting the remaining ones".format(
+                    len(instances), count, instancetype
                 )
-                startsubnet = 0
-                if first_subnet_wraparound is None:
-                    # so that we are guaranteed that the default timeout of `timedelta()` aka timedelta(0)
-                    # will cause timeout the very first time, we make the first_subnet_wraparound happen a bit in the
-                    # past
-                    first_subnet_wraparound = datetime.now() - timedelta(microseconds=1)
-
-                time_elapsed = datetime.now() - first_subnet_wraparound
-                logging.info(
-                    "have been trying for {} using timeout of {}".format(
-                        time_elapsed, timeout
-                    )
+            )
+            backoff = LAUNCH_BACKOFF_INITIAL
+            continue
+
+        logging.info(
+            "Tried all subnets, but there was insufficient capacity to launch your instances"
+        )
+        if first_subnet_wraparound is None:
+            # so that we are guaranteed that the default timeout of `timedelta()` aka timedelta(0)
+            # will cause timeout the very first time, we make the first_subnet_wraparound happen a bit in the
+            # past
+            first_subnet_wraparound = datetime.now() - timedelta(microseconds=1)
+
+        time_elapsed = datetime.now() - first_subnet_wraparound
+        logging.info(
+            "have been trying for {} using timeout of {}".format(time_elapsed, timeout)
+        )
+        logging.info(
+            """only {} of {} {} instances have been launched""".format(
+                len(instances), count, instancetype
+            )
+        )
+        if time_elapsed > timeout:
+            logging.fatal(
+                """Aborting! only the following {} instances were launched""".format(
+                    len(instances)
                 )
-                logging.info(
-                    """only {} of {} {} instances have been launched""".format(
-                        len(instances), count, instancetype
-                    )
+            )
+            logging.fatal(instances)
+            logging.fatal(
+                "To continue trying to allocate instances, you can rerun launchrunfarm"
+            )
+            sys.exit(1)
+        else:
+            # jitter keeps concurrent managers from retrying in lockstep
+            delay = backoff * random.uniform(0.5, 1.0)
+            logging.info("Will keep trying after sleeping for {:.0f}s...".format(delay))
+            time.sleep(delay)
+            backoff = min(backoff * 2, LAUNCH_BACKOFF_MAX)
+            logging.info(
+                "Continuing to request remaining {}, {} instances".format(
+                    count - len(instances), instancetype
                 )
-                if time_elapsed > timeout:
-                    logging.fatal(
-                        """Aborting! only the following {} instances were launched""".format(
-                            len(instances)
-                        )
-                    )
-                    logging.fatal(instances)
-                    logging.fatal(
-                        "To continue trying to allocate instances, you can rerun launchrunfarm"
-                    )
-                    sys.exit(1)
-                else:
-                    logging.info("Will keep trying after sleeping for a bit...")
-                    time.sleep(30)
-                    logging.info(
-                        "Continuing to request remaining {}, {} instances".format(
-                            count - len(instances), instancetype
-                        )
-                    )
+            )
     return instances
 
 
@@ -821,14 +964,134 @@ def instance_privateip_lookup_table(
     return {ip: instance for (ip, instance) in ips_to_instances}
 
 
+# seconds between polls of the state of booting instances
+INSTANCE_POLL_INTERVAL = 5
+# seconds to wait for an SSH connection when checking if an instance is reachable
+SSH_PROBE_TIMEOUT = 2.0
+INSTANCE_READY_TIMEOUT = timedelta(minutes=15)
+
+
+def instance_ssh_reachable(ip: str) -> bool:
+    """Return True if ip accepts connections on the SSH port."""
+    try:
+        with socket.create_connection((ip, 22), timeout=SSH_PROBE_TIMEOUT):
+            return True
+    except OSError:
+        return False
+
+
+class InstanceReadinessPoller:
+    """Tracks instances (as returned by create_instances) until they are
+    running and, with wait_for_ssh, accept SSH connections. Each poll queries
+    the state of all instances that are not running yet with a single
+    describe_instances call and never waits, so callers can do other work
+    between polls and start using early instances while later ones are still
+    booting. More instances can be added between polls, each gets its own
+    timeout.
+
+    Attributes:
+        pending: Instances that were not ready yet, by instance id.
+    """
+
+    pending: Dict[str, EC2InstanceResource]
+    wait_for_ssh: bool
+    timeout: timedelta
+
+    def __init__(
+        self,
+        instances: List[EC2InstanceResource],
+        wait_for_ssh: bool = False,
+        timeout: timedelta = INSTANCE_READY_TIMEOUT,
+    ) -> None:
+        self.client = boto3.client("ec2")
+        self.pending = {}
+        self.wait_for_ssh = wait_for_ssh
+        self.timeout = timeout
+        # private ip by instance id
+        self.running: Dict[str, str] = {}
+        self.deadlines: Dict[str, datetime] = {}
+        self.add(instances)
+
+    def add(self, instances: List[EC2InstanceResource]) -> None:
+        """Start tracking more instances."""
+        deadline = datetime.now() + self.timeout
+        for instance in instances:
+            self.pending[instance.id] = instance
+            self.deadlines[instance.id] = deadline
+
+    def poll(self) -> List[EC2InstanceResource]:
+        """Return the instances that became ready since the last poll. Raises
+        if an instance stopped booting, or instances are still pending after
+        the timeout."""
+        booting = [i for i in self.pending if i not in self.running]
+        if booting:
+            try:
+                reservations = depaginated_boto_query(
+                    self.client,
+                    "describe_instances",
+                    {"InstanceIds": booting},
+                    "Reservations",
+                )
+            except exceptions.ClientError as e:
+                # instances can take a moment to show up after they are created
+                logging.debug(e)
+                reservations = []
+            for reservation in reservations:
+                for desc in reservation["Instances"]:
+                    state = desc["State"]["Name"]
+                    if state == "running":
+                        self.running[desc["InstanceId"]] = desc.get(
+                            "PrivateIpAddress", ""
+                        )
+                    elif state != "pending":
+                        raise Exception(
+                            f"Instance {desc['InstanceId']} is {state} instead of booting: {desc.get('StateReason', {}).get('Message')}"
+                        )
+
+        ready = []
+        for instance_id, ip in self.running.items():
+            if instance_id not in self.pending:
+                continue
+            if self.wait_for_ssh and not instance_ssh_reachable(ip):
+                continue
+            instance = self.pending.pop(instance_id)
+            del self.deadlines[instance_id]
+            # refresh the cached attributes (e.g. the public ip), like
+            # wait_until_running does
+            instance.reload()
+            ready.append(instance)
+
+        now = datetime.now()
+        timed_out = sorted(i for i in self.pending if now > self.deadlines[i])
+        if timed_out:
+            raise Exception(
+                f"Timed out after {self.timeout} waiting for instances to boot: {timed_out}"
+            )
+        return ready
+
+
+def iter_ready_instances(
+    instances: List[EC2InstanceResource],
+    wait_for_ssh: bool = False,
+    timeout: timedelta = INSTANCE_READY_TIMEOUT,
+) -> Iterator[EC2InstanceResource]:
+    """Yield instances (as returned by create_instances) as soon as they are
+    ready, see InstanceReadinessPoller."""
+    poller = InstanceReadinessPoller(instances, wait_for_ssh, timeout)
+    while True:
+        yield from poller.poll()
+        if not poller.pending:
+            return
+        time.sleep(INSTANCE_POLL_INTERVAL)
+
+
 def wait_on_instance_launches(
-    instances: List[EC2InstanceResource], message: str = ""
+    instances: List[EC2InstanceResource], message: str = "", wait_for_ssh: bool = False
 ) -> None:
     """Take a list of instances (as returned by create_instances), wait until
-    instance is running."""
+    all instances are running (and with wait_for_ssh, reachable over SSH)."""
     logging.info("Waiting for instance boots: " + str(len(instances)) + " " + message)
-    for instance in instances:
-        instance.wait_until_running()
+    for instance in iter_ready_instances(instances, wait_for_ssh):
         logging.info(str(instance.id) + " booted!")
 
 
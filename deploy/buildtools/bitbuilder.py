@@ -1,13 +1,16 @@
 from __future__ import with_statement, annotations
 
 import abc
+import os
 import yaml
-from absl import logging
-from fabric.api import prefix, local, run, env, lcd, parallel, settings  # type: ignore
+from absl import flags, logging
+from fabric.api import prefix, local, run, env, lcd, parallel, settings, hide  # type: ignore
 from fabric.contrib.console import confirm  # type: ignore
 from fabric.contrib.project import rsync_project  # type: ignore
 
 from buildtools.utils import get_deploy_dir
+from buildtools import bitstream_cache
+from buildtools.build_progress import BuildProgress, BuildProgressLogger
 from utils.streamlogger import InfoStreamLogger
 from utils.export import create_export_string
 from awstools.afitools import firesim_tags_to_description, copy_afi_to_all_regions
@@ -22,11 +25,19 @@ from awstools.awstools import (
 )
 
 # imports needed for python type checking
-from typing import Dict, Any, TYPE_CHECKING
+from typing import Dict, Any, List, Optional, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from buildtools.build_config import BuildConfig
 
+FLAGS = flags.FLAGS
+
+flags.DEFINE_bool(
+    "retrievecheckpoints",
+    False,
+    "For buildbitstream, also copy the Vivado checkpoints of each build back into results-build/.",
+)
+
 
 class BitBuilder(metaclass=abc.ABCMeta):
     """Abstract class to manage how to build a bitstream for a build config.
@@ -34,10 +45,16 @@ class BitBuilder(metaclass=abc.ABCMeta):
     Attributes:
         build_config: Build config to build a bitstream for.
         args: Args (i.e. options) passed to the bitbuilder.
+        RESULTS_MANIFEST: rsync include patterns, relative to the CL_DIR, of
+            the build results copied back from the build host.
+        CHECKPOINTS_MANIFEST: rsync include patterns of the Vivado checkpoints,
+            only copied back with --retrievecheckpoints.
     """
 
     build_config: BuildConfig
     args: Dict[str, Any]
+    RESULTS_MANIFEST: List[str] = ["**"]
+    CHECKPOINTS_MANIFEST: List[str] = []
 
     def __init__(self, build_config: BuildConfig, args: Dict[str, Any]) -> None:
         """
@@ -94,6 +111,158 @@ class BitBuilder(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError
 
+    def run_build_script(self, cl_dir: str, script_args: str) -> Any:
+        """Run build-bitstream.sh in cl_dir on the build host, streaming its
+        output into a BuildProgress of the build.
+
+        Args:
+            cl_dir: Path to the CL_DIR on the build host.
+            script_args: Arguments of build-bitstream.sh.
+
+        Returns:
+            Result of the fabric `run` (the script output and return code).
+        """
+        # the script runs in its own session on the build host, so all of
+        # Vivado can be killed if the run is aborted early
+        sid_file = f"{cl_dir}/.build-bitstream.sid"
+
+        def abort(reason: str) -> None:
+            with hide("everything"), settings(warn_only=True):
+                run(f"pkill -TERM -s $(cat {sid_file})")
+
+        progress = BuildProgress(self.build_config, abort)
+        with BuildProgressLogger(progress), settings(warn_only=True):
+            result = run(
+                f"ps -o sid= -p $$ > {sid_file} && {cl_dir}/build-bitstream.sh {script_args}"
+            )
+        progress.finish(result.return_code == 0)
+        return result
+
+    def get_results_manifest(self) -> List[str]:
+        """rsync include patterns, relative to the CL_DIR, of the build results
+        to copy back from the build host.
+
+        Returns:
+            `RESULTS_MANIFEST`, plus `CHECKPOINTS_MANIFEST` with --retrievecheckpoints.
+        """
+        patterns = list(self.RESULTS_MANIFEST)
+        if FLAGS.retrievecheckpoints:
+            patterns += self.CHECKPOINTS_MANIFEST
+        return patterns
+
+    def copy_back_results(self, cl_dir: str, local_results_dir: str) -> None:
+        """Copy the build results listed in the manifests from the CL_DIR on
+        the build host into local_results_dir, which gets a directory named
+        like the CL_DIR. Everything else (e.g. the Vivado project) stays on
+        the build host.
+
+        Args:
+            cl_dir: Path to the CL_DIR on the build host.
+            local_results_dir: Local results-build directory of the build.
+        """
+        patterns = self.get_results_manifest()
+        # patterns are anchored at the CL_DIR, the top directory of the transfer
+        cl_dir_name = os.path.basename(cl_dir.rstrip("/"))
+        filters = (
+            ["--include='*/'"]
+            + [f"--include='/{cl_dir_name}/{pattern}'" for pattern in patterns]
+            + ["--exclude='*'", "--prune-empty-dirs"]
+        )
+
+        rsync_cap = rsync_project(
+            local_dir=f"{local_results_dir}/",
+            remote_dir=cl_dir,
+            ssh_opts="-o StrictHostKeyChecking=no",
+            upload=False,
+            extra_opts=" ".join(["-l"] + filters),
+            capture=True,
+        )
+        logging.debug(rsync_cap)
+        logging.debug(rsync_cap.stderr)
+
+    def get_cache_inputs(
+        self,
+    ) -> Optional[Tuple[List[bitstream_cache.BuildInput], Dict[str, str]]]:
+        """Local files/directories that `build_bitstream` copies to the build
+        host, and the build-bitstream.sh options, which together determine the
+        result of `build_bitstream` once `replace_rtl` ran.
+
+        Returns:
+            Inputs and options, or `None` if builds of this platform are not cached.
+        """
+        return None
+
+    def get_cache_key(self) -> Optional[str]:
+        """Key of the build in the bitstream cache, see `get_cache_inputs`.
+
+        Returns:
+            Hash of the build inputs, or `None` if the build is not cached,
+            also if one of its inputs is missing.
+        """
+        inputs = self.get_cache_inputs()
+        if inputs is None:
+            return None
+        build_inputs, params = inputs
+        params = dict(
+            params,
+            platform=self.build_config.PLATFORM,
+            build_quintuplet=self.build_config.get_chisel_quintuplet(),
+            deploy_quintuplet=self.build_config.get_effective_deploy_quintuplet(),
+        )
+        try:
+            return bitstream_cache.hash_build_inputs(build_inputs, params)
+        except FileNotFoundError as e:
+            logging.warning(f"Not caching the build of {self.build_config.name}: {e}")
+            return None
+
+    def restore_cached_bitstream(self) -> bool:
+        """If an identical build is in the bitstream cache, write its hwdb entry
+        for this build config instead of building. Should run on the manager
+        host after `replace_rtl`.
+
+        Returns:
+            Boolean indicating if the build was found in the cache.
+        """
+        key = self.get_cache_key()
+        if key is None:
+            return False
+        hwdb = bitstream_cache.lookup(key)
+        if hwdb is None:
+            logging.info(f"No cached bitstream for {self.build_config.name}.")
+            return False
+
+        hwdb_entry_name = self.build_config.name
+        hwdb_entry = hwdb_entry_name + ":\n"
+        for field, value in hwdb.items():
+            hwdb_entry += f"    {field}: {value}\n"
+        hwdb_entry += "    deploy_quintuplet_override: null\n"
+        hwdb_entry += "    custom_runtime_config: null\n"
+
+        hwdb_entry_file_location = f"{get_deploy_dir()}/built-hwdb-entries/"
+        local("mkdir -p " + hwdb_entry_file_location)
+        with open(hwdb_entry_file_location + "/" + hwdb_entry_name, "w") as outputfile:
+            outputfile.write(hwdb_entry)
+
+        logging.info(
+            f"Found an identical build of {hwdb_entry_name} in the bitstream cache, skipping its bitstream build. See {os.path.join(hwdb_entry_file_location, hwdb_entry_name)}."
+        )
+        return True
+
+    def store_cached_bitstream(
+        self, hwdb: Dict[str, str], files: Optional[List[str]] = None
+    ) -> None:
+        """Add the result of a passed build to the bitstream cache. Should run
+        on the manager host.
+
+        Args:
+            hwdb: Fields of the hwdb entry of the result, see `bitstream_cache.store`.
+            files: Local files the hwdb fields refer to.
+        """
+        key = self.get_cache_key()
+        if key is None:
+            return
+        bitstream_cache.store(key, self.build_config.name, hwdb, files)
+
     def get_metadata_string(self) -> str:
         """Standardized metadata format used across different FPGA platforms"""
         # construct the "tags" we store in the metadata description
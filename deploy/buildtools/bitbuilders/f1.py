@@ -2,7 +2,6 @@ from __future__ import with_statement, annotations
 
 import yaml
 import json
-import time
 import random
 import string
 from absl import logging
@@ -13,9 +12,14 @@ from fabric.contrib.project import rsync_project  # type: ignore
 
 from buildtools.bitbuilder import BitBuilder
 from buildtools.utils import get_deploy_dir
+from buildtools import bitstream_cache
 from utils.streamlogger import InfoStreamLogger
 from utils.export import create_export_string
-from awstools.afitools import firesim_tags_to_description, copy_afi_to_all_regions
+from awstools.afitools import (
+    firesim_tags_to_description,
+    copy_afi_to_all_regions,
+    wait_on_afi_generation,
+)
 from awstools.awstools import (
     send_firesim_notification,
     get_aws_userid,
@@ -27,7 +31,7 @@ from awstools.awstools import (
 )
 
 # imports needed for python type checking
-from typing import Optional, Dict, Any, TYPE_CHECKING
+from typing import Optional, Dict, Any, List, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from buildtools.build_config import BuildConfig
@@ -41,6 +45,15 @@ class F1BitBuilder(BitBuilder):
     """
 
     s3_bucketname: str
+    RESULTS_MANIFEST: List[str] = [
+        # tarball submitted for AGFI creation
+        "build/checkpoints/to_aws/**",
+        "build/reports/**",
+        "**.log",
+        # generated verilog the build used
+        "design/**",
+    ]
+    CHECKPOINTS_MANIFEST: List[str] = ["build/checkpoints/**"]
 
     def __init__(self, build_config: BuildConfig, args: Dict[str, Any]) -> None:
         super().__init__(build_config, args)
@@ -64,6 +77,27 @@ class F1BitBuilder(BitBuilder):
         # check to see email notifications can be subscribed
         get_snsname_arn()
 
+    def get_cache_inputs(
+        self,
+    ) -> Optional[Tuple[List[bitstream_cache.BuildInput], Dict[str, str]]]:
+        # what cl_dir_setup and build_bitstream copy to the build host
+        local_awsfpga_dir = f"{get_deploy_dir()}/../platforms/f1/aws-fpga"
+        local_cl_dir = f"{local_awsfpga_dir}/hdk/cl/developer_designs/cl_{self.build_config.get_chisel_quintuplet()}"
+        build_inputs = [
+            bitstream_cache.BuildInput(
+                local_awsfpga_dir, exclude=["hdk/cl/developer_designs/cl_*"]
+            ),
+            bitstream_cache.BuildInput(local_cl_dir, exclude=["build/checkpoints"]),
+            bitstream_cache.BuildInput(
+                f"{get_deploy_dir()}/../platforms/f1/build-bitstream.sh"
+            ),
+        ]
+        params = {
+            "frequency": str(self.build_config.get_frequency()),
+            "strategy": self.build_config.get_strategy().name,
+        }
+        return build_inputs, params
+
     def cl_dir_setup(self, chisel_quintuplet: str, dest_build_dir: str) -> str:
         """Setup CL_DIR on build host.
 
@@ -176,29 +210,19 @@ class F1BitBuilder(BitBuilder):
         fpga_frequency = self.build_config.get_frequency()
         build_strategy = self.build_config.get_strategy().name
 
-        with InfoStreamLogger("stdout"), settings(warn_only=True):
-            vivado_result = run(
-                f"{cl_dir}/build-bitstream.sh --cl_dir {cl_dir} --frequency {fpga_frequency} --strategy {build_strategy}"
-            )
-            vivado_rc = vivado_result.return_code
+        vivado_result = self.run_build_script(
+            cl_dir,
+            f"--cl_dir {cl_dir} --frequency {fpga_frequency} --strategy {build_strategy}",
+        )
+        vivado_rc = vivado_result.return_code
 
-            if vivado_result != 0:
-                logging.info("Printing error output:")
-                for line in vivado_result.splitlines()[-100:]:
-                    logging.info(line)
+        if vivado_rc != 0:
+            logging.info("Printing error output:")
+            for line in vivado_result.splitlines()[-100:]:
+                logging.info(line)
 
         # put build results in the result-build area
-
-        rsync_cap = rsync_project(
-            local_dir=f"{local_results_dir}/",
-            remote_dir=cl_dir,
-            ssh_opts="-o StrictHostKeyChecking=no",
-            upload=False,
-            extra_opts="-l",
-            capture=True,
-        )
-        logging.debug(rsync_cap)
-        logging.debug(rsync_cap.stderr)
+        self.copy_back_results(cl_dir, local_results_dir)
 
         if vivado_rc != 0:
             on_build_failure()
@@ -208,6 +232,10 @@ class F1BitBuilder(BitBuilder):
             on_build_failure()
             return False
 
+        with open(f"{local_results_dir}/AGFI_INFO") as f:
+            agfi = json.load(f)["FpgaImages"][0]["FpgaImageGlobalId"]
+        self.store_cached_bitstream({"agfi": agfi})
+
         build_farm.release_build_host(self.build_config)
 
         return True
@@ -274,17 +302,11 @@ class F1BitBuilder(BitBuilder):
             logging.info("Resulting AFI: " + str(afi))
 
         logging.info("Waiting for create-fpga-image completion.")
-        checkstate = "pending"
-        with lcd(local_results_dir):
-            while checkstate == "pending":
-                imagestate = local(
-                    f"aws ec2 describe-fpga-images --fpga-image-id {afi} | tee AGFI_INFO",
-                    capture=True,
-                )
-                state_as_dict = json.loads(imagestate)
-                checkstate = state_as_dict["FpgaImages"][0]["State"]["Code"]
-                logging.info("Current state: " + str(checkstate))
-                time.sleep(10)
+        image = wait_on_afi_generation(afi)
+        checkstate = image["State"]["Code"]
+        logging.info("Current state: " + str(checkstate))
+        with open(f"{local_results_dir}/AGFI_INFO", "w") as f:
+            json.dump({"FpgaImages": [image]}, f, indent=4, default=str)
 
         if checkstate == "available":
             # copy the image to all regions for the current user
@@ -9,6 +9,7 @@ from fabric.contrib.project import rsync_project  # type: ignore
 
 from buildtools.bitbuilder import BitBuilder
 from buildtools.utils import get_deploy_dir
+from buildtools import bitstream_cache
 from utils.streamlogger import InfoStreamLogger
 from utils.export import create_export_string
 from awstools.afitools import firesim_tags_to_description, copy_afi_to_all_regions
@@ -23,7 +24,7 @@ from awstools.awstools import (
 )
 
 # imports needed for python type checking
-from typing import Optional, Dict, Any, TYPE_CHECKING
+from typing import Optional, Dict, Any, List, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from buildtools.build_config import BuildConfig
@@ -33,6 +34,16 @@ class XilinxAlveoBitBuilder(BitBuilder):
     """Bit builder class that builds a Xilinx Alveo bitstream from the build config."""
 
     BOARD_NAME: Optional[str]
+    # where replace_rtl puts the generated RTL, relative to the CL_DIR
+    DELIVERY_DIR: str = "design"
+    RESULTS_MANIFEST: List[str] = [
+        "vivado_proj/firesim.bit",
+        "vivado_proj/firesim.mcs",
+        "vivado_proj/firesim_secondary.mcs",
+        "vivado_proj/reports/**",
+        "**.log",
+    ]
+    CHECKPOINTS_MANIFEST: List[str] = ["**.dcp"]
 
     def __init__(self, build_config: BuildConfig, args: Dict[str, Any]) -> None:
         super().__init__(build_config, args)
@@ -41,6 +52,35 @@ class XilinxAlveoBitBuilder(BitBuilder):
     def setup(self) -> None:
         return
 
+    def get_results_manifest(self) -> List[str]:
+        # also keep the generated verilog the build used
+        return super().get_results_manifest() + [f"{self.DELIVERY_DIR}/**"]
+
+    def get_local_board_dir(self) -> str:
+        """Local directory holding the cl_firesim template and the CL_DIR of each quintuplet."""
+        return f"{get_deploy_dir()}/../platforms/{self.build_config.PLATFORM}"
+
+    def get_cache_inputs(
+        self,
+    ) -> Optional[Tuple[List[bitstream_cache.BuildInput], Dict[str, str]]]:
+        # what cl_dir_setup and build_bitstream copy to the build host
+        board_dir = self.get_local_board_dir()
+        build_inputs = [
+            bitstream_cache.BuildInput(board_dir, exclude=["cl_*"]),
+            bitstream_cache.BuildInput(
+                f"{board_dir}/cl_{self.build_config.get_chisel_quintuplet()}"
+            ),
+            bitstream_cache.BuildInput(
+                f"{get_deploy_dir()}/../platforms/{self.build_config.PLATFORM}/build-bitstream.sh"
+            ),
+        ]
+        params = {
+            "frequency": str(self.build_config.get_frequency()),
+            "strategy": self.build_config.get_strategy().name,
+            "board": str(self.BOARD_NAME),
+        }
+        return build_inputs, params
+
     def cl_dir_setup(self, chisel_quintuplet: str, dest_build_dir: str) -> str:
         """Setup CL_DIR on build host.
 
@@ -153,29 +193,19 @@ class XilinxAlveoBitBuilder(BitBuilder):
         fpga_frequency = self.build_config.get_frequency()
         build_strategy = self.build_config.get_strategy().name
 
-        with InfoStreamLogger("stdout"), settings(warn_only=True):
-            alveo_result = run(
-                f"{cl_dir}/build-bitstream.sh --cl_dir {cl_dir} --frequency {fpga_frequency} --strategy {build_strategy} --board {self.BOARD_NAME}"
-            )
-            alveo_rc = alveo_result.return_code
+        alveo_result = self.run_build_script(
+            cl_dir,
+            f"--cl_dir {cl_dir} --frequency {fpga_frequency} --strategy {build_strategy} --board {self.BOARD_NAME}",
+        )
+        alveo_rc = alveo_result.return_code
 
-            if alveo_rc != 0:
-                logging.info("Printing error output:")
-                for line in alveo_result.splitlines()[-100:]:
-                    logging.info(line)
+        if alveo_rc != 0:
+            logging.info("Printing error output:")
+            for line in alveo_result.splitlines()[-100:]:
+                logging.info(line)
 
         # put build results in the result-build area
-
-        rsync_cap = rsync_project(
-            local_dir=f"{local_results_dir}/",
-            remote_dir=cl_dir,
-            ssh_opts="-o StrictHostKeyChecking=no",
-            upload=False,
-            extra_opts="-l",
-            capture=True,
-        )
-        logging.debug(rsync_cap)
-        logging.debug(rsync_cap.stderr)
+        self.copy_back_results(cl_dir, local_results_dir)
 
         if alveo_rc != 0:
             on_build_failure()
@@ -227,6 +257,11 @@ class XilinxAlveoBitBuilder(BitBuilder):
         with open(hwdb_entry_file_location + "/" + hwdb_entry_name, "w") as outputfile:
             outputfile.write(hwdb_entry)
 
+        self.store_cached_bitstream(
+            {"bitstream_tar": f"file://{{cache_dir}}/{tar_name}"},
+            [f"{local_cl_dir}/{tar_name}"],
+        )
+
         if self.build_config.post_build_hook:
             localcap = local(
                 f"{self.build_config.post_build_hook} {local_results_dir}", capture=True
@@ -270,6 +305,9 @@ class XilinxVCU118BitBuilder(XilinxAlveoBitBuilder):
         super().__init__(build_config, args)
         self.BOARD_NAME = "xilinx_vcu118"
 
+    def get_local_board_dir(self) -> str:
+        return f"{get_deploy_dir()}/../platforms/{self.build_config.PLATFORM}/garnet-firesim"
+
     def cl_dir_setup(self, chisel_quintuplet: str, dest_build_dir: str) -> str:
         """Setup CL_DIR on build host.
 
@@ -323,11 +361,15 @@ class RHSResearchNitefuryIIBitBuilder(XilinxAlveoBitBuilder):
     """Bit builder class that builds an RHS Research Nitefury II bitstream from the build config."""
 
     BOARD_NAME: Optional[str]
+    DELIVERY_DIR: str = "Nitefury-II/project/project.srcs/sources_1/imports/HDL"
 
     def __init__(self, build_config: BuildConfig, args: Dict[str, Any]) -> None:
         super().__init__(build_config, args)
         self.BOARD_NAME = "rhsresearch_nitefury_ii"
 
+    def get_local_board_dir(self) -> str:
+        return f"{get_deploy_dir()}/../platforms/{self.build_config.PLATFORM}/NiteFury-and-LiteFury-firesim/Sample-Projects/Project-0"
+
     def cl_dir_setup(self, chisel_quintuplet: str, dest_build_dir: str) -> str:
         """Setup CL_DIR on build host.
 
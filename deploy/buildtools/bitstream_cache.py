@@ -0,0 +1,163 @@
+""" Content-addressed cache of bitstream builds. A build is keyed by the hash
+of everything that goes into its Vivado run: the files copied to the build host
+(the platform build scripts and board files, and the FPGA build directory with
+the generated RTL and constraints), and the options given to
+build-bitstream.sh. A later build with the same key reuses the
+cached bitstream (or AGFI) instead of running Vivado again. """
+
+from __future__ import annotations
+
+from absl import flags, logging
+from dataclasses import dataclass, field
+import fnmatch
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+from buildtools.utils import get_deploy_dir
+
+from typing import Dict, List, Optional
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_bool(
+    "bitstreamcache",
+    True,
+    "For buildbitstream, reuse the result of an earlier build whose generated RTL, build scripts and build options are identical instead of running Vivado again. Use --nobitstreamcache to always rebuild.",
+)
+
+CACHE_DIR_NAME = "bitstream-cache"
+CACHE_ENTRY_FILE = "entry.json"
+
+# files rewritten by the build flow that do not change the bitstream
+IGNORED_FILE_NAMES = {"repo_state", "stamp"}
+
+HASH_CHUNK_BYTES = 1 << 20
+
+
+def get_cache_dir() -> str:
+    return f"{get_deploy_dir()}/{CACHE_DIR_NAME}"
+
+
+@dataclass
+class BuildInput:
+    """A local file or directory copied to the build host.
+
+    Attributes:
+        path: Local path.
+        exclude: rsync exclude patterns of the copy. Patterns with a "/" match
+            paths relative to path, the others match file and directory names.
+    """
+
+    path: str
+    exclude: List[str] = field(default_factory=list)
+
+    def excludes(self, relpath: str) -> bool:
+        name = os.path.basename(relpath)
+        return any(
+            fnmatch.fnmatch(relpath if "/" in pattern else name, pattern)
+            for pattern in self.exclude
+        )
+
+    def files(self) -> List[str]:
+        """Files copied from path, in a stable order. Symlinks are followed."""
+        if not os.path.isdir(self.path):
+            return [self.path]
+        files = []
+        for root, dirs, names in os.walk(self.path, followlinks=True):
+            rel_root = os.path.relpath(root, self.path)
+            dirs[:] = sorted(
+                d
+                for d in dirs
+                if not self.excludes(os.path.normpath(os.path.join(rel_root, d)))
+            )
+            files += [
+                os.path.join(root, n)
+                for n in sorted(names)
+                if n not in IGNORED_FILE_NAMES
+                and not self.excludes(os.path.normpath(os.path.join(rel_root, n)))
+            ]
+        return files
+
+
+def hash_build_inputs(inputs: List[BuildInput], params: Dict[str, str]) -> str:
+    """Hash the contents of inputs and params into a cache key.
+
+    Args:
+        inputs: Local files and directories that go into the build.
+        params: Build options, e.g. frequency and strategy.
+
+    Returns:
+        Hex digest used as the cache key.
+
+    Raises:
+        FileNotFoundError: An input does not exist.
+    """
+    h = hashlib.sha256()
+    for key in sorted(params):
+        h.update(f"param {key}={params[key]}\n".encode())
+    for index, build_input in enumerate(inputs):
+        if not os.path.exists(build_input.path):
+            raise FileNotFoundError(f"Missing build input {build_input.path}")
+        h.update(f"input {index}\n".encode())
+        for f in build_input.files():
+            h.update(f"file {os.path.relpath(f, build_input.path)}\n".encode())
+            with open(f, "rb") as infile:
+                for chunk in iter(lambda: infile.read(HASH_CHUNK_BYTES), b""):
+                    h.update(chunk)
+    return h.hexdigest()
+
+
+def lookup(key: str) -> Optional[Dict[str, str]]:
+    """Return the hwdb fields cached under key, or None on a miss."""
+    if not FLAGS.bitstreamcache:
+        return None
+    entry_path = f"{get_cache_dir()}/{key}/{CACHE_ENTRY_FILE}"
+    if not os.path.exists(entry_path):
+        return None
+    with open(entry_path) as f:
+        return json.load(f)["hwdb"]
+
+
+def store(
+    key: str, build_name: str, hwdb: Dict[str, str], files: Optional[List[str]] = None
+) -> None:
+    """Cache the result of a build under key. files are copied into the
+    cache, and hwdb fields may refer to them with "{cache_dir}", which is
+    replaced by the cache directory of the entry.
+
+    Args:
+        key: Cache key of the build, see `hash_build_inputs`.
+        build_name: Name of the build that produced the result.
+        hwdb: Fields of the hwdb entry of the result (e.g. agfi, bitstream_tar).
+        files: Local files to keep along with the entry.
+    """
+    if not FLAGS.bitstreamcache:
+        return
+
+    cache_dir = get_cache_dir()
+    entry_dir = f"{cache_dir}/{key}"
+    os.makedirs(cache_dir, exist_ok=True)
+    # builds finishing at the same time may store the same key, so stage the
+    # entry and move it into place in one step
+    staging_dir = tempfile.mkdtemp(dir=cache_dir, prefix=f".{key}-")
+    for f in files or []:
+        shutil.copy(f, staging_dir)
+    with open(f"{staging_dir}/{CACHE_ENTRY_FILE}", "w") as outfile:
+        json.dump(
+            {
+                "build_name": build_name,
+                "hwdb": {k: v.format(cache_dir=entry_dir) for k, v in hwdb.items()},
+            },
+            outfile,
+            indent=4,
+        )
+    try:
+        os.rename(staging_dir, entry_dir)
+    except OSError:
+        shutil.rmtree(staging_dir)
+        logging.info(f"Bitstream cache already has an entry for {build_name}.")
+    else:
+        logging.info(f"Cached result of {build_name} in {entry_dir}.")
@@ -2,7 +2,6 @@ from __future__ import annotations
 
 from time import strftime, gmtime
 import pprint
-from absl import logging
 import yaml
 from absl import flags
 
@@ -16,7 +15,7 @@ from buildtools.build_farms.ec2 import AWSEC2
 from utils.deepmerge import deep_merge
 
 # imports needed for python type checking
-from typing import List, Set, TYPE_CHECKING
+from typing import List, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from absl.flags import FlagValues
@@ -57,7 +56,6 @@ class BuildConfigFile:
         acctids_to_sharewith: List of AWS account names to share AGFIs with.
         hwdb: Object holding all HWDB entries.
         builds_list: List of build recipe names to build.
-        build_ip_set: List of IPs to use for builds.
         num_builds: Number of builds to run.
         build_farm: Build farm used to host builds.
         build_config_file_path: Path to build config file
@@ -69,7 +67,6 @@ class BuildConfigFile:
     acctids_to_sharewith: List[str]
     hwdb: RuntimeHWDB
     builds_list: List[BuildConfig]
-    build_ip_set: Set[str]
     num_builds: int
     build_farm: BuildFarm
     build_config_file_path: str
@@ -122,7 +119,6 @@ class BuildConfigFile:
         self.hwdb = RuntimeHWDB(FLAGS.hwdbconfigfile)
 
         self.builds_list = list(map(lambda x: build_recipes[x], builds_to_run_list))
-        self.build_ip_set = set()
 
         # retrieve the build host section
 
@@ -159,43 +155,12 @@ class BuildConfigFile:
         for build in self.builds_list:
             build.bitbuilder.setup()
 
-    def request_build_hosts(self) -> None:
-        """Launch an instance for the builds. Exits the program if an IP address is reused."""
-        for build in self.builds_list:
-            self.build_farm.request_build_host(build)
-
-    def wait_on_build_host_initializations(self) -> None:
-        """Block until all build instances are initialized."""
-        for build in self.builds_list:
-            self.build_farm.wait_on_build_host_initialization(build)
-
-            ip = self.build_farm.get_build_host_ip(build)
-            if ip in self.build_ip_set:
-                error_msg = f"ERROR: Duplicate {ip} IP used when launching instance."
-                logging.fatal(error_msg)
-                self.release_build_hosts()
-                raise Exception(error_msg)
-            else:
-                self.build_ip_set.add(ip)
-
     def release_build_hosts(self) -> None:
         """Terminate all build instances that are launched."""
         for build in self.builds_list:
-            self.build_farm.release_build_host(build)
-
-    def get_build_by_ip(self, nodeip: str) -> BuildConfig:
-        """Obtain the build config for a particular IP address.
-
-        Args:
-            nodeip: IP address of build config wanted
-
-        Returns:
-            BuildConfig for `nodeip`. Returns `None` if `nodeip` is not found.
-        """
-        for build in self.builds_list:
-            if self.build_farm.get_build_host_ip(build) == nodeip:
-                return build
-        assert False, f"Unable to find build config associated with {nodeip}"
+            # builds only get a build host once they are ready to run
+            if any(h.build_config == build for h in self.build_farm.build_hosts):
+                self.build_farm.release_build_host(build)
 
     def __repr__(self) -> str:
         return f"< {type(self)}(file={FLAGS.buildconfigfile!r}, recipes={FLAGS.buildrecipesconfigfile!r}, build_farm={self.build_farm!r}) @{id(self)} >"
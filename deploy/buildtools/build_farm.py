@@ -83,6 +83,47 @@ class BuildFarm(metaclass=abc.ABCMeta):
         """
         return
 
+    def poll_build_host_initializations(
+        self, build_configs: List[BuildConfig]
+    ) -> List[BuildConfig]:
+        """Check which of the requested build hosts of build_configs are
+        launched and ready to be used. Build farms that can check all of them
+        at once do so without waiting, the others wait on each build host in
+        turn.
+
+        Args:
+            build_configs: Build configs used to find build hosts that must be ready.
+
+        Returns:
+            The build configs whose build host is ready.
+        """
+        for build_config in build_configs:
+            self.wait_on_build_host_initialization(build_config)
+        return list(build_configs)
+
+    def assign_build_host(self, build_config: BuildConfig) -> bool:
+        """Bind build config to a build host that can start its build now.
+        Called in the manager process right before the build is dispatched.
+        By default every build has its own build host from `request_build_host`.
+
+        Args:
+            build_config: Build config to find a build host for.
+
+        Returns:
+            False if all build hosts are busy and the build must wait for
+            another build to finish.
+        """
+        return True
+
+    def finish_build(self, build_config: BuildConfig) -> None:
+        """Record (in the manager process) that the build of build config
+        finished, so that its build host can take the next build.
+
+        Args:
+            build_config: Build config whose build finished.
+        """
+        return
+
     def get_build_host(self, build_config: BuildConfig) -> Any:  # Use Any for now
         """Get build host associated with the build config.
 
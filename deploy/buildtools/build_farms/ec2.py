@@ -6,6 +6,7 @@ from awstools.awstools import (
     aws_resource_names,
     launch_instances,
     wait_on_instance_launches,
+    InstanceReadinessPoller,
     get_instance_ids_for_instances,
     terminate_instances,
 )
@@ -14,7 +15,7 @@ from buildtools.build_hosts.ec2 import EC2BuildHost
 from buildtools.build_config import BuildConfig
 
 # imports needed for python type checking
-from typing import cast, Any, Dict
+from typing import cast, Any, Dict, List, Optional
 from mypy_boto3_ec2.service_resource import Instance as EC2InstanceResource
 
 
@@ -27,6 +28,9 @@ class AWSEC2(BuildFarm):
         build_instance_market: instance market type
         spot_interruption_behavior: if spot instance, the interruption behavior
         spot_max_price: if spot instance, the max price
+        running_ips: Builds running on each launched instance, by IP address.
+        readiness: Polls the instances of requested build hosts until they
+            accept SSH connections. None until the first build host is requested.
     """
 
     build_farm_tag: str
@@ -34,6 +38,8 @@ class AWSEC2(BuildFarm):
     build_instance_market: str
     spot_interruption_behavior: str
     spot_max_price: str
+    running_ips: Dict[str, BuildConfig]
+    readiness: Optional[InstanceReadinessPoller]
 
     def __init__(self, args: Dict[str, Any]) -> None:
         """
@@ -41,6 +47,8 @@ class AWSEC2(BuildFarm):
             args: Args (i.e. options) passed to the build farm.
         """
         super().__init__(args)
+        self.running_ips = {}
+        self.readiness = None
 
         self._parse_args()
 
@@ -106,6 +114,18 @@ class AWSEC2(BuildFarm):
             )
         )
 
+        ip = inst_obj.private_ip_address
+        if ip in self.running_ips:
+            error_msg = f"ERROR: Duplicate {ip} IP used when launching instance for {build_config.name} (already used by {self.running_ips[ip].name})."
+            logging.error(error_msg)
+            self.release_build_host(build_config)
+            raise Exception(error_msg)
+        self.running_ips[ip] = build_config
+
+        if self.readiness is None:
+            self.readiness = InstanceReadinessPoller([], wait_for_ssh=True)
+        self.readiness.add([inst_obj])
+
     def wait_on_build_host_initialization(self, build_config: BuildConfig) -> None:
         """Wait for EC2 instance launch.
 
@@ -113,9 +133,49 @@ class AWSEC2(BuildFarm):
             build_config: Build config used to find build host that must ready.
         """
         build_host = cast(EC2BuildHost, self.get_build_host(build_config))
-        wait_on_instance_launches([build_host.launched_instance_object])
+        wait_on_instance_launches(
+            [build_host.launched_instance_object],
+            f"for {build_config.name}",
+            wait_for_ssh=True,
+        )
         build_host.ip_address = build_host.launched_instance_object.private_ip_address
 
+    def poll_build_host_initializations(
+        self, build_configs: List[BuildConfig]
+    ) -> List[BuildConfig]:
+        """Check the EC2 instances of all requested build hosts with a single
+        query, without waiting.
+
+        Args:
+            build_configs: Build configs used to find build hosts that must be ready.
+
+        Returns:
+            The build configs whose build host is ready.
+        """
+        if self.readiness is not None:
+            for instance in self.readiness.poll():
+                for build_host in self.build_hosts:
+                    if build_host.launched_instance_object.id == instance.id:
+                        build_host.ip_address = instance.private_ip_address
+                        logging.info(
+                            f"Build instance {instance.id} for {build_host.build_config.name} booted!"
+                        )
+        return [
+            build_config
+            for build_config in build_configs
+            if self.get_build_host(build_config).ip_address is not None
+        ]
+
+    def finish_build(self, build_config: BuildConfig) -> None:
+        """Forget the IP address of the instance of build config, which may
+        be reused by instances launched later.
+
+        Args:
+            build_config: Build config whose build finished.
+        """
+        build_host = cast(EC2BuildHost, self.get_build_host(build_config))
+        self.running_ips.pop(build_host.launched_instance_object.private_ip_address)
+
     def release_build_host(self, build_config: BuildConfig) -> None:
         """Terminate the EC2 instance running this build.
 
@@ -5,17 +5,27 @@ from buildtools.build_farm import BuildHost, BuildFarm
 from buildtools.build_config import BuildConfig
 
 # imports needed for python type checking
-from typing import Any, Dict
+from typing import Any, Dict, List, Tuple
 
 
 class ExternallyProvisioned(BuildFarm):
     """Build farm that selects from a set of user-determined IPs to allocate a new build host.
 
+    Builds are queued onto the hosts: each host runs up to its
+    `max_concurrent_builds` builds at once, and takes the next queued build
+    when one of its builds finishes.
+
     Attributes:
-        build_hosts_allocated: Count of build hosts assigned with builds (`BuildConfig`s).
+        host_pool: Build hosts given by the user (not bound to builds).
+        max_concurrent_builds: Number of builds each host can run at once, by IP address.
+        running_builds: Builds running on each host, by IP address.
+        last_platform: Platform of the last build dispatched to each host, by IP address.
     """
 
-    build_hosts_allocated: int
+    host_pool: List[BuildHost]
+    max_concurrent_builds: Dict[str, int]
+    running_builds: Dict[str, List[BuildConfig]]
+    last_platform: Dict[str, str]
 
     def __init__(self, args: Dict[str, Any]) -> None:
         """
@@ -28,7 +38,10 @@ class ExternallyProvisioned(BuildFarm):
 
     def _parse_args(self) -> None:
         """Parse build host arguments."""
-        self.build_hosts_allocated = 0
+        self.host_pool = []
+        self.max_concurrent_builds = {}
+        self.running_builds = {}
+        self.last_platform = {}
 
         build_farm_hosts_key = "build_farm_hosts"
         build_farm_hosts_list = self.args[build_farm_hosts_key]
@@ -49,11 +62,13 @@ class ExternallyProvisioned(BuildFarm):
                 ip_addr, ip_args = next(iter(items))
 
                 dest_build_dir = ip_args.get("override_build_dir", default_build_dir)
+                max_concurrent_builds = int(ip_args.get("max_concurrent_builds", 1))
             elif type(build_farm_host) is str:
                 # add element w/ defaults
 
                 ip_addr = build_farm_host
                 dest_build_dir = default_build_dir
+                max_concurrent_builds = 1
             else:
                 raise Exception(
                     f"""Unexpected YAML type provided in "{build_farm_hosts_key}" list. Must be dict or str."""
@@ -62,28 +77,38 @@ class ExternallyProvisioned(BuildFarm):
             if not dest_build_dir:
                 raise Exception("ERROR: Invalid null build dir")
 
-            self.build_hosts.append(
+            if ip_addr in self.max_concurrent_builds:
+                raise Exception(
+                    f"""Build farm host {ip_addr} is listed more than once in "{build_farm_hosts_key}". Use "max_concurrent_builds" to run several builds on it at once."""
+                )
+            if max_concurrent_builds < 1:
+                raise Exception(
+                    f"""Invalid "max_concurrent_builds" for build farm host {ip_addr}: {max_concurrent_builds}"""
+                )
+
+            self.host_pool.append(
                 BuildHost(ip_address=ip_addr, dest_build_dir=dest_build_dir)
             )
+            self.max_concurrent_builds[ip_addr] = max_concurrent_builds
+            self.running_builds[ip_addr] = []
 
     def request_build_host(self, build_config: BuildConfig) -> None:
-        """Request build host to use for build config. Just assigns build config to build host since IP address
-        is already granted by something outside of FireSim."
+        """Request build host to use for build config. Nothing to do since IP addresses are already granted by
+        something outside of FireSim. The build is bound to a host once one is free (see `assign_build_host`).
 
         Args:
             build_config: Build config to request build host for.
         """
-
-        if len(self.build_hosts) > self.build_hosts_allocated:
-            self.build_hosts[self.build_hosts_allocated].build_config = build_config
-            self.build_hosts_allocated += 1
-        else:
-            bcf = build_config.build_config_file
-            error_msg = f"ERROR: {bcf.num_builds} builds requested in `config_build.yaml` but {self.__class__.__name__} build farm only provides {len(self.build_hosts)} build hosts (i.e. IPs)."
+        slots = sum(self.max_concurrent_builds.values())
+        bcf = build_config.build_config_file
+        if slots == 0:
+            error_msg = f"ERROR: {self.__class__.__name__} build farm provides no build hosts (i.e. IPs)."
             logging.fatal(error_msg)
             raise Exception(error_msg)
-
-        return
+        if bcf.builds_list.index(build_config) == slots:
+            logging.info(
+                f"{bcf.num_builds} builds requested in `config_build.yaml` but {self.__class__.__name__} build farm can only run {slots} at once. The remaining builds are queued."
+            )
 
     def wait_on_build_host_initialization(self, build_config: BuildConfig) -> None:
         """Nothing happens since the provided IP address is already granted by something outside FireSim.
@@ -93,6 +118,57 @@ class ExternallyProvisioned(BuildFarm):
         """
         return
 
+    def assign_build_host(self, build_config: BuildConfig) -> bool:
+        """Bind build config to a host with room for another build. Hosts that
+        last built for the same platform are preferred, since they already have
+        its files. A host never runs two builds of the same quintuplet at once,
+        since those share a build directory.
+
+        Args:
+            build_config: Build config to find a build host for.
+
+        Returns:
+            False if no host has room for the build.
+        """
+        quintuplet = build_config.get_chisel_quintuplet()
+        free: List[Tuple[str, BuildHost]] = []
+        for host in self.host_pool:
+            ip = host.ip_address
+            assert ip is not None
+            if len(self.running_builds[ip]) < self.max_concurrent_builds[ip] and all(
+                b.get_chisel_quintuplet() != quintuplet for b in self.running_builds[ip]
+            ):
+                free.append((ip, host))
+        if not free:
+            return False
+        ip, host = min(
+            free,
+            key=lambda f: self.last_platform.get(f[0]) != build_config.PLATFORM,
+        )
+
+        self.build_hosts = [
+            h for h in self.build_hosts if h.build_config != build_config
+        ]
+        self.build_hosts.append(
+            BuildHost(
+                ip_address=ip,
+                dest_build_dir=host.dest_build_dir,
+                build_config=build_config,
+            )
+        )
+        self.running_builds[ip].append(build_config)
+        self.last_platform[ip] = build_config.PLATFORM
+        return True
+
+    def finish_build(self, build_config: BuildConfig) -> None:
+        """Free the slot of build config on its host.
+
+        Args:
+            build_config: Build config whose build finished.
+        """
+        ip = self.get_build_host_ip(build_config)
+        self.running_builds[ip].remove(build_config)
+
     def release_build_host(self, build_config: BuildConfig) -> None:
         """Nothing happens. Up to the IP address provider to cleanup after itself.
 
@@ -102,7 +178,7 @@ class ExternallyProvisioned(BuildFarm):
         return
 
     def __repr__(self) -> str:
-        return f"< {type(self)}(build_hosts={self.build_hosts!r} build_hosts_allocated={self.build_hosts_allocated}) >"
+        return f"< {type(self)}(build_hosts={self.build_hosts!r} host_pool={self.host_pool!r} max_concurrent_builds={self.max_concurrent_builds!r}) >"
 
     def __str__(self) -> str:
         return pprint.pformat(vars(self), width=1, indent=10)
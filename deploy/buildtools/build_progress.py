@@ -0,0 +1,287 @@
+""" Live progress of the Vivado run of a bitstream build. The output of
+build-bitstream.sh is parsed line by line as it streams in: Vivado phase markers
+(synth, opt, place, phys_opt, route, bitgen) and timing estimates become
+progress events, which are logged and written to BUILD_PROGRESS.json in the
+results-build directory of the build. Phase durations of each run are kept in a
+per-recipe history, used to estimate the time remaining in later runs. """
+
+from __future__ import annotations
+
+from absl import flags, logging
+import json
+import os
+import re
+import time
+
+from buildtools.utils import get_deploy_dir
+from utils.streamlogger import InfoStreamLogger
+
+from typing import Any, Callable, Dict, List, Optional, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from buildtools.build_config import BuildConfig
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_float(
+    "abortbuildwns",
+    None,
+    "For buildbitstream, abort a Vivado run (and fail its build) once the WNS Vivado estimates during placement or routing is below this many ns.",
+)
+
+# Vivado commands that start each phase, in flow order
+PHASE_COMMANDS = {
+    "synth_design": "synth",
+    "opt_design": "opt",
+    "place_design": "place",
+    "phys_opt_design": "phys_opt",
+    "route_design": "route",
+    "write_bitstream": "bitgen",
+}
+PHASES = list(PHASE_COMMANDS.values())
+# phases whose timing estimates are close enough to the final timing to give up on
+TIMING_ABORT_PHASES = {"place", "phys_opt", "route"}
+
+PHASE_START_RE = re.compile(r"\bCommand: (\w+)")
+PHASE_END_RE = re.compile(r"\b(\w+) completed successfully")
+WNS_RE = re.compile(r"\bWNS=(-?\d+(?:\.\d+)?)")
+TNS_RE = re.compile(r"\bTNS=(-?\d+(?:\.\d+)?)")
+TIMING_MET_LINE = "All user specified timing constraints are met"
+TIMING_FAILED_LINE = "Timing constraints are not met"
+
+PROGRESS_FILE = "BUILD_PROGRESS.json"
+HISTORY_DIR_NAME = "build-history"
+# runs kept in the history of a recipe
+HISTORY_LENGTH = 20
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h{minutes:02d}m{seconds:02d}s"
+
+
+def get_history_path(build_config: BuildConfig) -> str:
+    return f"{get_deploy_dir()}/{HISTORY_DIR_NAME}/{build_config.name}.json"
+
+
+class BuildProgress:
+    """Progress of the Vivado run of a build, fed the run's output line by line.
+
+    Attributes:
+        build_config: Build config being built.
+        on_abort: Called with the reason once the run should be aborted.
+        progress_path: Local file progress events are written to.
+        events: Progress events so far, oldest first.
+        durations: Seconds taken by each finished phase, by phase.
+        current_phase: Phase Vivado is in, if any.
+        phase_start: Time the current phase started.
+        wns: Latest worst negative slack estimate, in ns.
+        tns: Latest total negative slack estimate, in ns.
+        timing_met: Whether Vivado reported the timing constraints met, once it did.
+        aborted: Reason the run was aborted, if it was.
+        history: Earlier runs of the same recipe, oldest first.
+    """
+
+    build_config: BuildConfig
+    on_abort: Optional[Callable[[str], None]]
+    progress_path: str
+    events: List[Dict[str, Any]]
+    durations: Dict[str, float]
+    current_phase: Optional[str]
+    phase_start: float
+    wns: Optional[float]
+    tns: Optional[float]
+    timing_met: Optional[bool]
+    aborted: Optional[str]
+    history: List[Dict[str, Any]]
+
+    def __init__(
+        self,
+        build_config: BuildConfig,
+        on_abort: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.build_config = build_config
+        self.on_abort = on_abort
+        self.progress_path = f"{get_deploy_dir()}/results-build/{build_config.get_build_dir_name()}/{PROGRESS_FILE}"
+        self.events = []
+        self.durations = {}
+        self.current_phase = None
+        self.phase_start = time.time()
+        self.wns = None
+        self.tns = None
+        self.timing_met = None
+        self.aborted = None
+
+        self.history = []
+        history_path = get_history_path(build_config)
+        if os.path.exists(history_path):
+            with open(history_path) as f:
+                self.history = json.load(f)
+
+    def feed(self, line: str) -> None:
+        """Parse a line of build-bitstream.sh output."""
+        if self.aborted is not None:
+            return
+
+        match = PHASE_START_RE.search(line)
+        if match and match.group(1) in PHASE_COMMANDS:
+            self.start_phase(PHASE_COMMANDS[match.group(1)])
+            return
+
+        match = PHASE_END_RE.search(line)
+        if match and match.group(1) in PHASE_COMMANDS:
+            if PHASE_COMMANDS[match.group(1)] == self.current_phase:
+                self.finish_phase()
+            return
+
+        if TIMING_MET_LINE in line or TIMING_FAILED_LINE in line:
+            self.timing_met = TIMING_MET_LINE in line
+            self.add_event("timing_summary", timing_met=self.timing_met)
+            return
+
+        wns = WNS_RE.search(line)
+        if wns:
+            tns = TNS_RE.search(line)
+            self.wns = float(wns.group(1))
+            self.tns = float(tns.group(1)) if tns else None
+            self.add_event("timing", wns=self.wns, tns=self.tns)
+            self.check_timing()
+
+    def start_phase(self, phase: str) -> None:
+        if self.current_phase is not None:
+            self.finish_phase()
+        self.current_phase = phase
+        self.phase_start = time.time()
+        self.add_event("phase_started")
+
+        estimate = self.estimate_remaining()
+        remaining = (
+            f", about {format_duration(estimate)} remaining"
+            if estimate is not None
+            else ""
+        )
+        logging.info(f"[{self.build_config.name}] Vivado {phase} started{remaining}.")
+
+    def finish_phase(self) -> None:
+        phase = self.current_phase
+        assert phase is not None
+        self.durations[phase] = time.time() - self.phase_start
+        self.add_event("phase_finished", duration=self.durations[phase])
+        self.current_phase = None
+
+        timing = f" (WNS={self.wns}ns)" if self.wns is not None else ""
+        logging.info(
+            f"[{self.build_config.name}] Vivado {phase} finished in {format_duration(self.durations[phase])}{timing}."
+        )
+
+    def check_timing(self) -> None:
+        """Abort the run if its timing estimate is below --abortbuildwns."""
+        if (
+            FLAGS.abortbuildwns is None
+            or self.current_phase not in TIMING_ABORT_PHASES
+            or self.wns is None
+            or self.wns >= FLAGS.abortbuildwns
+        ):
+            return
+        self.aborted = f"WNS of {self.wns}ns during {self.current_phase} is below --abortbuildwns={FLAGS.abortbuildwns}ns"
+        self.add_event("aborted", reason=self.aborted)
+        logging.info(f"[{self.build_config.name}] Aborting Vivado: {self.aborted}.")
+        if self.on_abort is not None:
+            self.on_abort(self.aborted)
+
+    def estimate_remaining(self) -> Optional[float]:
+        """Estimate the seconds left in the run from the mean phase durations
+        of earlier runs of the recipe.
+
+        Returns:
+            Seconds left, or None without history.
+        """
+        means: Dict[str, float] = {}
+        for phase in PHASES:
+            durations = [
+                run["durations"][phase]
+                for run in self.history
+                if phase in run["durations"]
+            ]
+            if durations:
+                means[phase] = sum(durations) / len(durations)
+        if not means:
+            return None
+
+        remaining = 0.0
+        for phase, mean in means.items():
+            if phase in self.durations:
+                continue
+            if phase == self.current_phase:
+                remaining += max(0.0, mean - (time.time() - self.phase_start))
+            else:
+                remaining += mean
+        return remaining
+
+    def add_event(self, event: str, **fields: Any) -> None:
+        self.events.append(
+            dict(event=event, time=time.time(), phase=self.current_phase, **fields)
+        )
+        self.write()
+
+    def write(self) -> None:
+        """Write the progress so far to the progress file of the build."""
+        os.makedirs(os.path.dirname(self.progress_path), exist_ok=True)
+        progress = {
+            "build": self.build_config.name,
+            "current_phase": self.current_phase,
+            "durations": self.durations,
+            "wns": self.wns,
+            "tns": self.tns,
+            "timing_met": self.timing_met,
+            "estimated_remaining": self.estimate_remaining(),
+            "aborted": self.aborted,
+            "events": self.events,
+        }
+        # write-then-rename so that readers never see a partial file
+        with open(self.progress_path + ".tmp", "w") as f:
+            json.dump(progress, f, indent=4)
+        os.replace(self.progress_path + ".tmp", self.progress_path)
+
+    def finish(self, passed: bool) -> None:
+        """Record the run in the history of the recipe once it ended.
+
+        Args:
+            passed: Whether build-bitstream.sh succeeded.
+        """
+        if self.current_phase is not None and passed:
+            self.finish_phase()
+        self.add_event("finished", passed=passed)
+
+        self.history.append(
+            {
+                "time": self.events[0]["time"],
+                "passed": passed,
+                "aborted": self.aborted,
+                "frequency": self.build_config.get_frequency(),
+                "strategy": self.build_config.get_strategy().name,
+                "durations": self.durations,
+                "wns": self.wns,
+                "tns": self.tns,
+                "timing_met": self.timing_met,
+            }
+        )
+        history_path = get_history_path(self.build_config)
+        os.makedirs(os.path.dirname(history_path), exist_ok=True)
+        with open(history_path, "w") as f:
+            json.dump(self.history[-HISTORY_LENGTH:], f, indent=4)
+
+
+class BuildProgressLogger(InfoStreamLogger):
+    """InfoStreamLogger of stdout that also feeds each line to a BuildProgress."""
+
+    progress: BuildProgress
+
+    def __init__(self, progress: BuildProgress) -> None:
+        super().__init__("stdout")
+        self.progress = progress
+
+    def parse(self, data: str) -> Tuple[str, str]:
+        self.progress.feed(data)
+        return "info", data
@@ -0,0 +1,238 @@
+""" Scheduling of bitstream builds onto build hosts. Builds can first be
+prepared locally (RTL generation), several at once. A prepared build waits in a
+queue until the build farm has a build host free for it. Build hosts are only
+requested for builds that are ready to run, so a build finished by its
+preparation (e.g. found in the bitstream cache) never gets one. The manager
+polls all booting build hosts together and only starts a build once its build
+host is ready. Each build runs in its own process, so that the next queued
+build is dispatched as soon as any running build finishes, any preparation
+completes or any build host finishes booting. """
+
+from __future__ import annotations
+
+from absl import flags, logging
+import multiprocessing
+import multiprocessing.connection
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, cast, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from buildtools.build_config import BuildConfig
+    from buildtools.build_farm import BuildFarm
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer(
+    "rtlgenerationjobs",
+    1,
+    "For buildbitstream, the number of builds whose RTL (and driver) is generated at once. Each runs a memory-heavy JVM. The bitstream build of a build starts as soon as its own RTL is generated.",
+)
+
+
+# seconds between polls of booting build hosts
+BUILD_HOST_POLL_INTERVAL = 5.0
+
+
+def _run_build(
+    build_fn: Callable[[BuildConfig], bool], build_config: BuildConfig, passed: Any
+) -> None:
+    passed.value = bool(build_fn(build_config))
+
+
+# outcomes of a preparation
+PREPARATION_FAILED = 0
+PREPARATION_READY = 1
+PREPARATION_FINISHED_BUILD = 2
+
+
+def _run_preparation(
+    prepare_fn: Callable[[BuildConfig], bool],
+    build_config: BuildConfig,
+    slots: Any,
+    outcome: Any,
+) -> None:
+    with slots:
+        needs_build_host = prepare_fn(build_config)
+    outcome.value = (
+        PREPARATION_READY if needs_build_host else PREPARATION_FINISHED_BUILD
+    )
+
+
+class BuildScheduler:
+    """Runs builds on the hosts of a build farm, at most as many at once as
+    the farm has room for (see BuildFarm.assign_build_host).
+
+    Attributes:
+        build_farm: Build farm to run the builds on.
+        queue: Builds waiting for a build host, in the order they are dispatched.
+        running: Running builds with their process and result, by process sentinel.
+        preparing: Builds being prepared with their process and outcome, by process sentinel.
+        prepared: Names of builds whose preparation succeeded. None if builds
+            need no preparation.
+        unprepared: Builds whose preparation waits for the preparation of a
+            build with the same chisel quintuplet, which writes the same
+            generated sources.
+        requested: Names of builds whose build host was requested.
+        ready: Names of builds whose build host is ready.
+        results: Whether each finished build passed, by build config name.
+    """
+
+    build_farm: BuildFarm
+    queue: List[BuildConfig]
+    running: Dict[int, Tuple[BuildConfig, multiprocessing.process.BaseProcess, Any]]
+    preparing: Dict[int, Tuple[BuildConfig, multiprocessing.process.BaseProcess, Any]]
+    prepared: Optional[Set[str]]
+    unprepared: List[BuildConfig]
+    requested: Set[str]
+    ready: Set[str]
+    results: Dict[str, bool]
+
+    def __init__(self, build_farm: BuildFarm, builds: List[BuildConfig]) -> None:
+        self.build_farm = build_farm
+        self.queue = list(builds)
+        self.running = {}
+        self.preparing = {}
+        self.prepared = None
+        self.unprepared = []
+        self.requested = set()
+        self.ready = set()
+        self.results = {}
+        # builds run fabric tasks like @parallel does, in forked processes
+        # that inherit the build farm
+        self.context = multiprocessing.get_context("fork")
+
+    def prepare(self, prepare_fn: Callable[[BuildConfig], bool], jobs: int) -> None:
+        """Start preparing every queued build with prepare_fn(build_config),
+        in a process per build of which at most jobs run prepare_fn at once.
+        Builds with the same chisel quintuplet are prepared one after the
+        other. A build is only dispatched once its preparation succeeded.
+        prepare_fn returns False if it already finished the build, which then
+        never gets a build host. Preparations run in the background until
+        `run`."""
+        assert jobs > 0, f"Invalid number of preparation jobs: {jobs}"
+        self.prepared = set()
+        self.prepare_fn = prepare_fn
+        self.slots = self.context.Semaphore(jobs)
+        self.unprepared = list(self.queue)
+        self.start_preparations()
+
+    def start_preparations(self) -> None:
+        """Start preparing the unprepared builds whose chisel quintuplet no
+        other build is being prepared for."""
+        busy = {b.get_chisel_quintuplet() for b, _, _ in self.preparing.values()}
+        for build_config in list(self.unprepared):
+            quintuplet = build_config.get_chisel_quintuplet()
+            if quintuplet in busy:
+                continue
+            busy.add(quintuplet)
+            self.unprepared.remove(build_config)
+            outcome = self.context.Value("b", PREPARATION_FAILED)
+            process = self.context.Process(
+                target=_run_preparation,
+                args=(self.prepare_fn, build_config, self.slots, outcome),
+                name=f"prepare-{build_config.name}",
+            )
+            process.start()
+            self.preparing[process.sentinel] = (build_config, process, outcome)
+
+    def booting(self) -> List[BuildConfig]:
+        """Queued builds whose build host was requested but is not ready yet."""
+        return [
+            build_config
+            for build_config in self.queue
+            if build_config.name in self.requested
+            and build_config.name not in self.ready
+        ]
+
+    def dispatch(self, build_fn: Callable[[BuildConfig], bool]) -> None:
+        """Request build hosts for prepared queued builds, check which of the
+        requested build hosts are ready, and start every build whose build
+        host is ready and that the build farm has room for."""
+        for build_config in self.queue:
+            if self.prepared is not None and build_config.name not in self.prepared:
+                continue
+            if build_config.name not in self.requested:
+                self.build_farm.request_build_host(build_config)
+                self.requested.add(build_config.name)
+
+        booting = self.booting()
+        if booting:
+            self.ready.update(
+                build_config.name
+                for build_config in self.build_farm.poll_build_host_initializations(
+                    booting
+                )
+            )
+
+        for build_config in list(self.queue):
+            if build_config.name not in self.ready:
+                continue
+            if not self.build_farm.assign_build_host(build_config):
+                continue
+            self.queue.remove(build_config)
+            passed = self.context.Value("b", False)
+            process = self.context.Process(
+                target=_run_build,
+                args=(build_fn, build_config, passed),
+                name=f"build-{build_config.name}",
+            )
+            process.start()
+            logging.info(
+                f"Dispatched build {build_config.name} to {self.build_farm.get_build_host_ip(build_config)} ({len(self.queue)} builds queued)."
+            )
+            self.running[process.sentinel] = (build_config, process, passed)
+
+    def run(self, build_fn: Callable[[BuildConfig], bool]) -> Dict[str, bool]:
+        """Run build_fn(build_config) for every build, in a child process once
+        the build host of the build is ready, and return whether each build
+        passed."""
+        while self.queue or self.running:
+            self.dispatch(build_fn)
+            booting = bool(self.booting())
+            if not self.running and not self.preparing and not booting:
+                raise Exception(
+                    f"No build host can run the queued builds: {', '.join(b.name for b in self.queue)}"
+                )
+            sentinels = list(self.running) + list(self.preparing)
+            if not sentinels:
+                # only build hosts that are still booting are left to wait on
+                time.sleep(BUILD_HOST_POLL_INTERVAL)
+                continue
+            # wake up to poll the build hosts that are still booting
+            timeout = BUILD_HOST_POLL_INTERVAL if booting else None
+            for sentinel in multiprocessing.connection.wait(sentinels, timeout):
+                if sentinel in self.preparing:
+                    self.finish_preparation(cast(int, sentinel))
+                    continue
+                build_config, process, passed = self.running.pop(cast(int, sentinel))
+                process.join()
+                self.results[build_config.name] = process.exitcode == 0 and bool(
+                    passed.value
+                )
+                self.build_farm.finish_build(build_config)
+                logging.info(
+                    f"Build {build_config.name} {'passed' if self.results[build_config.name] else 'failed'}."
+                )
+        return self.results
+
+    def finish_preparation(self, sentinel: int) -> None:
+        build_config, process, outcome = self.preparing.pop(sentinel)
+        process.join()
+        assert self.prepared is not None
+        if process.exitcode != 0:
+            outcome.value = PREPARATION_FAILED
+        if outcome.value == PREPARATION_READY:
+            logging.info(f"Build {build_config.name} is ready to run.")
+            self.prepared.add(build_config.name)
+        elif outcome.value == PREPARATION_FINISHED_BUILD:
+            logging.info(f"Build {build_config.name} finished without a build host.")
+            self.queue.remove(build_config)
+            self.results[build_config.name] = True
+        else:
+            logging.info(
+                f"Build {build_config.name} failed before its bitstream build could start."
+            )
+            self.queue.remove(build_config)
+            self.results[build_config.name] = False
+        self.start_preparations()
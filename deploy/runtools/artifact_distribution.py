@@ -0,0 +1,352 @@
+""" Fan-out distribution of large simulation artifacts (driver tarballs, rootfs
+images, bitstreams) to run farm hosts. Instead of every host pulling the same
+file from the manager, the manager seeds each artifact to a few hosts, which
+then serve it over HTTP to the next level of a tree of hosts. Every hop verifies
+the sha256 of what it received. Hosts keep artifacts in a content-addressed
+cache dir, from which copy_sim_slot_infrastructure copies them into place. """
+
+from __future__ import annotations
+
+from absl import flags, logging
+from fabric.api import env, execute, parallel, run, settings, hide  # type: ignore
+from fabric.contrib.project import rsync_project  # type: ignore
+import os
+from os.path import realpath
+import stat
+
+from runtools.utils import file_digest
+
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from runtools.run_farm import RunHost
+
+FLAGS = flags.FLAGS
+
+ARTIFACT_DISTRIBUTION_MODES = ["direct", "fanout"]
+
+flags.DEFINE_enum(
+    "artifactdistribution",
+    "direct",
+    ARTIFACT_DISTRIBUTION_MODES,
+    "How infrasetup copies large artifacts (driver tarballs, rootfses, bitstreams) needed by several run farm hosts. direct: every host copies them from the manager. fanout: the manager seeds them to a few hosts, which forward them to the others over HTTP. Requires run farm hosts to reach each other on --artifactfanoutport.",
+)
+flags.DEFINE_integer(
+    "artifactfanoutport",
+    8642,
+    "Port run farm hosts serve artifacts to each other on with --artifactdistribution=fanout. The server (python3 -m http.server) listens on all interfaces without access control while infrasetup runs, so anyone who can reach this port can download the artifacts; restrict it to the run farm hosts with a firewall or security group.",
+)
+
+# smaller files are always copied directly from the manager
+FANOUT_MIN_SIZE = 16 * 1024 * 1024
+# bytes/s assumed for the manager uplink and for links between hosts
+ASSUMED_BANDWIDTH = 1.25e9
+# seconds assumed for the fixed cost of a hop (ssh round trips, checksumming)
+HOP_OVERHEAD = 2.0
+
+CACHE_DIR_NAME = "artifact-cache"
+
+
+class Artifact:
+    """A file needed by several hosts.
+
+    Attributes:
+        local_paths: Paths of the file (or identical copies) on the manager.
+        sha256: Hash of its contents, also its name in the host caches.
+        size: Size in bytes.
+        mode: Permission bits of the file on the manager.
+        hosts: Hosts that need it, in deployment order.
+    """
+
+    local_paths: List[str]
+    sha256: str
+    size: int
+    mode: int
+    hosts: List[str]
+
+    def __init__(self, sha256: str, size: int, mode: int) -> None:
+        self.local_paths = []
+        self.sha256 = sha256
+        self.size = size
+        self.mode = mode
+        self.hosts = []
+
+
+def estimate_distribution_time(num_hosts: int, size: int, fanout: int) -> float:
+    """Estimate the seconds needed to get size bytes to num_hosts hosts when
+    every sender (the manager, then each host that has the file) sends to
+    fanout receivers at once, sharing its uplink between them."""
+    levels = 0
+    reached = 0
+    senders = 1
+    while reached < num_hosts:
+        receivers = min(senders * fanout, num_hosts - reached)
+        reached += receivers
+        senders = receivers
+        levels += 1
+    return levels * (HOP_OVERHEAD + fanout * size / ASSUMED_BANDWIDTH)
+
+
+def choose_fanout(num_hosts: int, size: int) -> int:
+    """Return the fanout with the lowest estimated distribution time. A fanout
+    of num_hosts means the manager sends to every host directly."""
+    return min(
+        range(1, num_hosts + 1),
+        key=lambda fanout: (
+            estimate_distribution_time(num_hosts, size, fanout),
+            -fanout,
+        ),
+    )
+
+
+def plan_tree(hosts: List[str], fanout: int) -> Dict[str, Tuple[int, Optional[str]]]:
+    """Return the (level, parent) of each host in a tree where the manager
+    (parent None) sends to the first fanout hosts and each host sends to
+    fanout hosts of the next level."""
+    plan: Dict[str, Tuple[int, Optional[str]]] = {}
+    level_hosts: List[Optional[str]] = [None]
+    remaining = list(hosts)
+    level = 0
+    while remaining:
+        level += 1
+        next_level: List[Optional[str]] = []
+        for parent in level_hosts:
+            children, remaining = remaining[:fanout], remaining[fanout:]
+            for child in children:
+                plan[child] = (level, parent)
+                next_level.append(child)
+        level_hosts = next_level
+    return plan
+
+
+def cache_dir(host: RunHost) -> str:
+    return f"{host.get_sim_dir()}/{CACHE_DIR_NAME}"
+
+
+def _kill_server_cmd(cache: str) -> str:
+    """Shell command that stops the server recorded in {cache}.pid, if that
+    pid still belongs to an http.server (a stale file may name a reused pid)."""
+    return (
+        f"[ -f {cache}.pid ] && ps -p $(cat {cache}.pid) -o args= | grep -q http.server"
+        f" && kill $(cat {cache}.pid); rm -f {cache}.pid"
+    )
+
+
+def _verify_and_commit(sha256: str, mode: int) -> str:
+    """Shell command (run in the cache dir) that checks the sha256 of a
+    received artifact and moves it into place with the mode of the original."""
+    return (
+        f"if echo '{sha256}  {sha256}.tmp' | sha256sum -c --status; "
+        f"then chmod {mode:o} {sha256}.tmp && mv -f {sha256}.tmp {sha256}; "
+        f"else rm -f {sha256}.tmp; false; fi"
+    )
+
+
+class ArtifactDistribution:
+    """Plans and runs the fan-out of artifacts to hosts. All fabric tasks run
+    once per round on the hosts involved in that round, in parallel."""
+
+    hosts: Dict[str, RunHost]
+    # by sha256
+    artifacts: Dict[str, Artifact]
+    plans: Dict[str, Dict[str, Tuple[int, Optional[str]]]]
+    # sha256 by local realpath
+    digests: Dict[str, str]
+
+    def __init__(self, hosts: List[RunHost]) -> None:
+        self.hosts = {host.get_host(): host for host in hosts}
+        self.artifacts = {}
+        self.plans = {}
+        self.digests = {}
+
+    def add_files(self, host: RunHost, local_paths: List[str]) -> None:
+        """Register the files host needs. Files that are too small to be
+        worth a tree are ignored."""
+        for local_path in local_paths:
+            if not os.path.isfile(local_path):
+                continue
+            st = os.stat(local_path)
+            if st.st_size < FANOUT_MIN_SIZE:
+                continue
+            path = realpath(local_path)
+            if path not in self.digests:
+                self.digests[path] = file_digest(path)
+            sha256 = self.digests[path]
+            if sha256 not in self.artifacts:
+                self.artifacts[sha256] = Artifact(
+                    sha256, st.st_size, stat.S_IMODE(st.st_mode)
+                )
+            artifact = self.artifacts[sha256]
+            if path not in artifact.local_paths:
+                artifact.local_paths.append(path)
+            if host.get_host() not in artifact.hosts:
+                artifact.hosts.append(host.get_host())
+
+    def distribute(self) -> None:
+        """Get every artifact needed by more than one host to those hosts and
+        record the verified copies in their deploy managers (see
+        InstanceDeployManager.distributed_files). Hosts that fail to receive
+        an artifact are left to copy it from the manager."""
+        shared = [a for a in self.artifacts.values() if len(a.hosts) > 1]
+        if not shared:
+            return
+
+        present = self._run_round(self._list_cache)
+        for artifact in shared:
+            missing = [
+                h for h in artifact.hosts if artifact.sha256 not in present.get(h, [])
+            ]
+            fanout = choose_fanout(len(missing), artifact.size) if missing else 1
+            self.plans[artifact.sha256] = plan_tree(missing, fanout)
+            logging.info(
+                f"Distributing {artifact.local_paths[0]} ({artifact.size >> 20} MiB) to {len(missing)} hosts with fanout {fanout} ({len(artifact.hosts) - len(missing)} already have it)."
+            )
+
+        received: Dict[str, Set[str]] = {h: set(present.get(h, [])) for h in self.hosts}
+        num_levels = max(
+            [level for plan in self.plans.values() for level, _ in plan.values()],
+            default=0,
+        )
+        servers: List[str] = []
+        try:
+            for level in range(1, num_levels + 1):
+                parents = sorted(
+                    set(
+                        parent
+                        for plan in self.plans.values()
+                        for lvl, parent in plan.values()
+                        if lvl == level and parent is not None
+                    )
+                )
+                new_servers = [p for p in parents if p not in servers]
+                if new_servers:
+                    self._run_round(self._start_server, new_servers)
+                    servers += new_servers
+                receivers = sorted(
+                    set(
+                        host
+                        for plan in self.plans.values()
+                        for host, (lvl, _) in plan.items()
+                        if lvl == level
+                    )
+                )
+                for host, shas in self._run_round(
+                    self._receive, receivers, level=level
+                ).items():
+                    received[host].update(shas)
+        finally:
+            if servers:
+                self._run_round(self._stop_server, servers)
+
+        # drop artifacts of earlier runs, the cache only holds what the
+        # current simulations use
+        self._run_round(self._prune)
+
+        failed = 0
+        for artifact in shared:
+            for host in artifact.hosts:
+                if artifact.sha256 in received[host]:
+                    deploy_manager = self.hosts[host].instance_deploy_manager
+                    for local_path in artifact.local_paths:
+                        deploy_manager.distributed_files[local_path] = (
+                            f"{cache_dir(self.hosts[host])}/{artifact.sha256}"
+                        )
+                else:
+                    failed += 1
+        if failed:
+            logging.warning(
+                f"{failed} artifact copies failed to fan out and will be copied from the manager."
+            )
+
+    def _run_round(
+        self,
+        task: Callable[..., List[str]],
+        hosts: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Dict[str, List[str]]:
+        """Run task on hosts (all hosts by default) in parallel and return
+        what it returned on each host."""
+        hosts = list(self.hosts) if hosts is None else hosts
+        if not hosts:
+            return {}
+
+        # fabric can only mark plain functions as parallel, not methods
+        @parallel
+        def task_wrapper(**kwargs: Any) -> List[str]:
+            return task(**kwargs)
+
+        results = execute(task_wrapper, hosts=hosts, **kwargs)
+        return {h: r or [] for h, r in results.items()}
+
+    def _list_cache(self) -> List[str]:
+        cache = cache_dir(self.hosts[env.host_string])
+        with hide("everything"), settings(warn_only=True):
+            run(f"mkdir -p {cache}")
+            return run(f"ls -1 {cache}").split()
+
+    def _prune(self) -> List[str]:
+        me = env.host_string
+        keep = [a.sha256 for a in self.artifacts.values() if me in a.hosts]
+        names = " ".join(f"! -name {sha256}" for sha256 in keep)
+        with settings(warn_only=True):
+            run(f"find {cache_dir(self.hosts[me])} -maxdepth 1 -type f {names} -delete")
+        return []
+
+    def _start_server(self) -> List[str]:
+        me = env.host_string
+        cache = cache_dir(self.hosts[me])
+        port = FLAGS.artifactfanoutport
+        # a server left behind by an interrupted run would hold the port
+        with settings(warn_only=True):
+            run(_kill_server_cmd(cache))
+        # only the in-VPC peers that fetch from this host need to reach it
+        run(
+            f"cd {cache} && nohup python3 -m http.server {port} --bind {me} > ../{CACHE_DIR_NAME}-server.log 2>&1 & echo $! > {cache}.pid",
+            pty=False,
+        )
+        run(
+            f"for i in $(seq 50); do curl -fs -o /dev/null http://{me}:{port}/ && break; sleep 0.1; done"
+        )
+        return []
+
+    def _stop_server(self) -> List[str]:
+        cache = cache_dir(self.hosts[env.host_string])
+        with settings(warn_only=True):
+            run(_kill_server_cmd(cache))
+        return []
+
+    def _receive(self, level: int) -> List[str]:
+        """Receive the artifacts this host gets at level of their trees, from
+        the manager or its parent host. Returns the hashes received."""
+        me = env.host_string
+        cache = cache_dir(self.hosts[me])
+        received = []
+        for sha256, plan in self.plans.items():
+            if plan.get(me, (None, None))[0] != level:
+                continue
+            parent = plan[me][1]
+            with settings(warn_only=True):
+                if parent is None:
+                    rsync_cap = rsync_project(
+                        local_dir=self.artifacts[sha256].local_paths[0],
+                        remote_dir=f"{cache}/{sha256}.tmp",
+                        ssh_opts="-o StrictHostKeyChecking=no",
+                        extra_opts="-L",
+                        capture=True,
+                    )
+                    logging.debug(rsync_cap)
+                    logging.debug(rsync_cap.stderr)
+                else:
+                    run(
+                        f"curl -fsS --retry 3 -o {cache}/{sha256}.tmp http://{parent}:{FLAGS.artifactfanoutport}/{sha256}"
+                    )
+                result = run(
+                    f"cd {cache} && {_verify_and_commit(sha256, self.artifacts[sha256].mode)}"
+                )
+            if result.return_code == 0:
+                received.append(sha256)
+            else:
+                logging.warning(
+                    f"[{me}] Did not receive a valid copy of {self.artifacts[sha256].local_paths[0]} from {parent or 'the manager'}."
+                )
+        return received
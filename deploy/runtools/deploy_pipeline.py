@@ -0,0 +1,185 @@
+""" Dependency-driven scheduling of infrasetup. Artifacts (URIs, drivers,
+pipes, switches) are built in the manager process, one host's worth at a time,
+and each host is deployed in its own process as soon as everything it needs is
+built, so that transfers and FPGA flashing on early hosts overlap the builds for
+later ones. """
+
+from __future__ import annotations
+
+from absl import flags, logging
+import multiprocessing
+import multiprocessing.connection
+import sys
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_bool(
+    "pipelinedinfrasetup",
+    True,
+    "Deploy each run farm host as soon as the drivers, switches and pipes it needs are built, instead of building everything before deploying to any host.",
+)
+
+# name, start, end of an artifact build, relative to the pipeline start
+BuildRecord = Tuple[str, float, float]
+
+
+class HostDeployment:
+    """A host deployment running in a child process."""
+
+    host: str
+    ready: float
+    process: multiprocessing.Process
+    finished: Any
+
+    def __init__(
+        self,
+        host: str,
+        ready: float,
+        process: multiprocessing.Process,
+        finished: Any,
+    ) -> None:
+        self.host = host
+        self.ready = ready
+        self.process = process
+        self.finished = finished
+
+    def end(self) -> float:
+        """Time the deployment finished, relative to the pipeline start."""
+        return self.finished.value
+
+
+def _run_deployment(
+    fn: Callable[..., None], args: Tuple[Any, ...], start: float, finished: Any
+) -> None:
+    try:
+        fn(*args)
+    finally:
+        # monotonic time is system-wide, so it can be compared with the
+        # parent's timestamps
+        finished.value = time.monotonic() - start
+
+
+class DeploymentPipeline:
+    """Records artifact builds and starts host deployments. Use as a context
+    manager: leaving the context waits for all deployments, reports the
+    critical path and exits if any deployment failed."""
+
+    start: float
+    builds: List[BuildRecord]
+    deployments: List[HostDeployment]
+    context: Any
+
+    def __init__(self) -> None:
+        self.start = time.monotonic()
+        self.builds = []
+        self.deployments = []
+        # deployments run fabric tasks like @parallel does, in forked
+        # processes that inherit the topology
+        self.context = multiprocessing.get_context("fork")
+
+    def now(self) -> float:
+        return time.monotonic() - self.start
+
+    def build(self, name: str, fn: Callable[..., None], *args: Any) -> None:
+        """Build an artifact in the manager process."""
+        begin = self.now()
+        fn(*args)
+        self.builds.append((name, begin, self.now()))
+
+    def deploy(self, host: str, fn: Callable[..., None], *args: Any) -> None:
+        """Start deploying to host, whose artifacts are all built."""
+        ready = self.now()
+        finished = self.context.Value("d", float("inf"))
+        process = self.context.Process(
+            target=_run_deployment,
+            args=(fn, args, self.start, finished),
+            name=f"infrasetup-{host}",
+        )
+        process.start()
+        logging.debug(f"[{host}] Artifacts ready after {ready:.1f}s. Deploying.")
+        self.deployments.append(HostDeployment(host, ready, process, finished))
+
+    def __enter__(self) -> DeploymentPipeline:
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        # never leave a host half set up behind, even if a build failed
+        pending = [d.process.sentinel for d in self.deployments]
+        while pending:
+            ready_sentinels = multiprocessing.connection.wait(pending)
+            pending = [s for s in pending if s not in ready_sentinels]
+        for deployment in self.deployments:
+            deployment.process.join()
+            if deployment.finished.value == float("inf"):
+                # killed before it could record its end
+                deployment.finished.value = self.now()
+
+        if exc_type is not None:
+            return
+
+        self.report()
+
+        failed = [d.host for d in self.deployments if d.process.exitcode != 0]
+        if failed:
+            logging.info(f"infrasetup failed on hosts: {', '.join(failed)}")
+            sys.exit(1)
+
+    def builds_before(self, time_ready: float) -> List[BuildRecord]:
+        return [b for b in self.builds if b[2] <= time_ready]
+
+    def report(self) -> None:
+        """Log when each host was ready and done, and the critical path: the
+        builds the last host to finish waited for, then its deployment."""
+        for d in self.deployments:
+            logging.debug(
+                f"[{d.host}] ready at {d.ready:.1f}s, deployed in {d.end() - d.ready:.1f}s"
+            )
+        if not self.deployments:
+            return
+
+        last = max(self.deployments, key=lambda d: d.end())
+        waited_for = self.builds_before(last.ready)
+        longest = sorted(waited_for, key=lambda b: b[2] - b[1], reverse=True)[:3]
+        build_time = sum(b[2] - b[1] for b in self.builds)
+        phased_estimate = build_time + max(d.end() - d.ready for d in self.deployments)
+
+        logging.info(
+            f"infrasetup took {last.end():.1f}s. Critical path: {len(waited_for)} builds until {last.host} was ready at {last.ready:.1f}s"
+            + (
+                " (longest: "
+                + ", ".join(
+                    f"{name} {end - begin:.1f}s" for name, begin, end in longest
+                )
+                + ")"
+                if longest
+                else ""
+            )
+            + f", then deploying {last.host} took {last.end() - last.ready:.1f}s."
+        )
+        logging.info(
+            f"Building everything before deploying would have taken about {phased_estimate:.1f}s."
+        )
+
+
+def order_by_missing_artifacts(
+    hosts: List[Any], artifacts: Dict[Any, List[Any]], built: Optional[Set[Any]] = None
+) -> List[Any]:
+    """Order hosts so that each next host needs the fewest artifacts that are
+    not built yet (ties keep the given order). Hosts that only need artifacts
+    already needed by earlier hosts (e.g. all hosts running the same hardware
+    config) are deployed right after them."""
+    built = set() if built is None else set(built)
+    remaining = list(hosts)
+    ordered = []
+    while remaining:
+        host = min(
+            remaining,
+            key=lambda h: len([a for a in artifacts[h] if a not in built]),
+        )
+        remaining.remove(host)
+        ordered.append(host)
+        built.update(artifacts[host])
+    return ordered
@@ -0,0 +1,59 @@
+""" Per-host inventory of FPGA devices: the FPGA database written by
+enumerate_fpgas and the PCIe enumeration of the host. Slot operations (flashing,
+changing permissions, starting simulations) look devices up here instead of
+each asking the host again. """
+
+from __future__ import annotations
+
+from absl import logging
+from fabric.api import env, run  # type: ignore
+import json
+
+from typing import Dict, List, Optional
+
+
+class DeviceInventory:
+    """FPGA database and PCIe devices of a run farm host, fetched on first use.
+
+    Fabric runs per-host tasks in forked processes, so an inventory fetched by
+    a task is dropped when the task ends. Within a task, whatever changes what
+    the host reports (rescanning the PCIe bus, reflashing FPGAs, regenerating
+    the FPGA database) must call invalidate().
+
+    Attributes:
+        fpga_db_path: Remote path of the cached FPGA database.
+        fpga_db: Entries of the FPGA database, one per FPGA, in slot order.
+        pci_devices: lspci lines of the devices of a vendor, by vendor.
+    """
+
+    fpga_db_path: Optional[str]
+    fpga_db: Optional[List[Dict[str, str]]]
+    pci_devices: Dict[str, List[str]]
+
+    def __init__(self) -> None:
+        self.fpga_db_path = None
+        self.fpga_db = None
+        self.pci_devices = {}
+
+    def get_fpga_db(self, json_db: str) -> List[Dict[str, str]]:
+        """Return the entries of the FPGA database at json_db on the host."""
+        if self.fpga_db is None or self.fpga_db_path != json_db:
+            logging.debug(f"[{env.host_string}] Reading FPGA database {json_db}")
+            self.fpga_db = json.loads(run(f"cat {json_db}"))
+            self.fpga_db_path = json_db
+        return self.fpga_db
+
+    def get_pci_devices(self, vendor: str) -> List[str]:
+        """Return the lspci lines of the devices of vendor on the host, in bus
+        order."""
+        if vendor not in self.pci_devices:
+            logging.debug(f"[{env.host_string}] Enumerating {vendor} PCIe devices")
+            collect = run(f"lspci | grep -i {vendor}")
+            self.pci_devices[vendor] = [i for i in collect.splitlines() if i.strip()]
+        return self.pci_devices[vendor]
+
+    def invalidate(self) -> None:
+        """Forget everything, the next lookup asks the host again."""
+        self.fpga_db_path = None
+        self.fpga_db = None
+        self.pci_devices = {}
@@ -0,0 +1,176 @@
+""" Persistent record of built simulation drivers and driver tarballs, so that
+manager invocations after the first skip make and tarball creation when
+nothing they depend on has changed.
+
+Each output (driver binary or tarball) gets a sidecar file next to it that
+holds the key of the inputs it was produced from and the stat of the output
+when it was produced. An output is reused if the current key matches and the
+output was not modified since. """
+
+from __future__ import annotations
+
+from absl import flags, logging
+import hashlib
+import json
+import os
+from pathlib import Path
+
+from buildtools.utils import get_deploy_dir
+from runtools.utils import file_digest
+
+from typing import Any, Dict, Optional, Sequence, Tuple, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from runtools.runtime_hw_config import RuntimeHWConfig
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_bool(
+    "usedrivercache",
+    True,
+    "Reuse simulation drivers and driver tarballs built by earlier manager invocations when their inputs are unchanged. Set to false to always run make and recreate the tarballs.",
+)
+
+# bump this whenever the way keys are computed changes
+DRIVER_CACHE_VERSION = 2
+SIDECAR_SUFFIX = ".cachekey"
+
+# driver sources shared by all target projects, relative to the deploy dir
+DRIVER_SOURCE_DIRS = [
+    "../sim/midas/src/main/cc",
+    "../sim/firesim-lib/src/main/cc",
+    "../sim/src/main/cc",
+    "../sim/src/main/makefrag",
+    "../sim/make",
+]
+
+# prefix of the Golden Gate outputs in the generated-src dir of a quintuplet
+GENERATED_FILE_PREFIX = "FireSim-generated"
+
+
+def _stat_entry(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+
+def _tree_fingerprint(h: Any, root: Path) -> None:
+    """Add the path, size and mtime of every file under root to h. This
+    matches what make uses to decide whether a target is out of date."""
+    if not root.exists():
+        h.update(f"missing:{root}\n".encode())
+        return
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = Path(dirpath) / name
+            h.update(f"{path}:{_stat_entry(path)}\n".encode())
+
+
+def driver_build_key(hwconfig: RuntimeHWConfig) -> str:
+    """Return the key of the inputs of a driver build: the make arguments
+    (which include the deploy quintuplet), the Golden Gate outputs of the
+    quintuplet in generated-src, the driver sources and the makefrags."""
+    deploy_dir = Path(get_deploy_dir())
+    h = hashlib.sha256()
+    h.update(f"version:{DRIVER_CACHE_VERSION}\n".encode())
+    h.update(f"make:{hwconfig.get_driver_build_make_args()}\n".encode())
+
+    generated_dir = (
+        deploy_dir
+        / "../sim/generated-src"
+        / hwconfig.get_platform()
+        / hwconfig.get_deployquintuplet_for_config()
+    )
+    if generated_dir.exists():
+        for path in sorted(generated_dir.glob(f"{GENERATED_FILE_PREFIX}*")):
+            h.update(f"{path.name}:{_stat_entry(path)}\n".encode())
+
+    for source_dir in DRIVER_SOURCE_DIRS:
+        _tree_fingerprint(h, deploy_dir / source_dir)
+
+    makefrag = hwconfig.get_deploymakefrag_for_config()
+    if makefrag is not None:
+        makefrag_dir = Path(makefrag).parent
+        _tree_fingerprint(h, makefrag_dir)
+        # target projects keep their driver sources in src/main/cc next to
+        # src/main/makefrag
+        for parent in makefrag_dir.parents:
+            if parent.name == "main" and parent.parent.name == "src":
+                _tree_fingerprint(h, parent / "cc")
+                break
+    return h.hexdigest()
+
+
+def tarball_key(
+    quintuplet: str, tarball_name: str, paths: Sequence[Tuple[str, str]], codec: str
+) -> str:
+    """Return the key of the contents of a driver tarball: the quintuplet,
+    the codec and the content hash of every file that goes into it (the
+    driver, runtime conf, shared libraries and additional files) with its
+    location in the tarball. paths are (local_path, remote_path) pairs as
+    passed to build_sim_tarball, local paths are relative to the deploy dir."""
+    deploy_dir = Path(get_deploy_dir())
+    h = hashlib.sha256()
+    h.update(f"version:{DRIVER_CACHE_VERSION}\n".encode())
+    h.update(f"quintuplet:{quintuplet}\ntarball:{tarball_name}\n".encode())
+    h.update(f"codec:{codec}\n".encode())
+    for local_path, remote_path in sorted(paths):
+        path = deploy_dir / local_path
+        h.update(f"entry:{local_path}:{remote_path}\n".encode())
+        if path.is_dir():
+            for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    file_path = Path(dirpath) / name
+                    relative = file_path.relative_to(path)
+                    h.update(f"{relative}:{file_digest(file_path)}\n".encode())
+        elif path.exists():
+            h.update(f"{file_digest(path)}\n".encode())
+        else:
+            h.update(b"missing\n")
+    return h.hexdigest()
+
+
+def _sidecar_path(output: Path) -> Path:
+    return output.with_name(output.name + SIDECAR_SUFFIX)
+
+
+def cache_hit(output: Path, key: str) -> bool:
+    """Return True if output exists, was produced from inputs with key and
+    has not been modified since."""
+    if not FLAGS.usedrivercache:
+        return False
+    sidecar = _sidecar_path(output)
+    try:
+        with open(sidecar, "r") as f:
+            entry = json.load(f)
+    except (OSError, ValueError):
+        return False
+    stat = _stat_entry(output)
+    return (
+        stat is not None and entry.get("key") == key and entry.get("stat") == list(stat)
+    )
+
+
+def record(output: Path, key: str) -> None:
+    """Record that output was produced from inputs with key."""
+    stat = _stat_entry(output)
+    if stat is None:
+        logging.warning(f"Unable to record {output} in the driver cache: missing.")
+        return
+    entry: Dict[str, object] = {"key": key, "stat": list(stat)}
+    sidecar = _sidecar_path(output)
+    tmp = sidecar.with_name(sidecar.name + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(entry, f)
+    os.replace(tmp, sidecar)
+
+
+def invalidate(output: Path) -> None:
+    """Forget output, e.g. before it is rebuilt."""
+    sidecar = _sidecar_path(output)
+    if sidecar.exists():
+        sidecar.unlink()
@@ -0,0 +1,133 @@
+""" Creation of the driver tarballs that are copied to run farm hosts. Archives
+are written in-process with fixed metadata, so identical inputs produce
+byte-identical tarballs (which rsync can then skip). """
+
+from __future__ import annotations
+
+from absl import flags
+import gzip
+import os
+import shutil
+import subprocess
+import tarfile
+from pathlib import Path
+
+from typing import BinaryIO, Dict, List, Sequence, Tuple
+
+FLAGS = flags.FLAGS
+
+DRIVER_TARBALL_CODECS = ["gzip", "zstd"]
+
+flags.DEFINE_enum(
+    "drivertarballcodec",
+    "gzip",
+    DRIVER_TARBALL_CODECS,
+    "Compression used for driver tarballs. zstd compresses with all local cores and is faster for large drivers, but requires zstd on the run farm hosts.",
+)
+
+# all archive members get this mtime and owner
+ARCHIVE_MTIME = 0
+GZIP_COMPRESSLEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def tarball_members(
+    paths: Sequence[Tuple[str, str]], base_dir: Path
+) -> List[Tuple[str, Path]]:
+    """Return the (name in archive, local path) of every file and directory
+    that goes into a tarball of paths, sorted by name. paths are
+    (local_path, remote_path) pairs, local paths are relative to base_dir.
+    This follows the rsync -r -L semantics the tarballs used to be staged
+    with: a file is stored as remote_path (or under its own name if
+    remote_path is empty or a directory), a directory is stored recursively
+    under its own name, and symlinks are followed."""
+    members: Dict[str, Path] = {}
+    for local_path, remote_path in paths:
+        path = base_dir / local_path
+        if path.is_dir():
+            top = os.path.join(remote_path, path.name)
+            members[top] = path
+            for dirpath, dirnames, filenames in os.walk(path, followlinks=True):
+                for name in dirnames + filenames:
+                    member = Path(dirpath) / name
+                    members[os.path.join(top, str(member.relative_to(path)))] = member
+        elif remote_path == "" or remote_path.endswith("/"):
+            members[os.path.join(remote_path, path.name)] = path
+        else:
+            members[remote_path] = path
+    return sorted(members.items())
+
+
+def _add_member(tar: tarfile.TarFile, name: str, path: Path) -> None:
+    st = os.stat(path)
+    info = tarfile.TarInfo(name)
+    info.mode = st.st_mode & 0o7777
+    info.mtime = ARCHIVE_MTIME
+    info.uid = info.gid = 0
+    info.uname = info.gname = ""
+    if path.is_dir():
+        info.type = tarfile.DIRTYPE
+        tar.addfile(info)
+    else:
+        info.size = st.st_size
+        with open(path, "rb") as f:
+            tar.addfile(info, f)
+
+
+def _write_tar(
+    fileobj: BinaryIO, paths: Sequence[Tuple[str, str]], base_dir: Path
+) -> None:
+    with tarfile.open(fileobj=fileobj, mode="w|", format=tarfile.GNU_FORMAT) as tar:
+        for name, path in tarball_members(paths, base_dir):
+            _add_member(tar, name, path)
+
+
+def write_driver_tarball(
+    paths: Sequence[Tuple[str, str]], base_dir: Path, output: Path, codec: str
+) -> None:
+    """Write a tarball of paths (see tarball_members) to output, compressed
+    with codec."""
+    assert codec in DRIVER_TARBALL_CODECS, f"Unknown driver tarball codec {codec}"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    tmp = output.with_name(output.name + ".tmp")
+    try:
+        if codec == "gzip":
+            with open(tmp, "wb") as raw, gzip.GzipFile(
+                filename="",
+                mode="wb",
+                fileobj=raw,
+                compresslevel=GZIP_COMPRESSLEVEL,
+                mtime=ARCHIVE_MTIME,
+            ) as gz:
+                _write_tar(gz, paths, base_dir)  # type: ignore[arg-type]
+        else:
+            zstd = shutil.which("zstd")
+            if zstd is None:
+                raise Exception(
+                    "Unable to find zstd, which is required by --drivertarballcodec=zstd."
+                )
+            # the output of multithreaded zstd doesn't depend on the number
+            # of threads
+            proc = subprocess.Popen(
+                [zstd, "-q", "-f", f"-{ZSTD_LEVEL}", "-T0", "-o", str(tmp)],
+                stdin=subprocess.PIPE,
+            )
+            assert proc.stdin is not None
+            try:
+                _write_tar(proc.stdin, paths, base_dir)  # type: ignore[arg-type]
+            finally:
+                proc.stdin.close()
+            if proc.wait() != 0:
+                raise Exception(f"zstd failed while writing {output}")
+        os.replace(tmp, output)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def extract_command(codec: str, tarball: str) -> str:
+    """Return the shell command that extracts tarball, compressed with codec,
+    into the current directory."""
+    if codec == "zstd":
+        return f"zstd -dc {tarball} | tar -xf -"
+    return f"tar -xf {tarball}"
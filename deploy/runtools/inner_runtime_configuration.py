@@ -14,6 +14,8 @@ from runtools.simulation_configs.autocounter import AutoCounterConfig
 from runtools.simulation_configs.host_debug import HostDebugConfig
 from runtools.simulation_configs.synth_print import SynthPrintConfig
 from runtools.simulation_configs.partition import PartitionConfig
+from runtools.topology.diagram import TopologyDiagramConfig
+from runtools.topology.switching import UPLINK_ROUTING_MODES
 
 from utils.inheritors import inheritors
 from utils.deepmerge import deep_merge
@@ -38,6 +40,7 @@ class InnerRuntimeConfiguration:
     """Pythonic version of config_runtime.yaml"""
 
     run_farm_requested_name: str
+    run_farm_base_recipe: str
     run_farm_dispatcher: RunFarm
     topology: str
     no_net_num_nodes: int
@@ -60,6 +63,9 @@ class InnerRuntimeConfiguration:
     metasimulation_only_plusargs: str
     metasimulation_only_vcs_plusargs: str
     default_plusarg_passthrough: str
+    host_mapping: str
+    uplink_routing: str
+    diagram_config: TopologyDiagramConfig
 
     def __init__(self) -> None:
 
@@ -100,6 +106,7 @@ class InnerRuntimeConfiguration:
 
         # Setup the run farm
         defaults_file = runtime_dict["run_farm"]["base_recipe"]
+        self.run_farm_base_recipe = defaults_file
         with open(defaults_file, "r") as yaml_file:
             run_farm_configfile = yaml.safe_load(yaml_file)
         run_farm_type = run_farm_configfile["run_farm_type"]
@@ -130,11 +137,26 @@ class InnerRuntimeConfiguration:
         self.netbandwidth = int(runtime_dict["target_config"]["net_bandwidth"])
         self.profileinterval = int(runtime_dict["target_config"]["profile_interval"])
         self.defaulthwconfig = runtime_dict["target_config"]["default_hw_config"]
+        self.host_mapping = runtime_dict["target_config"].get("host_mapping", "greedy")
+        if self.host_mapping not in ["greedy", "min_cut"]:
+            raise Exception(
+                f"Invalid host_mapping {self.host_mapping} in target_config. Must be one of: greedy, min_cut."
+            )
+        self.uplink_routing = runtime_dict["target_config"].get(
+            "uplink_routing", "ecmp"
+        )
+        if self.uplink_routing not in UPLINK_ROUTING_MODES:
+            raise Exception(
+                f"Invalid uplink_routing {self.uplink_routing} in target_config. Must be one of: {', '.join(UPLINK_ROUTING_MODES)}."
+            )
 
         self.tracerv_config = TracerVConfig(runtime_dict.get("tracing", {}))
         self.autocounter_config = AutoCounterConfig(runtime_dict.get("autocounter", {}))
         self.hostdebug_config = HostDebugConfig(runtime_dict.get("host_debug", {}))
         self.synthprint_config = SynthPrintConfig(runtime_dict.get("synth_print", {}))
+        self.diagram_config = TopologyDiagramConfig(
+            runtime_dict.get("topology_diagram", {})
+        )
         self.partition_config = PartitionConfig()
 
         dict_assert("plusarg_passthrough", runtime_dict["target_config"])
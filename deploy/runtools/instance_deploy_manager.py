@@ -7,16 +7,19 @@ from absl import logging
 import abc
 from fabric.api import prefix, local, run, env, cd, warn_only, put, settings, hide  # type: ignore
 from fabric.contrib.project import rsync_project  # type: ignore
-from os.path import join as pjoin
+from os.path import join as pjoin, realpath
 import os
 
 from utils.streamlogger import StreamLogger
 from awstools.awstools import terminate_instances, get_instance_ids_for_instances
-from runtools.utils import has_sudo, run_only_aws, check_script, is_on_aws, script_path
+from runtools.utils import has_sudo, check_script, is_on_aws, script_path
 from buildtools.utils import get_deploy_dir
 from runtools.nbd_tracker import NBDTracker
+from runtools.device_inventory import DeviceInventory
+from runtools.remote_script import RemoteScript
 
-from typing import List, Dict, Optional, TYPE_CHECKING
+from contextlib import contextmanager
+from typing import Iterator, List, Dict, Optional, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from runtools.run_farm import RunHost
@@ -28,10 +31,15 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
 
     Attributes:
         parent_node: Run farm host associated with this platform implementation.
+        distributed_files: Local paths of files that were already distributed to
+            this host (see ArtifactDistribution), mapped to their remote copy.
+        device_inventory: FPGA database and PCIe devices of this host.
     """
 
     parent_node: RunHost
     nbd_tracker: Optional[NBDTracker]
+    distributed_files: Dict[str, str]
+    device_inventory: DeviceInventory
 
     def __init__(self, parent_node: RunHost) -> None:
         """
@@ -45,6 +53,8 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
         # Set this to self.nbd_tracker = NBDTracker() in the __init__ of your
         # subclass if your system supports the NBD kernel module.
         self.nbd_tracker = None
+        self.distributed_files = {}
+        self.device_inventory = DeviceInventory()
 
     @abc.abstractmethod
     def infrasetup_instance(self, uridir: str) -> None:
@@ -75,6 +85,20 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
         """
         raise NotImplementedError
 
+    @contextmanager
+    def batched(
+        self, script: Optional[RemoteScript], name: str
+    ) -> Iterator[RemoteScript]:
+        """Yield a RemoteScript to queue remote steps on: script if given (its
+        owner runs it later), otherwise a new one that is run in a single
+        round trip when the block ends."""
+        if script is not None:
+            yield script
+            return
+        own_script = RemoteScript(name)
+        yield own_script
+        own_script.run()
+
     def instance_logger(self, logstr: str, debug: bool = False) -> None:
         """Log with this host's info as prefix."""
         if debug:
@@ -82,60 +106,81 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
         else:
             logging.info("""[{}] """.format(env.host_string) + logstr)
 
-    def sim_node_qcow(self) -> None:
+    def require_aws(self, step: str) -> None:
+        """Raise unless running on AWS, like run_only_aws does for a single
+        command.
+
+        Args:
+            step: Description of the step that needs AWS, for the error.
+        """
+        if not is_on_aws():
+            error_msg = f"[{env.host_string}] {step} is only supported on AWS."
+            logging.error(error_msg)
+            raise Exception(error_msg)
+
+    def sim_node_qcow(self, script: Optional[RemoteScript] = None) -> None:
         """If NBD is available and qcow2 support is required, install qemu-img
         management tools and copy NBD infra to remote node. This assumes that
         the kernel module was already built and exists in the directory on this
         machine."""
         if self.nbd_tracker is not None and self.parent_node.qcow2_support_required():
             self.instance_logger("""Setting up remote node for qcow2 disk images.""")
-            # get qemu-nbd
-            run_only_aws("sudo yum -y install qemu-img")
             # copy over kernel module
             put(
                 "../build/nbd.ko",
                 f"/home/{os.environ['USER']}/nbd.ko",
                 mirror_local_mode=True,
             )
+            self.require_aws("Installing qemu-img for qcow2 disk images")
+            # get qemu-nbd
+            with self.batched(script, "install qemu-img") as s:
+                s.add("Install qemu-img", "sudo yum -y install qemu-img")
 
-    def load_nbd_module(self) -> None:
+    def load_nbd_module(self, script: Optional[RemoteScript] = None) -> None:
         """If NBD is available and qcow2 support is required, load the nbd
         module. always unload the module first to ensure it is in a clean
         state."""
         if self.nbd_tracker is not None and self.parent_node.qcow2_support_required():
             self.instance_logger("Loading NBD Kernel Module.")
-            self.unload_nbd_module()
-            run_only_aws(
-                f"""sudo insmod /home/{os.environ['USER']}/nbd.ko nbds_max={self.nbd_tracker.NBDS_MAX}"""
-            )
+            self.require_aws("Loading the NBD kernel module")
+            with self.batched(script, "load nbd") as s:
+                self.unload_nbd_module(s)
+                s.add(
+                    "Load NBD kernel module",
+                    f"""sudo insmod /home/{os.environ['USER']}/nbd.ko nbds_max={self.nbd_tracker.NBDS_MAX}""",
+                )
 
-    def unload_nbd_module(self) -> None:
+    def unload_nbd_module(self, script: Optional[RemoteScript] = None) -> None:
         """If NBD is available and qcow2 support is required, unload the nbd
         module."""
         if self.nbd_tracker is not None and self.parent_node.qcow2_support_required():
             self.instance_logger("Unloading NBD Kernel Module.")
 
-            # disconnect all /dev/nbdX devices before rmmod
-            self.disconnect_all_nbds_instance()
-            with warn_only():
-                run_only_aws("sudo rmmod nbd")
+            self.require_aws("Unloading the NBD kernel module")
+            with self.batched(script, "unload nbd") as s:
+                # disconnect all /dev/nbdX devices before rmmod
+                self.disconnect_all_nbds_instance(s)
+                s.add("Unload NBD kernel module", "sudo rmmod nbd", warn_only=True)
 
-    def disconnect_all_nbds_instance(self) -> None:
+    def disconnect_all_nbds_instance(
+        self, script: Optional[RemoteScript] = None
+    ) -> None:
         """If NBD is available and qcow2 support is required, disconnect all
         nbds on the instance."""
         if self.nbd_tracker is not None and self.parent_node.qcow2_support_required():
             self.instance_logger("Disconnecting all NBDs.")
 
-            # warn_only, so we can call this even if there are no nbds
-            with warn_only():
-                # build up one large command with all the disconnects
-                fullcmd = []
-                for nbd_index in range(self.nbd_tracker.NBDS_MAX):
-                    fullcmd.append(
-                        """sudo qemu-nbd -d /dev/nbd{nbdno}""".format(nbdno=nbd_index)
-                    )
+            # build up one large command with all the disconnects
+            fullcmd = []
+            for nbd_index in range(self.nbd_tracker.NBDS_MAX):
+                fullcmd.append(
+                    """sudo qemu-nbd -d /dev/nbd{nbdno}""".format(nbdno=nbd_index)
+                )
 
-                run_only_aws("; ".join(fullcmd))
+            self.require_aws("Disconnecting NBDs")
+            with self.batched(script, "disconnect nbds") as s:
+                # warn_only, so we can call this even if there are no nbds
+                s.add("Disconnect all NBDs", "; ".join(fullcmd), warn_only=True)
 
     def get_remote_sim_dir_for_slot(self, slotno: int) -> str:
         """Returns the path on the remote for a given slot number."""
@@ -149,13 +194,26 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
 
         return remote_sim_dir
 
-    def copy_sim_slot_infrastructure(self, slotno: int, uridir: str) -> None:
-        """copy all the simulation infrastructure to the remote node."""
+    def get_sim_slot_files(self, slotno: int, uridir: str) -> List[Tuple[str, str]]:
+        """Return the local and remote paths of all files copied to a sim
+        slot. Remote paths are relative to the slot's rsyncdir."""
+        serv = self.parent_node.sim_slots[slotno]
+        files_to_copy = serv.get_required_files_local_paths()
+
+        # Append required URI paths to the end of this list
+        hwcfg = serv.get_resolved_server_hardware_config()
+        files_to_copy.extend(hwcfg.get_local_uri_paths(uridir))
+        return files_to_copy
+
+    def copy_sim_slot_infrastructure(
+        self, slotno: int, uridir: str, script: Optional[RemoteScript] = None
+    ) -> None:
+        """copy all the simulation infrastructure to the remote node. The
+        remote steps after the copies are queued on script if one is given."""
         if self.instance_assigned_simulations():
             assert slotno < len(
                 self.parent_node.sim_slots
             ), f"{slotno} can not index into sim_slots {len(self.parent_node.sim_slots)} on {self.parent_node.host}"
-            serv = self.parent_node.sim_slots[slotno]
 
             self.instance_logger(
                 f"""Copying {self.sim_type_message} simulation infrastructure for slot: {slotno}."""
@@ -163,29 +221,44 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
 
             remote_sim_dir = self.get_remote_sim_dir_for_slot(slotno)
             remote_sim_rsync_dir = remote_sim_dir + "rsyncdir/"
-            run(f"mkdir -p {remote_sim_rsync_dir}")
-
-            files_to_copy = serv.get_required_files_local_paths()
 
-            # Append required URI paths to the end of this list
-            hwcfg = serv.get_resolved_server_hardware_config()
-            files_to_copy.extend(hwcfg.get_local_uri_paths(uridir))
-
-            for local_path, remote_path in files_to_copy:
-                # -z --inplace
-                rsync_cap = rsync_project(
-                    local_dir=local_path,
-                    remote_dir=pjoin(remote_sim_rsync_dir, remote_path),
-                    ssh_opts="-o StrictHostKeyChecking=no",
-                    extra_opts="-L",
-                    capture=True,
+            with self.batched(script, "copy sim slot") as s:
+                s.add(
+                    f"Create sim slot {slotno} dir", f"mkdir -p {remote_sim_rsync_dir}"
                 )
-                logging.debug(rsync_cap)
-                logging.debug(rsync_cap.stderr)
+                for local_path, remote_path in self.get_sim_slot_files(slotno, uridir):
+                    distributed_copy = self.distributed_files.get(realpath(local_path))
+                    if distributed_copy is not None:
+                        # same placement as rsync'ing the file to remote_path
+                        if remote_path == "" or remote_path.endswith("/"):
+                            remote_path += os.path.basename(local_path)
+                        s.add(
+                            f"Copy distributed {os.path.basename(local_path)} to sim slot {slotno}",
+                            f"cp -f {distributed_copy} {pjoin(remote_sim_rsync_dir, remote_path)}",
+                        )
+                        continue
+
+                    # -z --inplace
+                    rsync_cap = rsync_project(
+                        local_dir=local_path,
+                        remote_dir=pjoin(remote_sim_rsync_dir, remote_path),
+                        ssh_opts="-o StrictHostKeyChecking=no",
+                        # the slot dir is created by the script, which runs
+                        # after the copies
+                        extra_opts=f"-L --rsync-path='mkdir -p {remote_sim_rsync_dir} && rsync'",
+                        capture=True,
+                    )
+                    logging.debug(rsync_cap)
+                    logging.debug(rsync_cap.stderr)
 
-            run(f"cp -r {remote_sim_rsync_dir}/* {remote_sim_dir}/", shell=True)
+                s.add(
+                    f"Install sim slot {slotno} files",
+                    f"cp -r {remote_sim_rsync_dir}/* {remote_sim_dir}/",
+                )
 
-    def extract_driver_tarball(self, slotno: int) -> None:
+    def extract_driver_tarball(
+        self, slotno: int, script: Optional[RemoteScript] = None
+    ) -> None:
         """extract tarball that already exists on the remote node."""
         if self.instance_assigned_simulations():
             assert slotno < len(self.parent_node.sim_slots)
@@ -194,10 +267,21 @@ class InstanceDeployManager(metaclass=abc.ABCMeta):
             hwcfg = serv.get_resolved_server_hardware_config()
 
             remote_sim_dir = self.get_remote_sim_dir_for_slot(slotno)
-            options = "-xf"
 
-            with cd(remote_sim_dir):
-                run(f"tar {options} {hwcfg.get_driver_tar_filename()}")
+            with self.batched(script, "extract driver tarball") as s:
+                s.add(
+                    f"Extract driver tarball in sim slot {slotno}",
+                    hwcfg.get_driver_tar_extract_command(),
+                    cwd=remote_sim_dir,
+                )
+
+    def setup_sim_slots(self, uridir: str, script: RemoteScript) -> None:
+        """Copy the simulation infrastructure of every sim slot and queue the
+        remote steps that install it (and extract the driver tarballs) on
+        script."""
+        for slotno in range(len(self.parent_node.sim_slots)):
+            self.copy_sim_slot_infrastructure(slotno, uridir, script)
+            self.extract_driver_tarball(slotno, script)
 
     def copy_switch_slot_infrastructure(self, switchslot: int) -> None:
         """copy all the switch infrastructure to the remote node."""
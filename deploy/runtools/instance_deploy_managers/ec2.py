@@ -8,8 +8,9 @@ import os
 
 from runtools.instance_deploy_manager import InstanceDeployManager
 from runtools.nbd_tracker import NBDTracker
+from runtools.remote_script import RemoteScript
 
-from typing import TYPE_CHECKING
+from typing import Optional, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from runtools.run_farm import RunHost
@@ -26,14 +27,17 @@ class EC2InstanceDeployManager(InstanceDeployManager):
         super().__init__(parent_node)
         self.nbd_tracker = NBDTracker()
 
-    def remote_kmsg(self, message: str) -> None:
+    def remote_kmsg(self, message: str, script: Optional[RemoteScript] = None) -> None:
         """This will let you write whatever is passed as message into the kernel
         log of the remote machine.  Useful for figuring what the manager is doing
         w.r.t output from kernel stuff on the remote node."""
         commd = """echo '{}' | sudo tee /dev/kmsg""".format(message)
-        run(commd, shell=True)
+        with self.batched(script, "kmsg") as s:
+            s.add(f"Write {message} to kernel log", commd)
 
-    def get_and_install_aws_fpga_sdk(self) -> None:
+    def get_and_install_aws_fpga_sdk(
+        self, script: Optional[RemoteScript] = None
+    ) -> None:
         """Installs the aws-sdk. This gets us access to tools to flash the fpga."""
         if self.instance_assigned_simulations():
             with prefix("cd ../"):
@@ -51,13 +55,24 @@ class EC2InstanceDeployManager(InstanceDeployManager):
                     aws_fpga_upstream_version
                 )
             )
-            with warn_only():
-                run("git clone https://github.com/aws/aws-fpga")
-                run("cd aws-fpga && git checkout " + aws_fpga_upstream_version)
-            with cd(f"/home/{os.environ['USER']}/aws-fpga"):
-                run("source sdk_setup.sh")
+            with self.batched(script, "install aws-fpga sdk") as s:
+                s.add(
+                    "Clone aws-fpga",
+                    "git clone https://github.com/aws/aws-fpga",
+                    warn_only=True,
+                )
+                s.add(
+                    "Check out aws-fpga",
+                    "cd aws-fpga && git checkout " + aws_fpga_upstream_version,
+                    warn_only=True,
+                )
+                s.add(
+                    "Set up aws-fpga sdk",
+                    "source sdk_setup.sh",
+                    cwd=f"/home/{os.environ['USER']}/aws-fpga",
+                )
 
-    def fpga_node_xdma(self) -> None:
+    def fpga_node_xdma(self, script: Optional[RemoteScript] = None) -> None:
         """Copy XDMA infra to remote node. This assumes that the driver was
         already built and that a binary exists in the directory on this machine
         """
@@ -69,192 +84,215 @@ class EC2InstanceDeployManager(InstanceDeployManager):
                 f"/home/{os.environ['USER']}/xdma/",
                 mirror_local_mode=True,
             )
-            with cd(
-                f"/home/{os.environ['USER']}/xdma/linux_kernel_drivers/xdma/"
-            ), prefix("export PATH=/usr/bin:$PATH"):
-                # prefix only needed if conda env is earlier in PATH
+            xdma_dir = f"/home/{os.environ['USER']}/xdma/linux_kernel_drivers/xdma/"
+            with self.batched(script, "build xdma") as s:
+                # PATH only needs to be changed if conda env is earlier in PATH
                 # see build-setup-nolog.sh for explanation.
-                run("make clean")
-                run("make")
+                s.add(
+                    "Clean XDMA driver",
+                    "export PATH=/usr/bin:$PATH && make clean",
+                    cwd=xdma_dir,
+                )
+                s.add(
+                    "Build XDMA driver",
+                    "export PATH=/usr/bin:$PATH && make",
+                    cwd=xdma_dir,
+                )
 
-    def unload_xrt_and_xocl(self) -> None:
+    def unload_xrt_and_xocl(self, script: Optional[RemoteScript] = None) -> None:
         if self.instance_assigned_simulations():
             self.instance_logger("Unloading XRT-related Kernel Modules.")
 
-            with warn_only():
+            with self.batched(script, "unload xrt") as s:
                 # fpga mgmt tools seem to force load xocl after a flash now...
                 # so we just remove everything for good measure:
-                self.remote_kmsg("removing_xrt_start")
-                run("sudo systemctl stop mpd")
-                run("sudo yum remove -y xrt xrt-aws")
-                self.remote_kmsg("removing_xrt_end")
+                self.remote_kmsg("removing_xrt_start", s)
+                s.add("Stop mpd", "sudo systemctl stop mpd", warn_only=True)
+                s.add("Remove XRT", "sudo yum remove -y xrt xrt-aws", warn_only=True)
+                self.remote_kmsg("removing_xrt_end", s)
 
-    def unload_xdma(self) -> None:
+    def unload_xdma(self, script: Optional[RemoteScript] = None) -> None:
         if self.instance_assigned_simulations():
             self.instance_logger("Unloading XDMA Driver Kernel Module.")
 
-            with warn_only():
+            with self.batched(script, "unload xdma") as s:
                 # fpga mgmt tools seem to force load xocl after a flash now...
                 # so we just remove everything for good measure:
-                self.remote_kmsg("removing_xdma_start")
-                run("sudo rmmod xdma")
-                self.remote_kmsg("removing_xdma_end")
+                self.remote_kmsg("removing_xdma_start", s)
+                s.add("Unload XDMA kernel module", "sudo rmmod xdma", warn_only=True)
+                self.remote_kmsg("removing_xdma_end", s)
 
             # self.instance_logger("Waiting 10 seconds after removing kernel modules (esp. xocl).")
             # time.sleep(10)
 
-    def clear_fpgas(self) -> None:
+    def clear_fpgas(self, script: Optional[RemoteScript] = None) -> None:
         if self.instance_assigned_simulations():
-            # we always clear ALL fpga slots
-            for slotno in range(self.parent_node.MAX_SIM_SLOTS_ALLOWED):
-                self.instance_logger("""Clearing FPGA Slot {}.""".format(slotno))
-                self.remote_kmsg("""about_to_clear_fpga{}""".format(slotno))
-                run("""sudo fpga-clear-local-image -S {} -A""".format(slotno))
-                self.remote_kmsg("""done_clearing_fpga{}""".format(slotno))
-
-            for slotno in range(self.parent_node.MAX_SIM_SLOTS_ALLOWED):
-                self.instance_logger(
-                    """Checking for Cleared FPGA Slot {}.""".format(slotno)
-                )
-                self.remote_kmsg("""about_to_check_clear_fpga{}""".format(slotno))
-                run(
-                    """until sudo fpga-describe-local-image -S {} -R -H | grep -q "cleared"; do  sleep 1;  done""".format(
-                        slotno
+            with self.batched(script, "clear fpgas") as s:
+                # we always clear ALL fpga slots
+                for slotno in range(self.parent_node.MAX_SIM_SLOTS_ALLOWED):
+                    self.instance_logger("""Clearing FPGA Slot {}.""".format(slotno))
+                    self.remote_kmsg("""about_to_clear_fpga{}""".format(slotno), s)
+                    s.add(
+                        f"Clear FPGA slot {slotno}",
+                        """sudo fpga-clear-local-image -S {} -A""".format(slotno),
                     )
-                )
-                self.remote_kmsg("""done_checking_clear_fpga{}""".format(slotno))
+                    self.remote_kmsg("""done_clearing_fpga{}""".format(slotno), s)
 
-    def flash_fpgas(self) -> None:
-        if self.instance_assigned_simulations():
-            dummyagfi = None
-            for slotno, firesimservernode in enumerate(self.parent_node.sim_slots):
-                agfi = firesimservernode.get_agfi()
-                dummyagfi = agfi
-                self.instance_logger(
-                    """Flashing FPGA Slot: {} with agfi: {}.""".format(slotno, agfi)
-                )
-                run(
-                    """sudo fpga-load-local-image -S {} -I {} -A""".format(slotno, agfi)
-                )
+                for slotno in range(self.parent_node.MAX_SIM_SLOTS_ALLOWED):
+                    self.instance_logger(
+                        """Checking for Cleared FPGA Slot {}.""".format(slotno)
+                    )
+                    self.remote_kmsg(
+                        """about_to_check_clear_fpga{}""".format(slotno), s
+                    )
+                    s.add(
+                        f"Wait for FPGA slot {slotno} to be cleared",
+                        """until sudo fpga-describe-local-image -S {} -R -H | grep -q "cleared"; do  sleep 1;  done""".format(
+                            slotno
+                        ),
+                    )
+                    self.remote_kmsg("""done_checking_clear_fpga{}""".format(slotno), s)
 
-            # We only do this because XDMA hangs if some of the FPGAs on the instance
-            # are left in the cleared state. So, if you're only using some of the
-            # FPGAs on an instance, we flash the rest with one of your images
-            # anyway. Since the only interaction we have with an FPGA right now
-            # is over PCIe where the software component is mastering, this can't
-            # break anything.
-            for slotno in range(
-                len(self.parent_node.sim_slots), self.parent_node.MAX_SIM_SLOTS_ALLOWED
-            ):
-                self.instance_logger(
-                    """Flashing FPGA Slot: {} with dummy agfi: {}.""".format(
-                        slotno, dummyagfi
+    def flash_fpgas(self, script: Optional[RemoteScript] = None) -> None:
+        if self.instance_assigned_simulations():
+            with self.batched(script, "flash fpgas") as s:
+                dummyagfi = None
+                for slotno, firesimservernode in enumerate(self.parent_node.sim_slots):
+                    agfi = firesimservernode.get_agfi()
+                    dummyagfi = agfi
+                    self.instance_logger(
+                        """Flashing FPGA Slot: {} with agfi: {}.""".format(slotno, agfi)
                     )
-                )
-                run(
-                    """sudo fpga-load-local-image -S {} -I {} -A""".format(
-                        slotno, dummyagfi
+                    s.add(
+                        f"Flash FPGA slot {slotno}",
+                        """sudo fpga-load-local-image -S {} -I {} -A""".format(
+                            slotno, agfi
+                        ),
                     )
-                )
 
-            for slotno, firesimservernode in enumerate(self.parent_node.sim_slots):
-                self.instance_logger(
-                    """Checking for Flashed FPGA Slot: {} with agfi: {}.""".format(
-                        slotno, agfi
+                # We only do this because XDMA hangs if some of the FPGAs on the instance
+                # are left in the cleared state. So, if you're only using some of the
+                # FPGAs on an instance, we flash the rest with one of your images
+                # anyway. Since the only interaction we have with an FPGA right now
+                # is over PCIe where the software component is mastering, this can't
+                # break anything.
+                for slotno in range(
+                    len(self.parent_node.sim_slots),
+                    self.parent_node.MAX_SIM_SLOTS_ALLOWED,
+                ):
+                    self.instance_logger(
+                        """Flashing FPGA Slot: {} with dummy agfi: {}.""".format(
+                            slotno, dummyagfi
+                        )
                     )
-                )
-                run(
-                    """until sudo fpga-describe-local-image -S {} -R -H | grep -q "loaded"; do  sleep 1;  done""".format(
-                        slotno
+                    s.add(
+                        f"Flash unused FPGA slot {slotno}",
+                        """sudo fpga-load-local-image -S {} -I {} -A""".format(
+                            slotno, dummyagfi
+                        ),
                     )
-                )
 
-            for slotno in range(
-                len(self.parent_node.sim_slots), self.parent_node.MAX_SIM_SLOTS_ALLOWED
-            ):
-                self.instance_logger(
-                    """Checking for Flashed FPGA Slot: {} with agfi: {}.""".format(
-                        slotno, dummyagfi
+                for slotno in range(self.parent_node.MAX_SIM_SLOTS_ALLOWED):
+                    self.instance_logger(
+                        """Checking for Flashed FPGA Slot: {}.""".format(slotno)
                     )
-                )
-                run(
-                    """until sudo fpga-describe-local-image -S {} -R -H | grep -q "loaded"; do  sleep 1;  done""".format(
-                        slotno
+                    s.add(
+                        f"Wait for FPGA slot {slotno} to be flashed",
+                        """until sudo fpga-describe-local-image -S {} -R -H | grep -q "loaded"; do  sleep 1;  done""".format(
+                            slotno
+                        ),
                     )
-                )
 
-    def load_xdma(self) -> None:
+    def load_xdma(self, script: Optional[RemoteScript] = None) -> None:
         """load the xdma kernel module."""
         if self.instance_assigned_simulations():
-            # fpga mgmt tools seem to force load xocl after a flash now...
-            # xocl conflicts with the xdma driver, which we actually want to use
-            # so we just remove everything for good measure before loading xdma:
-            self.unload_xdma()
-            # now load xdma
-            self.instance_logger("Loading XDMA Driver Kernel Module.")
-            # TODO: can make these values automatically be chosen based on link lat
-            run(
-                f"sudo insmod /home/{os.environ['USER']}/xdma/linux_kernel_drivers/xdma/xdma.ko poll_mode=1"
-            )
+            with self.batched(script, "load xdma") as s:
+                # fpga mgmt tools seem to force load xocl after a flash now...
+                # xocl conflicts with the xdma driver, which we actually want to use
+                # so we just remove everything for good measure before loading xdma:
+                self.unload_xdma(s)
+                # now load xdma
+                self.instance_logger("Loading XDMA Driver Kernel Module.")
+                # TODO: can make these values automatically be chosen based on link lat
+                s.add(
+                    "Load XDMA kernel module",
+                    f"sudo insmod /home/{os.environ['USER']}/xdma/linux_kernel_drivers/xdma/xdma.ko poll_mode=1",
+                )
 
-    def start_ila_server(self) -> None:
+    def start_ila_server(self, script: Optional[RemoteScript] = None) -> None:
         """start the vivado hw_server and virtual jtag on simulation instance."""
         if self.instance_assigned_simulations():
-            self.instance_logger("Starting Vivado hw_server.")
-            run(
-                """screen -S hw_server -d -m bash -c "script -f -c 'hw_server'"; sleep 1"""
-            )
-            self.instance_logger("Starting Vivado virtual JTAG.")
-            run(
-                """screen -S virtual_jtag -d -m bash -c "script -f -c 'sudo fpga-start-virtual-jtag -P 10201 -S 0'"; sleep 1"""
-            )
+            with self.batched(script, "start ila server") as s:
+                self.instance_logger("Starting Vivado hw_server.")
+                s.add(
+                    "Start Vivado hw_server",
+                    """screen -S hw_server -d -m bash -c "script -f -c 'hw_server'"; sleep 1""",
+                )
+                self.instance_logger("Starting Vivado virtual JTAG.")
+                s.add(
+                    "Start Vivado virtual JTAG",
+                    """screen -S virtual_jtag -d -m bash -c "script -f -c 'sudo fpga-start-virtual-jtag -P 10201 -S 0'"; sleep 1""",
+                )
 
-    def kill_ila_server(self) -> None:
+    def kill_ila_server(self, script: Optional[RemoteScript] = None) -> None:
         """Kill the vivado hw_server and virtual jtag"""
         if self.instance_assigned_simulations():
-            with warn_only():
-                run("sudo pkill -SIGKILL hw_server")
-            with warn_only():
-                run("sudo pkill -SIGKILL fpga-local-cmd")
+            with self.batched(script, "kill ila server") as s:
+                s.add(
+                    "Kill Vivado hw_server",
+                    "sudo pkill -SIGKILL hw_server",
+                    warn_only=True,
+                )
+                s.add(
+                    "Kill Vivado virtual JTAG",
+                    "sudo pkill -SIGKILL fpga-local-cmd",
+                    warn_only=True,
+                )
 
     def infrasetup_instance(self, uridir: str) -> None:
-        """Handle infrastructure setup for this instance."""
+        """Handle infrastructure setup for this instance. Remote steps are
+        batched into one script per phase, the phases are separated by
+        copies from the manager."""
 
         metasim_enabled = self.parent_node.metasimulation_enabled
 
         if self.instance_assigned_simulations():
             # This is a sim-host node.
+            script = RemoteScript("infrasetup sim slots")
 
             # copy sim infrastructure
-            for slotno in range(len(self.parent_node.sim_slots)):
-                self.copy_sim_slot_infrastructure(slotno, uridir)
-                self.extract_driver_tarball(slotno)
+            self.setup_sim_slots(uridir, script)
 
             if not metasim_enabled:
-                self.get_and_install_aws_fpga_sdk()
+                self.get_and_install_aws_fpga_sdk(script)
                 # unload any existing edma/xdma/xocl
-                self.unload_xrt_and_xocl()
+                self.unload_xrt_and_xocl(script)
+                script.run()
+
+                script = RemoteScript("infrasetup fpgas")
                 # copy xdma driver
-                self.fpga_node_xdma()
+                self.fpga_node_xdma(script)
                 # load xdma
-                self.load_xdma()
+                self.load_xdma(script)
 
             # setup nbd/qcow infra
-            self.sim_node_qcow()
+            self.sim_node_qcow(script)
             # load nbd module
-            self.load_nbd_module()
+            self.load_nbd_module(script)
 
             if not metasim_enabled:
                 # clear/flash fpgas
-                self.clear_fpgas()
-                self.flash_fpgas()
+                self.clear_fpgas(script)
+                self.flash_fpgas(script)
 
                 # re-load XDMA
-                self.load_xdma()
+                self.load_xdma(script)
 
                 # restart (or start form scratch) ila server
-                self.kill_ila_server()
-                self.start_ila_server()
+                self.kill_ila_server(script)
+                self.start_ila_server(script)
+
+            script.run()
 
         if self.instance_assigned_switches():
             # all nodes could have a switch
@@ -3,7 +3,6 @@
 from __future__ import annotations
 
 from absl import logging
-import json
 import os
 from pathlib import Path
 
@@ -11,6 +10,7 @@ from fabric.api import run, cd, put  # type: ignore
 from fabric.contrib.project import rsync_project  # type: ignore
 
 from runtools.instance_deploy_manager import InstanceDeployManager
+from runtools.remote_script import RemoteScript
 from runtools.utils import check_script, script_path
 from buildtools.utils import get_deploy_dir
 
@@ -29,111 +29,126 @@ class XilinxAlveoInstanceDeployManager(InstanceDeployManager):
         super().__init__(parent_node)
         self.PLATFORM_NAME = None
 
-    def load_xdma(self) -> None:
+    def load_xdma(self, script: Optional[RemoteScript] = None) -> None:
         """load the xdma kernel module."""
         if self.instance_assigned_simulations():
-            # load xdma if unloaded
-            if run("lsmod | grep -wq xdma", warn_only=True).return_code != 0:
-                self.instance_logger("Loading XDMA Driver Kernel Module.")
-                # must be installed to this path on sim. machine
+            with self.batched(script, "load xdma") as s:
+                # load xdma if unloaded. must be installed to this path on sim.
+                # machine
                 cmd = f"{script_path}/firesim-load-xdma-module"
-                check_script(cmd)
-                run(f"sudo {cmd}", shell=True)
-            else:
-                self.instance_logger("XDMA Driver Kernel Module already loaded.")
-            cmd = f"{script_path}/firesim-chmod-xdma-perm"
-            check_script(cmd)
-            run(f"sudo {cmd}")
+                s.add_check_script(cmd)
+                s.add(
+                    "Load XDMA kernel module",
+                    f"lsmod | grep -wq xdma && echo 'XDMA Driver Kernel Module already loaded.' || sudo {cmd}",
+                )
+                cmd = f"{script_path}/firesim-chmod-xdma-perm"
+                s.add_check_script(cmd)
+                s.add("Change XDMA permissions", f"sudo {cmd}")
 
-    def unload_xdma(self) -> None:
+    def unload_xdma(self, script: Optional[RemoteScript] = None) -> None:
         """unload the xdma kernel module."""
         if self.instance_assigned_simulations():
-            # unload xdma if loaded
-            if run("lsmod | grep -wq xdma", warn_only=True).return_code == 0:
-                self.instance_logger("Unloading XDMA Driver Kernel Module.")
+            with self.batched(script, "unload xdma") as s:
+                # unload xdma if loaded
                 cmd = f"{script_path}/firesim-remove-xdma-module"
-                check_script(cmd)
-                run(f"sudo {cmd}", shell=True)
-            else:
-                self.instance_logger("XDMA Driver Kernel Module already unloaded.")
+                s.add_check_script(cmd)
+                s.add(
+                    "Unload XDMA kernel module",
+                    f"if lsmod | grep -wq xdma; then sudo {cmd}; else echo 'XDMA Driver Kernel Module already unloaded.'; fi",
+                )
 
     def slot_to_bdf(self, slotno: int, json_db: str) -> str:
         # get fpga information from db
         self.instance_logger(f"""Determine BDF for {slotno}""")
-        collect = run(f"cat {json_db}")
-        db = json.loads(collect)
+        db = self.device_inventory.get_fpga_db(json_db)
         assert slotno < len(
             db
         ), f"Less FPGAs available than slots ({slotno} >= {len(db)})"
         return db[slotno]["bdf"]
 
-    def flash_fpgas(self) -> None:
+    def flash_fpgas(self, script: Optional[RemoteScript] = None) -> None:
         if self.instance_assigned_simulations():
             self.instance_logger("""Flash all FPGA Slots.""")
 
-            for slotno, firesimservernode in enumerate(self.parent_node.sim_slots):
-                serv = firesimservernode
-                hwcfg = serv.get_resolved_server_hardware_config()
-
-                bitstream_tar = hwcfg.get_bitstream_tar_filename()
-                remote_sim_dir = self.get_remote_sim_dir_for_slot(slotno)
-                bitstream_tar_unpack_dir = os.path.join(
-                    remote_sim_dir, str(self.PLATFORM_NAME)
-                )
-                bit = os.path.join(bitstream_tar_unpack_dir, "firesim.bit")
-
-                # at this point the tar file is in the sim slot
-                run(f"rm -rf {bitstream_tar_unpack_dir}")
-                run(f"tar xvf {remote_sim_dir}/{bitstream_tar} -C {remote_sim_dir}")
-
-                self.instance_logger(f"""Copying FPGA flashing scripts for {slotno}""")
-                rsync_cap = rsync_project(
-                    local_dir=f"../platforms/{self.PLATFORM_NAME}/scripts",
-                    remote_dir=remote_sim_dir,
-                    ssh_opts="-o StrictHostKeyChecking=no",
-                    extra_opts="-L -p",
-                    capture=True,
-                )
-                logging.debug(rsync_cap)
-                logging.debug(rsync_cap.stderr)
-
-                json_db = self.parent_node.get_fpga_db()
-                bdf = self.slot_to_bdf(slotno, json_db)
-
-                self.instance_logger(
-                    f"""Flashing FPGA Slot: {slotno} ({bdf}) with bitstream: {bit}"""
-                )
-                # Use a system wide installed firesim-fpga-util.py
-                cmd = f"{script_path}/firesim-fpga-util.py"
-                check_script(
-                    cmd,
-                    Path(
-                        f"{get_deploy_dir()}/../platforms/{self.PLATFORM_NAME}/scripts"
-                    ),
-                )
-                run(f"""{cmd} --bitstream {bit} --bdf {bdf} --fpga-db {json_db}""")
-
-    def change_pcie_perms(self) -> None:
+            json_db = self.parent_node.get_fpga_db()
+
+            with self.batched(script, "flash fpgas") as s:
+                for slotno, firesimservernode in enumerate(self.parent_node.sim_slots):
+                    serv = firesimservernode
+                    hwcfg = serv.get_resolved_server_hardware_config()
+
+                    bitstream_tar = hwcfg.get_bitstream_tar_filename()
+                    remote_sim_dir = self.get_remote_sim_dir_for_slot(slotno)
+                    bitstream_tar_unpack_dir = os.path.join(
+                        remote_sim_dir, str(self.PLATFORM_NAME)
+                    )
+                    bit = os.path.join(bitstream_tar_unpack_dir, "firesim.bit")
+
+                    self.instance_logger(
+                        f"""Copying FPGA flashing scripts for {slotno}"""
+                    )
+                    rsync_cap = rsync_project(
+                        local_dir=f"../platforms/{self.PLATFORM_NAME}/scripts",
+                        remote_dir=remote_sim_dir,
+                        ssh_opts="-o StrictHostKeyChecking=no",
+                        extra_opts=f"-L -p --rsync-path='mkdir -p {remote_sim_dir} && rsync'",
+                        capture=True,
+                    )
+                    logging.debug(rsync_cap)
+                    logging.debug(rsync_cap.stderr)
+
+                    # at this point the tar file is in the sim slot
+                    s.add(
+                        f"Remove old bitstream of slot {slotno}",
+                        f"rm -rf {bitstream_tar_unpack_dir}",
+                    )
+                    s.add(
+                        f"Extract bitstream of slot {slotno}",
+                        f"tar xvf {remote_sim_dir}/{bitstream_tar} -C {remote_sim_dir}",
+                    )
+
+                    bdf = self.slot_to_bdf(slotno, json_db)
+
+                    self.instance_logger(
+                        f"""Flashing FPGA Slot: {slotno} ({bdf}) with bitstream: {bit}"""
+                    )
+                    # Use a system wide installed firesim-fpga-util.py
+                    cmd = f"{script_path}/firesim-fpga-util.py"
+                    s.add_check_script(
+                        cmd,
+                        Path(
+                            f"{get_deploy_dir()}/../platforms/{self.PLATFORM_NAME}/scripts"
+                        ),
+                    )
+                    s.add(
+                        f"Flash FPGA slot {slotno}",
+                        f"""{cmd} --bitstream {bit} --bdf {bdf} --fpga-db {json_db}""",
+                    )
+
+    def change_pcie_perms(self, script: Optional[RemoteScript] = None) -> None:
         if self.instance_assigned_simulations():
             self.instance_logger("""Change permissions on FPGA slot""")
 
-            for slotno, firesimservernode in enumerate(self.parent_node.sim_slots):
-                bdf = self.slot_to_bdf(slotno, self.parent_node.get_fpga_db())
+            json_db = self.parent_node.get_fpga_db()
 
-                self.instance_logger(
-                    f"""Changing permissions on FPGA Slot: {slotno} (bdf:{bdf})"""
-                )
-                cmd = f"{script_path}/firesim-change-pcie-perms"
-                check_script(cmd)
-                run(f"""sudo {cmd} 0000:{bdf}""")
+            with self.batched(script, "change pcie permissions") as s:
+                for slotno, firesimservernode in enumerate(self.parent_node.sim_slots):
+                    bdf = self.slot_to_bdf(slotno, json_db)
 
-    def change_all_pcie_perms(self) -> None:
-        collect = run("lspci | grep -i xilinx")
+                    self.instance_logger(
+                        f"""Changing permissions on FPGA Slot: {slotno} (bdf:{bdf})"""
+                    )
+                    cmd = f"{script_path}/firesim-change-pcie-perms"
+                    s.add_check_script(cmd)
+                    s.add(
+                        f"Change permissions of FPGA slot {slotno}",
+                        f"""sudo {cmd} 0000:{bdf}""",
+                    )
 
+    def change_all_pcie_perms(self) -> None:
         bdfs = [
             {"busno": "0x" + i[:2], "devno": "0x" + i[3:5], "capno": "0x" + i[6:7]}
-            for i in collect.splitlines()
-            if len(i.strip()) >= 0
+            for i in self.device_inventory.get_pci_devices("xilinx")
         ]
         for bdf in bdfs:
             busno = bdf["busno"]
@@ -154,20 +169,27 @@ class XilinxAlveoInstanceDeployManager(InstanceDeployManager):
         if self.instance_assigned_simulations():
             # This is a sim-host node.
 
+            # remote steps are batched into a single script
+            script = RemoteScript("infrasetup")
+
             # copy sim infrastructure
-            for slotno in range(len(self.parent_node.sim_slots)):
-                self.copy_sim_slot_infrastructure(slotno, uridir)
-                self.extract_driver_tarball(slotno)
+            self.setup_sim_slots(uridir, script)
 
             if not metasim_enabled:
                 # unload xdma driver
-                self.unload_xdma()
+                self.unload_xdma(script)
                 # flash fpgas
-                self.flash_fpgas()
+                self.flash_fpgas(script)
                 # load xdma driver
-                self.load_xdma()
+                self.load_xdma(script)
                 # change pcie permissions
-                self.change_pcie_perms()
+                self.change_pcie_perms(script)
+
+            script.run()
+
+            if not metasim_enabled:
+                # flashing rescans the PCIe bus
+                self.device_inventory.invalidate()
 
         if self.instance_assigned_switches():
             # all nodes could have a switch
@@ -225,7 +247,7 @@ class XilinxAlveoInstanceDeployManager(InstanceDeployManager):
         bitstream = f"{remote_sim_dir}/{self.PLATFORM_NAME}/firesim.bit"
 
         with cd(remote_sim_dir):
-            run(f"tar -xf {hwcfg.get_driver_tar_filename()}")
+            run(hwcfg.get_driver_tar_extract_command())
 
         # at this point the tar file is in the sim slot
         run(f"rm -rf {bitstream_tar_unpack_dir}")
@@ -251,6 +273,9 @@ class XilinxAlveoInstanceDeployManager(InstanceDeployManager):
         if self.instance_assigned_simulations():
             # This is a sim-host node.
 
+            # devices are rescanned and the FPGA database is regenerated
+            self.device_inventory.invalidate()
+
             # unload xdma driver
             self.unload_xdma()
             # load xdma driver
@@ -261,6 +286,7 @@ class XilinxAlveoInstanceDeployManager(InstanceDeployManager):
 
             # run the passes
             self.create_fpga_database(uridir)
+            self.device_inventory.invalidate()
 
     def terminate_instance(self) -> None:
         """XilinxAlveoInstanceDeployManager machines cannot be terminated."""
@@ -5,7 +5,8 @@ from __future__ import annotations
 from fabric.api import run, cd, put  # type: ignore
 
 from runtools.instance_deploy_manager import InstanceDeployManager
-from runtools.utils import check_script, script_path
+from runtools.remote_script import RemoteScript
+from runtools.utils import script_path
 
 from typing import Optional, TYPE_CHECKING
 
@@ -23,123 +24,132 @@ class XilinxVCU118InstanceDeployManager(InstanceDeployManager):
         super().__init__(parent_node)
         self.PLATFORM_NAME = "xilinx_vcu118"
 
-    def load_xdma(self) -> None:
+    def load_xdma(self, script: Optional[RemoteScript] = None) -> None:
         """load the xdma kernel module."""
         if self.instance_assigned_simulations():
-            # load xdma if unloaded
-            if run("lsmod | grep -wq xdma", warn_only=True).return_code != 0:
-                self.instance_logger("Loading XDMA Driver Kernel Module.")
-                # must be installed to this path on sim. machine
+            with self.batched(script, "load xdma") as s:
+                # load xdma if unloaded. must be installed to this path on sim.
+                # machine
                 cmd = f"{script_path}/firesim-load-xdma-module"
-                check_script(cmd)
-                run(f"sudo {cmd}", shell=True)
-            else:
-                self.instance_logger("XDMA Driver Kernel Module already loaded.")
-            cmd = f"{script_path}/firesim-chmod-xdma-perm"
-            check_script(cmd)
-            run(f"sudo {cmd}")
+                s.add_check_script(cmd)
+                s.add(
+                    "Load XDMA kernel module",
+                    f"lsmod | grep -wq xdma && echo 'XDMA Driver Kernel Module already loaded.' || sudo {cmd}",
+                )
+                cmd = f"{script_path}/firesim-chmod-xdma-perm"
+                s.add_check_script(cmd)
+                s.add("Change XDMA permissions", f"sudo {cmd}")
 
-    def load_xvsec(self) -> None:
+    def load_xvsec(self, script: Optional[RemoteScript] = None) -> None:
         """load the xvsec kernel modules."""
         if self.instance_assigned_simulations():
-            if run("lsmod | grep -wq xvsec", warn_only=True).return_code != 0:
-                self.instance_logger("Loading XVSEC Driver Kernel Module.")
+            with self.batched(script, "load xvsec") as s:
                 # must be installed to this path on sim. machine
                 cmd = f"{script_path}/firesim-load-xvsec-module"
-                check_script(cmd)
-                run(f"sudo {cmd}", shell=True)
-            else:
-                self.instance_logger("XVSEC Driver Kernel Module already loaded.")
+                s.add_check_script(cmd)
+                s.add(
+                    "Load XVSEC kernel modules",
+                    f"lsmod | grep -wq xvsec && echo 'XVSEC Driver Kernel Module already loaded.' || sudo {cmd}",
+                )
 
-    def flash_fpgas(self) -> None:
+    def flash_fpgas(self, script: Optional[RemoteScript] = None) -> None:
         if self.instance_assigned_simulations():
             self.instance_logger("""Flash all FPGA Slots.""")
 
-            for slotno, firesimservernode in enumerate(self.parent_node.sim_slots):
-                serv = self.parent_node.sim_slots[slotno]
-                hwcfg = serv.get_resolved_server_hardware_config()
-
-                bitstream_tar = hwcfg.get_bitstream_tar_filename()
-                remote_sim_dir = self.get_remote_sim_dir_for_slot(slotno)
-                bitstream_tar_unpack_dir = f"{remote_sim_dir}/{self.PLATFORM_NAME}"
-                bit = f"{remote_sim_dir}/{self.PLATFORM_NAME}/firesim.bit"
-
-                # at this point the tar file is in the sim slot
-                run(f"rm -rf {bitstream_tar_unpack_dir}")
-                run(f"tar xvf {remote_sim_dir}/{bitstream_tar} -C {remote_sim_dir}")
-
-                self.instance_logger(f"""Determine BDF for {slotno}""")
-                collect = run("lspci | grep -i xilinx")
-
-                # TODO: is "Partial Reconfig Clear File" useful (see xvsecctl help)?
-                bdfs = [
+            devices = self.device_inventory.get_pci_devices("xilinx")
+
+            with self.batched(script, "flash fpgas") as s:
+                for slotno, firesimservernode in enumerate(self.parent_node.sim_slots):
+                    serv = self.parent_node.sim_slots[slotno]
+                    hwcfg = serv.get_resolved_server_hardware_config()
+
+                    bitstream_tar = hwcfg.get_bitstream_tar_filename()
+                    remote_sim_dir = self.get_remote_sim_dir_for_slot(slotno)
+                    bitstream_tar_unpack_dir = f"{remote_sim_dir}/{self.PLATFORM_NAME}"
+                    bit = f"{remote_sim_dir}/{self.PLATFORM_NAME}/firesim.bit"
+
+                    # at this point the tar file is in the sim slot
+                    s.add(
+                        f"Remove old bitstream of slot {slotno}",
+                        f"rm -rf {bitstream_tar_unpack_dir}",
+                    )
+                    s.add(
+                        f"Extract bitstream of slot {slotno}",
+                        f"tar xvf {remote_sim_dir}/{bitstream_tar} -C {remote_sim_dir}",
+                    )
+
+                    # TODO: is "Partial Reconfig Clear File" useful (see xvsecctl help)?
+                    device = devices[slotno]
+                    busno = "0x" + device[:2]
+                    devno = "0x" + device[3:5]
                     # capno is hardcoded to 0x1 otherwise xvsecctl program fails
-                    {"busno": "0x" + i[:2], "devno": "0x" + i[3:5], "capno": "0x1"}
-                    for i in collect.splitlines()
-                    if len(i.strip()) >= 0
-                ]
-                bdf = bdfs[slotno]
-
-                busno = bdf["busno"]
-                devno = bdf["devno"]
-                capno = bdf["capno"]
-
-                self.instance_logger(
-                    f"""Flashing FPGA Slot: {slotno} (bus:{busno}, dev:{devno}, cap:{capno}) with bit: {bit}"""
-                )
-                cmd = f"{script_path}/firesim-xvsecctl-flash-fpga"
-                check_script(cmd)
-                run(f"""sudo {cmd} {busno} {devno} {capno} {bit}""")
-
-    def change_pcie_perms(self) -> None:
+                    capno = "0x1"
+
+                    self.instance_logger(
+                        f"""Flashing FPGA Slot: {slotno} (bus:{busno}, dev:{devno}, cap:{capno}) with bit: {bit}"""
+                    )
+                    cmd = f"{script_path}/firesim-xvsecctl-flash-fpga"
+                    s.add_check_script(cmd)
+                    s.add(
+                        f"Flash FPGA slot {slotno}",
+                        f"""sudo {cmd} {busno} {devno} {capno} {bit}""",
+                    )
+
+            if script is None:
+                # flashing rescans the PCIe bus
+                self.device_inventory.invalidate()
+
+    def change_pcie_perms(self, script: Optional[RemoteScript] = None) -> None:
+        """Change the permissions of the PCIe devices of the FPGAs. The
+        devices are read when the steps are queued, so this must be queued
+        after the FPGAs were flashed and the device inventory invalidated."""
         if self.instance_assigned_simulations():
             self.instance_logger("""Change permissions on FPGA slot""")
 
-            for slotno, firesimservernode in enumerate(self.parent_node.sim_slots):
-                self.instance_logger(f"""Determine BDF for {slotno}""")
-                collect = run("lspci | grep -i xilinx")
+            devices = self.device_inventory.get_pci_devices("xilinx")
 
-                # TODO: is "Partial Reconfig Clear File" useful (see xvsecctl help)?
-                bdfs = [
+            with self.batched(script, "change pcie permissions") as s:
+                for slotno, firesimservernode in enumerate(self.parent_node.sim_slots):
+                    device = devices[slotno]
+                    busno = "0x" + device[:2]
+                    devno = "0x" + device[3:5]
                     # Cannot hardcode capno to 0x1 here, if 0x1 change permissions sometimes cannot find the device in /sys/bus/pci/devices/
-                    {
-                        "busno": "0x" + i[:2],
-                        "devno": "0x" + i[3:5],
-                        "capno": "0x" + i[6:7],
-                    }
-                    for i in collect.splitlines()
-                    if len(i.strip()) >= 0
-                ]
-                bdf = bdfs[slotno]
-
-                busno = bdf["busno"]
-                devno = bdf["devno"]
-                capno = bdf["capno"]
-
-                self.instance_logger(
-                    f"""Changing permissions on FPGA Slot: {slotno} (bus:{busno}, dev:{devno}, cap:{capno})"""
-                )
-                cmd = f"{script_path}/firesim-change-pcie-perms"
-                check_script(cmd)
-                run(f"""sudo {cmd} 0000:{busno[2:]}:{devno[2:]}:{capno[2:]}""")
+                    capno = "0x" + device[6:7]
+
+                    self.instance_logger(
+                        f"""Changing permissions on FPGA Slot: {slotno} (bus:{busno}, dev:{devno}, cap:{capno})"""
+                    )
+                    cmd = f"{script_path}/firesim-change-pcie-perms"
+                    s.add_check_script(cmd)
+                    s.add(
+                        f"Change permissions of FPGA slot {slotno}",
+                        f"""sudo {cmd} 0000:{busno[2:]}:{devno[2:]}:{capno[2:]}""",
+                    )
 
     def infrasetup_instance(self, uridir: str) -> None:
         """Handle infrastructure setup for this platform."""
         if self.instance_assigned_simulations():
             # This is a sim-host node.
 
+            # remote steps are batched into a single script
+            script = RemoteScript("infrasetup")
+
             # copy sim infrastructure
-            for slotno in range(len(self.parent_node.sim_slots)):
-                self.copy_sim_slot_infrastructure(slotno, uridir)
-                self.extract_driver_tarball(slotno)
+            self.setup_sim_slots(uridir, script)
 
             if not self.parent_node.metasimulation_enabled:
                 # load xdma driver
-                self.load_xdma()
-                self.load_xvsec()
+                self.load_xdma(script)
+                self.load_xvsec(script)
                 # flash fpgas
-                self.flash_fpgas()
-                # change pcie permissions
+                self.flash_fpgas(script)
+
+            script.run()
+
+            if not self.parent_node.metasimulation_enabled:
+                # flashing rescans the PCIe bus, so the PCIe functions to change
+                # permissions of are only known once the flash script ran
+                self.device_inventory.invalidate()
                 self.change_pcie_perms()
 
         if self.instance_assigned_switches():
@@ -175,9 +185,8 @@ class XilinxVCU118InstanceDeployManager(InstanceDeployManager):
 
             if not self.parent_node.metasimulation_enabled:
                 self.instance_logger(f"""Determine BDF for {slotno}""")
-                collect = run("lspci | grep -i xilinx")
-                bdfs = [i[:7] for i in collect.splitlines() if len(i.strip()) >= 0]
-                bdf = bdfs[slotno].replace(".", ":").split(":")
+                devices = self.device_inventory.get_pci_devices("xilinx")
+                bdf = devices[slotno][:7].replace(".", ":").split(":")
                 extra_args = f"+domain=0x0000 +bus=0x{bdf[0]} +device=0x{bdf[1]} +function=0x0 +bar=0x0 +pci-vendor=0x10ee +pci-device=0x903f"
             else:
                 extra_args = None
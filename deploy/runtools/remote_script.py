@@ -0,0 +1,185 @@
+""" Batching of remote commands. Steps queued on a RemoteScript are shipped to
+a run farm host as one generated bash script, run in a single round trip, and
+the exit code, run time and output of each step are parsed back from markers
+the script prints. """
+
+from __future__ import annotations
+
+from absl import logging
+from fabric.api import env, hide, run, settings  # type: ignore
+from pathlib import Path
+import shlex
+
+from runtools.utils import get_md5
+from buildtools.utils import get_deploy_dir
+
+from typing import List, Optional, Set
+
+STEP_BEGIN_MARKER = "@@FIRESIM_STEP_BEGIN"
+STEP_END_MARKER = "@@FIRESIM_STEP_END"
+
+
+class ScriptStep:
+    """A command queued on a RemoteScript and, once the script ran, its
+    result. return_code is None if the step did not run because an earlier
+    step failed."""
+
+    description: str
+    command: str
+    cwd: Optional[str]
+    warn_only: bool
+    error: Optional[str]
+    return_code: Optional[int]
+    millis: Optional[int]
+    output: List[str]
+
+    def __init__(
+        self,
+        description: str,
+        command: str,
+        cwd: Optional[str],
+        warn_only: bool,
+        error: Optional[str],
+    ) -> None:
+        self.description = description
+        self.command = command
+        self.cwd = cwd
+        self.warn_only = warn_only
+        self.error = error
+        self.return_code = None
+        self.millis = None
+        self.output = []
+
+    def failed(self) -> bool:
+        return self.return_code is not None and self.return_code != 0
+
+
+class RemoteScript:
+    """Steps to run on the current fabric host (env.host_string). Steps run
+    in order, each in its own subshell. A failing step stops the script
+    unless it was added with warn_only, like run() and warn_only() do. Steps
+    should be idempotent, since a failed script is simply run again by the
+    next manager command."""
+
+    name: str
+    steps: List[ScriptStep]
+    checked_scripts: Set[str]
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.steps = []
+        self.checked_scripts = set()
+
+    def add(
+        self,
+        description: str,
+        command: str,
+        cwd: Optional[str] = None,
+        warn_only: bool = False,
+        error: Optional[str] = None,
+    ) -> ScriptStep:
+        """Queue command. error replaces the generic message raised if it
+        fails."""
+        step = ScriptStep(description, command, cwd, warn_only, error)
+        self.steps.append(step)
+        return step
+
+    def add_check_script(
+        self, remote_script_str: str, search_dir: Optional[Path] = None
+    ) -> None:
+        """Queue the equivalent of runtools.utils.check_script: compare the
+        md5 of a remote script with the one in the local FireSim repo."""
+        if remote_script_str in self.checked_scripts:
+            return
+        self.checked_scripts.add(remote_script_str)
+
+        if search_dir is None:
+            search_dir = Path(f"{get_deploy_dir()}/sudo-scripts")
+        remote_script = Path(remote_script_str)
+        local_script = f"{search_dir}/{remote_script.name}"
+        self.add(
+            f"Check {remote_script}",
+            f"""p=$(command -v {shlex.quote(remote_script_str)}) && echo "{get_md5(local_script)}  $p" | md5sum -c --status""",
+            error=f"""{remote_script} (on remote) differs from the current FireSim version of {local_script}. Ensure the proper FireSim scripts are sourced (and are the same version as this FireSim)""",
+        )
+
+    def render(self) -> str:
+        """Return the bash script that runs all steps."""
+        lines = []
+        for i, step in enumerate(self.steps):
+            body = step.command
+            if step.cwd is not None:
+                body = f"cd {step.cwd} && {body}"
+            lines += [
+                f"echo '{STEP_BEGIN_MARKER} {i}'",
+                "t0=$(date +%s%N)",
+                f"( {body}\n) 2>&1",
+                "rc=$?",
+                # end the output of the step with a newline, so that the end
+                # marker always starts a line of its own
+                "echo",
+                f'echo "{STEP_END_MARKER} {i} $rc $(( ($(date +%s%N) - t0) / 1000000 ))"',
+            ]
+            if not step.warn_only:
+                lines.append('[ "$rc" -eq 0 ] || exit "$rc"')
+        return "\n".join(lines) + "\n"
+
+    def parse(self, output: str) -> None:
+        """Fill in the results of the steps from the script output."""
+        current: Optional[ScriptStep] = None
+        for line in output.splitlines():
+            line = line.rstrip("\r")
+            fields = line.split()
+            if line.startswith(STEP_BEGIN_MARKER) and len(fields) == 2:
+                current = self.steps[int(fields[1])]
+            elif line.startswith(STEP_END_MARKER) and len(fields) == 4:
+                step = self.steps[int(fields[1])]
+                # drop the line ended by the echo before the marker if the
+                # step's own output already ended in a newline
+                if step.output and step.output[-1] == "":
+                    step.output.pop()
+                step.return_code = int(fields[2])
+                step.millis = int(fields[3])
+                current = None
+            elif current is not None:
+                current.output.append(line)
+
+    def run(self) -> List[ScriptStep]:
+        """Run all queued steps on the current host in one round trip and
+        return them with their results. Raises if a step that was not added
+        with warn_only fails."""
+        if not self.steps:
+            return []
+
+        with hide("output"), settings(warn_only=True):
+            result = run(self.render())
+        self.parse(result)
+
+        host = env.host_string
+        total = sum(step.millis or 0 for step in self.steps)
+        logging.debug(
+            f"[{host}] Ran {self.name} ({len(self.steps)} steps) in {total / 1000:.1f}s"
+        )
+        for step in self.steps:
+            if step.return_code is None:
+                logging.debug(f"[{host}]   {step.description}: skipped")
+                continue
+            logging.debug(
+                f"[{host}]   {step.description}: exit code {step.return_code}, {step.millis}ms"
+            )
+            for line in step.output:
+                logging.debug(f"[{host}]     {line}")
+
+        for step in self.steps:
+            if step.failed() and not step.warn_only:
+                logging.info(f"[{host}] {step.description} failed:")
+                for line in step.output:
+                    logging.info(f"[{host}]     {line}")
+                raise Exception(
+                    step.error
+                    or f"{step.description} failed on {host} with exit code {step.return_code}: {step.command}"
+                )
+        if result.return_code != 0 and not any(s.failed() for s in self.steps):
+            # the script itself could not run
+            raise Exception(f"Unable to run {self.name} on {host}:\n{result}")
+        return self.steps
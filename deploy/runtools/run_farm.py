@@ -3,10 +3,20 @@ from __future__ import annotations
 from absl import logging
 import abc
 import os
+import time
 
 from utils.inheritors import inheritors
 
-from typing import Any, Dict, Type, Optional, List, Union, Tuple, TYPE_CHECKING
+from typing import (
+    Any,
+    Dict,
+    Type,
+    Optional,
+    List,
+    Union,
+    Tuple,
+    TYPE_CHECKING,
+)
 from mypy_boto3_ec2.service_resource import Instance as EC2InstanceResource
 from runtools.instance_deploy_manager import InstanceDeployManager
 from runtools.topology.elements import (
@@ -41,6 +51,7 @@ class RunHost(metaclass=abc.ABCMeta):
     # switch variables
     # restricted by default security group network model port alloc (10000 to 11000)
     MAX_SWITCH_AND_PIPE_SLOTS_ALLOWED: int = 1000
+    MAX_HOST_PORTS_ALLOWED: int = 1000
     switch_slots: List[FireSimSwitchNode]
     _next_switch_port: int
 
@@ -135,7 +146,7 @@ class RunHost(metaclass=abc.ABCMeta):
         will return a new port."""
         retport = self._next_switch_port
         assert (
-            retport < 11000
+            retport < 10000 + self.MAX_HOST_PORTS_ALLOWED
         ), "Exceeded number of ports used on host. You will need to modify your security groups to increase this value."
         self._next_switch_port += 1
         return retport
@@ -155,6 +166,40 @@ class RunHost(metaclass=abc.ABCMeta):
         self.run_farm.terminate_by_inst(self)
 
 
+class RunHostReadiness:
+    """Tracks run hosts until they accept SSH connections, so that early hosts
+    can be set up while later ones are still booting. Hosts that firesim did
+    not launch are ready right away.
+
+    Attributes:
+        pending: Hosts that were not ready yet.
+    """
+
+    # seconds between polls in wait_for_any
+    POLL_INTERVAL: float = 5.0
+
+    pending: List[RunHost]
+
+    def __init__(self, hosts: List[RunHost]) -> None:
+        self.pending = list(hosts)
+
+    def poll(self) -> List[RunHost]:
+        """Return the hosts that became ready since the last poll, without
+        waiting."""
+        ready, self.pending = self.pending, []
+        return ready
+
+    def wait_for_any(self) -> List[RunHost]:
+        """Wait until at least one pending host is ready, and return the hosts
+        that became ready."""
+        while self.pending:
+            ready = self.poll()
+            if ready:
+                return ready
+            time.sleep(self.POLL_INTERVAL)
+        return []
+
+
 class RunFarm(metaclass=abc.ABCMeta):
     """Abstract class to represent how to manage run farm hosts (similar to `BuildFarm`).
     In addition to having to implement how to spawn/terminate nodes, the child classes must
@@ -248,7 +293,11 @@ class RunFarm(metaclass=abc.ABCMeta):
 
     def allocate_sim_host(self, sim_host_handle: str) -> RunHost:
         """Let user allocate and use an run host (assign sims, etc.) given it's handle."""
-        logging.info(f"run_farm_hosts_dict {self.run_farm_hosts_dict}")
+        # don't log the whole run_farm_hosts_dict here, formatting it on every
+        # allocation is quadratic in the number of hosts
+        logging.debug(
+            f"allocating {sim_host_handle} #{self.mapper_consumed[sim_host_handle]}"
+        )
         inst_tup = self.run_farm_hosts_dict[sim_host_handle][
             self.mapper_consumed[sim_host_handle]
         ]
@@ -293,6 +342,10 @@ class RunFarm(metaclass=abc.ABCMeta):
         """Launch run hosts for simulations."""
         raise NotImplementedError
 
+    def host_readiness(self, hosts: List[RunHost]) -> RunHostReadiness:
+        """Track when the bound run hosts accept SSH connections."""
+        return RunHostReadiness(hosts)
+
     @abc.abstractmethod
     def terminate_run_farm(
         self, terminate_some_dict: Dict[str, int], forceterminate: bool
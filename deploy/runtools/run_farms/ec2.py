@@ -14,6 +14,8 @@ from awstools.awstools import (
     get_private_ips_for_instances,
     launch_run_instances,
     wait_on_instance_launches,
+    InstanceReadinessPoller,
+    INSTANCE_POLL_INTERVAL,
     terminate_instances,
     get_instance_ids_for_instances,
     aws_resource_names,
@@ -23,7 +25,7 @@ from utils.inheritors import inheritors
 from utils.io import firesim_input
 from runtools.instance_deploy_manager import InstanceDeployManager
 from runtools.instance_deploy_managers.ec2 import EC2InstanceDeployManager
-from runtools.run_farm import RunFarm, RunHost
+from runtools.run_farm import RunFarm, RunHost, RunHostReadiness
 
 from typing import Any, Dict, Optional, List, Union, Tuple, TYPE_CHECKING
 from mypy_boto3_ec2.service_resource import Instance as EC2InstanceResource
@@ -32,6 +34,41 @@ if TYPE_CHECKING:
     from runtools.topology.elements import FireSimSwitchNode, FireSimServerNode
 
 
+class EC2RunHostReadiness(RunHostReadiness):
+    """Polls the instances of run hosts with an InstanceReadinessPoller. Hosts
+    bound to mock instances are ready right away."""
+
+    POLL_INTERVAL = INSTANCE_POLL_INTERVAL
+
+    def __init__(self, run_farm: AWSEC2F1, hosts: List[RunHost]) -> None:
+        super().__init__(hosts)
+        wanted = set(hosts)
+        self.by_instance_id: Dict[str, RunHost] = {}
+        self.mocked: List[RunHost] = []
+        instances: List[EC2InstanceResource] = []
+        for sim_host_handle in sorted(run_farm.SIM_HOST_HANDLE_TO_MAX_FPGA_SLOTS):
+            for inst, boto in run_farm.run_farm_hosts_dict[sim_host_handle]:
+                if inst not in wanted:
+                    continue
+                assert boto is not None, f"{inst.get_host()} is not bound"
+                if isinstance(boto, MockBoto3Instance):
+                    self.mocked.append(inst)
+                else:
+                    self.by_instance_id[boto.id] = inst
+                    instances.append(boto)
+        # mock runs must not talk to AWS
+        self.poller = (
+            InstanceReadinessPoller(instances, wait_for_ssh=True) if instances else None
+        )
+
+    def poll(self) -> List[RunHost]:
+        ready, self.mocked = self.mocked, []
+        if self.poller is not None:
+            ready += [self.by_instance_id[i.id] for i in self.poller.poll()]
+        self.pending = [host for host in self.pending if host not in ready]
+        return ready
+
+
 class AWSEC2F1(RunFarm):
     """This manages the set of AWS resources requested for the run farm.
 
@@ -255,11 +292,21 @@ class AWSEC2F1(RunFarm):
             )
 
         # wait for instances to get to running state, so that they have been
-        # assigned IP addresses
-        for sim_host_handle in sorted(self.SIM_HOST_HANDLE_TO_MAX_FPGA_SLOTS):
-            wait_on_instance_launches(
-                launched_instance_objs[sim_host_handle], sim_host_handle
-            )
+        # assigned IP addresses. instances of all types are waited on together.
+        # infrasetup waits for each of them to accept SSH connections, see
+        # host_readiness
+        sim_host_handles = sorted(self.SIM_HOST_HANDLE_TO_MAX_FPGA_SLOTS)
+        wait_on_instance_launches(
+            [
+                instance
+                for sim_host_handle in sim_host_handles
+                for instance in launched_instance_objs[sim_host_handle]
+            ],
+            ", ".join(sim_host_handles),
+        )
+
+    def host_readiness(self, hosts: List[RunHost]) -> RunHostReadiness:
+        return EC2RunHostReadiness(self, hosts)
 
     def terminate_run_farm(
         self, terminate_some_dict: Dict[str, int], forceterminate: bool
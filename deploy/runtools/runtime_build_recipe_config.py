@@ -34,6 +34,7 @@ class RuntimeBuildRecipeConfig(RuntimeHWConfig):
         self.bitstream_tar = None
         self.driver_tar = None
         self.tarball_built = False
+        self.driver_tar_codec = "gzip"
 
         self.uri_list = []
 
@@ -5,6 +5,8 @@ from __future__ import annotations
 
 from absl import logging
 from absl import flags
+import os
+import pprint
 from time import strftime, gmtime
 
 from typing import Tuple, List
@@ -15,6 +17,12 @@ from runtools.run_farm import RunFarm
 from runtools.workload import WorkloadConfig
 from runtools.topology.core_with_passes import FireSimTopologyWithPasses
 from runtools.runtime_build_recipes import RuntimeBuildRecipes
+from runtools.utils import is_on_aws
+from runtools.topology_snapshot import (
+    snapshot_key,
+    save_topology_snapshot,
+    load_topology_snapshot,
+)
 
 
 FLAGS = flags.FLAGS
@@ -32,6 +40,22 @@ flags.DEFINE_multi_string(
 )
 
 
+flags.DEFINE_bool(
+    "usetopologysnapshot",
+    True,
+    "Reuse the mapped topology saved by infrasetup in boot, runworkload, and kill when the topology and run farm configuration are unchanged. Set to false to always recompute the topology.",
+)
+
+flags.DEFINE_integer(
+    "driverbuildjobs",
+    os.cpu_count() or 1,
+    "Maximum number of make jobs used to build simulation drivers. Drivers for different hardware configurations are built concurrently within this limit. Set to 1 to build drivers one at a time.",
+)
+
+# tasks that can reuse the topology snapshot saved by infrasetup
+SNAPSHOT_CONSUMER_TASKS = ["boot", "runworkload", "kill"]
+
+
 def terminatesomesplitter(raw_arg: str) -> Tuple[str, int]:
     """Splits a string of form 'instance_type:count' into a tuple."""
     split_arg = raw_arg.split(":")
@@ -68,6 +92,7 @@ class RuntimeConfig:
     workload: WorkloadConfig
     firesim_topology_with_passes: FireSimTopologyWithPasses
     runtime_build_recipes: RuntimeBuildRecipes
+    topology_snapshot_key: str
 
     def __init__(self) -> None:
         """This reads runtime configuration files, massages them into formats that
@@ -103,29 +128,67 @@ class RuntimeConfig:
                 "null.json", self.launch_time, self.innerconf.suffixtag
             )
 
-        # start constructing the target configuration tree
-        self.firesim_topology_with_passes = FireSimTopologyWithPasses(
-            self.innerconf.topology,
-            self.innerconf.no_net_num_nodes,
-            self.run_farm,
-            self.runtimehwdb,
-            self.innerconf.defaulthwconfig,
-            self.workload,
-            self.innerconf.linklatency,
-            self.innerconf.switchinglatency,
-            self.innerconf.netbandwidth,
-            self.innerconf.profileinterval,
-            self.innerconf.tracerv_config,
-            self.innerconf.autocounter_config,
-            self.innerconf.hostdebug_config,
-            self.innerconf.synthprint_config,
-            self.innerconf.partition_config,
-            self.innerconf.terminateoncompletion,
-            self.runtime_build_recipes,
-            self.innerconf.metasimulation_enabled,
-            self.innerconf.default_plusarg_passthrough,
+        topology_args = dict(
+            user_topology_name=self.innerconf.topology,
+            no_net_num_nodes=self.innerconf.no_net_num_nodes,
+            run_farm=self.run_farm,
+            hwdb=self.runtimehwdb,
+            defaulthwconfig=self.innerconf.defaulthwconfig,
+            workload=self.workload,
+            defaultlinklatency=self.innerconf.linklatency,
+            defaultswitchinglatency=self.innerconf.switchinglatency,
+            defaultnetbandwidth=self.innerconf.netbandwidth,
+            defaultprofileinterval=self.innerconf.profileinterval,
+            defaulttracervconfig=self.innerconf.tracerv_config,
+            defaultautocounterconfig=self.innerconf.autocounter_config,
+            defaulthostdebugconfig=self.innerconf.hostdebug_config,
+            defaultsynthprintconfig=self.innerconf.synthprint_config,
+            defaultpartitionconfig=self.innerconf.partition_config,
+            terminateoncompletion=self.innerconf.terminateoncompletion,
+            build_recipes=self.runtime_build_recipes,
+            default_metasim_mode=self.innerconf.metasimulation_enabled,
+            default_plusarg_passthrough=self.innerconf.default_plusarg_passthrough,
+            host_mapping=self.innerconf.host_mapping,
+            uplink_routing=self.innerconf.uplink_routing,
+            driver_build_jobs=FLAGS.driverbuildjobs,
+            diagram_config=self.innerconf.diagram_config,
         )
 
+        # the snapshot is keyed by what determines the mapping of the topology
+        # onto the run farm. everything else (hwdb, workload, default params) is
+        # re-applied by the passes that depend on it.
+        self.topology_snapshot_key = snapshot_key(
+            [self.innerconf.run_farm_base_recipe],
+            [
+                self.innerconf.topology,
+                str(self.innerconf.no_net_num_nodes),
+                self.innerconf.host_mapping,
+                str(self.innerconf.metasimulation_enabled),
+                type(self.run_farm).__name__,
+                pprint.pformat(self.run_farm.args),
+            ],
+        )
+
+        snapshot = None
+        if FLAGS.usetopologysnapshot and FLAGS.task in SNAPSHOT_CONSUMER_TASKS:
+            snapshot = load_topology_snapshot(self.topology_snapshot_key)
+
+        if snapshot is not None:
+            self.firesim_topology_with_passes = snapshot
+            self.run_farm = snapshot.run_farm
+            # only re-runs passes whose inputs changed. this always includes
+            # job assignment since results directories are named by launch time
+            snapshot.reconfigure(**topology_args)
+        else:
+            # start constructing the target configuration tree
+            self.firesim_topology_with_passes = FireSimTopologyWithPasses(
+                **topology_args
+            )
+
+        # probe the environment before tasks fork per host, so that they all
+        # share the result
+        is_on_aws()
+
     def launch_run_farm(self) -> None:
         """directly called by top-level launchrunfarm command."""
         self.run_farm.launch_run_farm()
@@ -144,6 +207,10 @@ class RuntimeConfig:
         # set this to True if you want to use mock boto3 instances for testing
         # the manager.
         use_mock_instances_for_testing = False
+        # save the mapped topology before it is bound to the launched hosts
+        save_topology_snapshot(
+            self.firesim_topology_with_passes, self.topology_snapshot_key
+        )
         self.firesim_topology_with_passes.infrasetup_passes(
             use_mock_instances_for_testing
         )
@@ -1,14 +1,14 @@
 from __future__ import annotations
 
-from absl import logging
+from absl import flags, logging
 import os
 import sys
+from contextlib import contextmanager
 from pathlib import Path
 
 from fabric.api import local, run, prefix  # type: ignore
 from fabric.operations import _stdoutString  # type: ignore
 from tempfile import TemporaryDirectory
-from os.path import join as pjoin
 
 from awstools.afitools import (
     get_firesim_deploy_quintuplet_for_agfi,
@@ -20,8 +20,10 @@ from buildtools.utils import get_deploy_dir
 from utils.streamlogger import InfoStreamLogger
 from utils.export import create_export_string
 from runtools.uri_container import URIContainer
+from runtools import driver_cache
+from runtools.driver_tarball import extract_command, write_driver_tarball
 
-from typing import Optional, Dict, Any, List, Sequence, Tuple, TYPE_CHECKING
+from typing import Optional, Dict, Any, Iterator, List, Sequence, Tuple, TYPE_CHECKING
 
 if TYPE_CHECKING:
     from runtools.utils import MacAddress
@@ -35,6 +37,20 @@ if TYPE_CHECKING:
 LOCAL_DRIVERS_BASE = "../sim/output"
 LOCAL_DRIVERS_GENERATED_SRC = "../sim/generated-src"
 CUSTOM_RUNTIMECONFS_BASE = "../sim/custom-runtime-configs"
+# output of concurrent driver builds, relative to the deploy dir
+DRIVER_BUILD_LOGS_DIR = "logs/driver-builds"
+
+FLAGS = flags.FLAGS
+
+
+@contextmanager
+def sim_build_context() -> Iterator[None]:
+    """Run fabric commands in firesim/sim with the manager environment
+    sourced."""
+    with prefix(f"cd {get_deploy_dir()}/.."), prefix(
+        create_export_string({"RISCV", "PATH", "LD_LIBRARY_PATH"})
+    ), prefix("source sourceme-manager.sh --skip-ssh-setup"), prefix("cd sim/"):
+        yield
 
 
 class RuntimeHWConfig:
@@ -56,6 +72,8 @@ class RuntimeHWConfig:
     # note whether we've built a copy of the simulation driver for this hwconf
     driver_built: bool
     tarball_built: bool
+    # compression of the driver tarball, if we built it
+    driver_tar_codec: str
     additional_required_files: List[Tuple[str, str]]
     driver_name_prefix: str
     local_driver_base_dir: str
@@ -90,6 +108,7 @@ class RuntimeHWConfig:
         self.platform = None
         self.driver_built = False
         self.tarball_built = False
+        self.driver_tar_codec = "gzip"
         self.additional_required_files = []
         self.driver_name_prefix = ""
         self.driver_type_message = "FPGA software"
@@ -539,11 +558,9 @@ class RuntimeHWConfig:
             logging.warning(f"FPGA index {target_split_fpga_idx} is not a number")
             return self.get_partition_fpga_cnt() - 1
 
-    def build_sim_driver(self) -> None:
-        """Build driver for running simulation"""
-        if self.driver_built:
-            # we already built the driver at some point
-            return
+    def get_driver_build_make_args(self) -> str:
+        """Return the make arguments (run in firesim/sim) that build the
+        driver for this configuration."""
         # TODO there is a duplicate of this in runtools
         quintuplet_pieces = self.get_deployquintuplet_pieces_for_config()
         target_project_makefrag = self.get_deploymakefrag_for_config()
@@ -552,20 +569,52 @@ class RuntimeHWConfig:
         design = quintuplet_pieces[2]
         target_config = quintuplet_pieces[3]
         platform_config = quintuplet_pieces[4]
+        return f"PLATFORM={self.get_platform()} TARGET_PROJECT={target_project} {extra_target_project_make_args(target_project, target_project_makefrag, get_deploy_dir())} DESIGN={design} TARGET_CONFIG={target_config} PLATFORM_CONFIG={platform_config} {self.get_driver_build_target()}"
+
+    def local_driver_output_path(self) -> Path:
+        """return the absolute local path of the driver used to run this sim."""
+        return Path(get_deploy_dir()) / self.get_local_driver_path()
+
+    def use_cached_driver(self) -> bool:
+        """If a driver built by an earlier manager invocation is up to date
+        (see driver_cache.py), mark the driver as built. Returns whether it
+        was."""
+        hit = driver_cache.cache_hit(
+            self.local_driver_output_path(), driver_cache.driver_build_key(self)
+        )
+        if hit:
+            logging.info(
+                f"Driver cache hit for {self.get_deployquintuplet_for_config()}, skipping driver build"
+            )
+            self.driver_built = True
+        return hit
+
+    def record_driver_build(self) -> None:
+        """Record a successful driver build in the driver cache."""
+        driver_cache.record(
+            self.local_driver_output_path(), driver_cache.driver_build_key(self)
+        )
+
+    def build_sim_driver(self) -> None:
+        """Build driver for running simulation"""
+        if self.driver_built:
+            # we already built the driver at some point
+            return
+        if self.use_cached_driver():
+            return
         logging.info(
-            f"Building {self.driver_type_message} driver for {str(self.get_deployquintuplet_for_config())}"
+            f"Driver cache miss. Building {self.driver_type_message} driver for {str(self.get_deployquintuplet_for_config())}"
         )
 
-        deploy_dir = get_deploy_dir()
-        with InfoStreamLogger("stdout"), prefix(f"cd {deploy_dir}/.."), prefix(
-            create_export_string({"RISCV", "PATH", "LD_LIBRARY_PATH"})
-        ), prefix("source sourceme-manager.sh --skip-ssh-setup"), prefix("cd sim/"):
-            driverbuildcommand = f"make PLATFORM={self.get_platform()} TARGET_PROJECT={target_project} {extra_target_project_make_args(target_project, target_project_makefrag, deploy_dir)} DESIGN={design} TARGET_CONFIG={target_config} PLATFORM_CONFIG={platform_config} {self.get_driver_build_target()}"
+        driver_cache.invalidate(self.local_driver_output_path())
+        with InfoStreamLogger("stdout"), sim_build_context():
+            driverbuildcommand = f"make {self.get_driver_build_make_args()}"
             buildresult = run(driverbuildcommand)
             self.handle_failure(
                 buildresult, "driver build", "firesim/sim", driverbuildcommand
             )
 
+        self.record_driver_build()
         self.driver_built = True
 
     def build_sim_tarball(
@@ -574,52 +623,37 @@ class RuntimeHWConfig:
         tarball_name: str,
     ) -> None:
         """Take the simulation driver and tar it. build_sim_driver()
-        must run before this function.  Rsync is used in a mode where it's copying
-        from local paths to a local folder. This is confusing as rsync traditionally is
-        used for copying from local folders to a remote folder. The variable local_remote_dir is
-        named as a reminder that it's actually pointing at this local machine"""
+        must run before this function. paths are (local path, path in the
+        tarball) pairs, see driver_tarball.tarball_members."""
         if self.tarball_built:
             # we already built it
             return
 
-        # builddir is a temporary directory created by TemporaryDirectory()
-        # the path a folder is under /tmp/ with a random name
-        # After this scope block exists, the entire folder is deleted
-        with TemporaryDirectory() as builddir:
-
-            with InfoStreamLogger("stdout"), prefix(f"cd {get_deploy_dir()}"):
-                for local_path, remote_path in paths:
-                    # The `rsync_project()` function does not allow
-                    # copying between two local directories.
-                    # This uses the same option flags but operates rsync in local->local mode
-                    options = "-pthrvz -L"
-                    local_dir = local_path
-                    local_remote_dir = pjoin(builddir, remote_path)
-                    cmd = f"rsync {options} {local_dir} {local_remote_dir}"
-
-                    results = run(cmd)
-                    self.handle_failure(results, "local rsync", get_deploy_dir(), cmd)
-
-            # This must be taken outside of a cd context
-            cmd = f"mkdir -p {self.local_quintuplet_path()}"
-            results = run(cmd)
-            self.handle_failure(results, "local mkdir", builddir, cmd)
-            absolute_tarball_path = self.local_quintuplet_path() / tarball_name
-
-            with InfoStreamLogger("stdout"), prefix(f"cd {builddir}"):
-                findcmd = 'find . -mindepth 1 -maxdepth 1 -printf "%P\n"'
-                taroptions = "-czvf"
-
-                # Running through find and xargs is the most simple way I've found to meet these requirements:
-                #   * create the tar with no leading ./ or foldername
-                #   * capture all types of hidden files (.a ..a .aa)
-                #   * avoid capturing the parent folder (..) with globs looking for hidden files
-                cmd = f"{findcmd} | xargs tar {taroptions} {absolute_tarball_path}"
-
-                results = run(cmd)
-                self.handle_failure(results, "tarball", builddir, cmd)
-
-            self.tarball_built = True
+        codec = FLAGS.drivertarballcodec
+        quintuplet = self.get_deployquintuplet_for_config()
+        absolute_tarball_path = self.local_quintuplet_path() / tarball_name
+        key = driver_cache.tarball_key(quintuplet, tarball_name, paths, codec)
+        if driver_cache.cache_hit(absolute_tarball_path, key):
+            logging.info(
+                f"Driver tarball cache hit for {quintuplet}, reusing {absolute_tarball_path}"
+            )
+        else:
+            logging.info(
+                f"Driver tarball cache miss. Creating {absolute_tarball_path} ({codec})"
+            )
+            driver_cache.invalidate(absolute_tarball_path)
+            write_driver_tarball(
+                paths, Path(get_deploy_dir()), absolute_tarball_path, codec
+            )
+            driver_cache.record(absolute_tarball_path, key)
+
+        self.driver_tar_codec = codec
+        self.tarball_built = True
+
+    def get_driver_tar_extract_command(self) -> str:
+        """Return the command that extracts the driver tarball in the sim slot
+        directory of a run farm host."""
+        return extract_command(self.driver_tar_codec, self.get_driver_tar_filename())
 
     def __str__(self) -> str:
         return """RuntimeHWConfig: {}\nDeployQuintuplet: {}\nDeployMakefrag: {}\nAGFI: {}\nBitstream tar: {}\nCustomRuntimeConf: {}""".format(
@@ -630,3 +664,84 @@ class RuntimeHWConfig:
             self.bitstream_tar,
             str(self.customruntimeconfig),
         )
+
+
+def build_sim_drivers(hwconfigs: Sequence[RuntimeHWConfig], jobs: int) -> None:
+    """Build the drivers of all hwconfigs. Configurations that share a driver
+    are built once. With more than one job, distinct drivers are built
+    concurrently by sub-makes of a single make -j{jobs}, so the make jobserver
+    bounds the total number of jobs across all builds. The output of each
+    build goes to its own log and all failed builds are reported together."""
+    builds: Dict[str, List[RuntimeHWConfig]] = {}
+    for hwconfig in hwconfigs:
+        if not hwconfig.driver_built and not hwconfig.use_cached_driver():
+            builds.setdefault(hwconfig.get_driver_build_make_args(), []).append(
+                hwconfig
+            )
+
+    if jobs <= 1 or len(builds) <= 1:
+        for group in builds.values():
+            group[0].build_sim_driver()
+            for hwconfig in group[1:]:
+                hwconfig.driver_built = True
+        return
+
+    log_dir = Path(get_deploy_dir()) / DRIVER_BUILD_LOGS_DIR
+    log_dir.mkdir(parents=True, exist_ok=True)
+    logging.info(f"Building {len(builds)} drivers with up to {jobs} jobs")
+
+    with TemporaryDirectory() as builddir:
+        targets: List[Tuple[str, List[RuntimeHWConfig], Path, Path]] = []
+        rules = ""
+        for make_args, group in builds.items():
+            name = f"driver{len(targets)}"
+            log_name = f"{group[0].get_deployquintuplet_for_config()}-{group[0].get_driver_build_target()}"
+            if any(log.name == f"{log_name}.log" for _, _, log, _ in targets):
+                log_name += f"-{len(targets)}"
+            log = log_dir / f"{log_name}.log"
+            status = Path(builddir) / f"{name}.status"
+            driver_cache.invalidate(group[0].local_driver_output_path())
+            targets.append((name, group, log, status))
+            logging.info(
+                f"Driver cache miss. Building {group[0].driver_type_message} driver for {group[0].get_deployquintuplet_for_config()}. Output in {log}"
+            )
+            # '+' and $(MAKE) let the sub-make join the jobserver. the recipe
+            # never fails so that all builds run to completion.
+            rules += f"{name}:\n\t+$(MAKE) {make_args.replace('$', '$$')} > {log} 2>&1; echo $$? > {status}\n"
+
+        makefile = Path(builddir) / "Makefile"
+        with open(makefile, "w") as f:
+            f.write(f".PHONY: all {' '.join(t[0] for t in targets)}\n")
+            f.write(f"all: {' '.join(t[0] for t in targets)}\n")
+            f.write(rules)
+
+        with InfoStreamLogger("stdout"), sim_build_context():
+            buildcommand = f"make -j{jobs} -f {makefile} all"
+            buildresult = run(buildcommand)
+            targets[0][1][0].handle_failure(
+                buildresult, "driver build", "firesim/sim", buildcommand
+            )
+
+        failed = []
+        for name, group, log, status in targets:
+            returncode = status.read_text().strip() if status.exists() else None
+            if returncode == "0":
+                group[0].record_driver_build()
+                for hwconfig in group:
+                    hwconfig.driver_built = True
+            else:
+                failed.append((group, log))
+
+    for group, log in failed:
+        log_tail = ""
+        if log.exists():
+            with open(log, "r", errors="replace") as f:
+                log_tail = "".join(f.readlines()[-20:])
+        logging.error(
+            f"{group[0].driver_type_message} driver build for {group[0].get_deployquintuplet_for_config()} failed. Last lines of {log}:\n{log_tail}"
+        )
+    if failed:
+        logging.info(
+            f"{len(failed)} of {len(targets)} driver builds failed. Exiting. See the logs above for details."
+        )
+        sys.exit(1)
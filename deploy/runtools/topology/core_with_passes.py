@@ -5,6 +5,7 @@ from __future__ import annotations
 import time
 import os
 import pprint
+import absl.flags
 import absl.logging
 import logging
 import datetime
@@ -23,6 +24,14 @@ from runtools.topology.elements import (
     FireSimSwitchNode,
 )
 from runtools.topology.core import FireSimTopology
+from runtools.topology.diagram import TopologyDiagramConfig, create_topology_diagram
+from runtools.topology.host_mapping import MinCutHostMapper
+from runtools.topology.pass_manager import PassManager, topology_pass
+from runtools.topology.switching import check_path_diversity, compute_switch_table
+from runtools.deploy_pipeline import DeploymentPipeline, order_by_missing_artifacts
+from runtools.artifact_distribution import ArtifactDistribution
+from runtools.nbd_tracker import NBDTracker
+from runtools.runtime_hw_config import build_sim_drivers
 from runtools.utils import MacAddress
 from runtools.simulation_configs.tracerv import TracerVConfig
 from runtools.simulation_configs.autocounter import AutoCounterConfig
@@ -31,15 +40,45 @@ from runtools.simulation_configs.synth_print import SynthPrintConfig
 from runtools.simulation_configs.partition import PartitionConfig
 
 from runtools.instance_deploy_manager import InstanceDeployManager
-from typing import Dict, Any, cast, List, Set, TYPE_CHECKING, Optional
+from typing import (
+    Dict,
+    Any,
+    Callable,
+    cast,
+    List,
+    Set,
+    TYPE_CHECKING,
+    Optional,
+    Union,
+)
 
 if TYPE_CHECKING:
-    from runtools.run_farm import RunFarm
+    from runtools.run_farm import RunFarm, RunHost
     from runtools.runtime_hwdb import RuntimeHWDB
     from runtools.runtime_build_recipes import RuntimeBuildRecipes
     from runtools.runtime_hw_config import RuntimeHWConfig
     from runtools.workload import WorkloadConfig
 
+FLAGS = absl.flags.FLAGS
+
+# inputs that determine the structure of the topology
+TOPOLOGY_INPUTS = ["user_topology_name", "no_net_num_nodes"]
+
+# the phase one passes, in the order they are run
+PHASE_ONE_PASSES = [
+    "pass_assign_mac_addresses",
+    "pass_compute_switching_tables",
+    "pass_perform_host_node_mapping",
+    "pass_apply_default_hwconfig",
+    "pass_apply_default_params",
+    "pass_assign_jobs",
+    "pass_allocate_nbd_devices",
+    "pass_create_topology_diagram",
+]
+
+# constructor arguments that can't change for an already mapped topology
+STRUCTURAL_ARGS = TOPOLOGY_INPUTS + ["default_metasim_mode", "host_mapping"]
+
 
 @parallel
 def instance_liveness() -> None:
@@ -92,7 +131,7 @@ class FireSimTopologyWithPasses:
     on the topology to map it all the way to something usable to deploy a simulation.
     """
 
-    passes_used: List[str]
+    pass_manager: PassManager
     user_topology_name: str
     no_net_num_nodes: int
     run_farm: RunFarm
@@ -111,6 +150,14 @@ class FireSimTopologyWithPasses:
     defaultsynthprintconfig: SynthPrintConfig
     defaultpartitionconfig: PartitionConfig
     terminateoncompletion: bool
+    host_mapping: str
+    uplink_routing: str
+    driver_build_jobs: int
+    diagram_config: TopologyDiagramConfig
+    user_server_hardware_configs: Optional[
+        Dict[FireSimServerNode, Union[RuntimeHWConfig, str]]
+    ]
+    user_node_params: Optional[Dict[FireSimNode, Dict[str, Any]]]
 
     def __init__(
         self,
@@ -133,8 +180,12 @@ class FireSimTopologyWithPasses:
         build_recipes: RuntimeBuildRecipes,
         default_metasim_mode: bool,
         default_plusarg_passthrough: str,
+        host_mapping: str = "greedy",
+        uplink_routing: str = "ecmp",
+        driver_build_jobs: int = 1,
+        diagram_config: Optional[TopologyDiagramConfig] = None,
     ) -> None:
-        self.passes_used = []
+        self.pass_manager = PassManager()
         self.user_topology_name = user_topology_name
         self.no_net_num_nodes = no_net_num_nodes
         self.run_farm = run_farm
@@ -155,12 +206,37 @@ class FireSimTopologyWithPasses:
         self.defaultpartitionconfig = defaultpartitionconfig
         self.default_metasim_mode = default_metasim_mode
         self.default_plusarg_passthrough = default_plusarg_passthrough
+        self.host_mapping = host_mapping
+        self.uplink_routing = uplink_routing
+        self.driver_build_jobs = driver_build_jobs
+        self.diagram_config = (
+            diagram_config if diagram_config is not None else TopologyDiagramConfig({})
+        )
+        self.user_server_hardware_configs = None
+        self.user_node_params = None
 
         self.phase_one_passes()
 
+    def reconfigure(self, **kwargs: Any) -> None:
+        """Update the configuration of an already constructed (e.g. loaded from
+        a snapshot) topology, using the same arguments as the constructor, then
+        re-run only the phase one passes whose inputs changed. The run farm
+        the topology was mapped onto is kept."""
+        for name in STRUCTURAL_ARGS:
+            if kwargs[name] != getattr(self, name):
+                raise Exception(
+                    f"Unable to change {name} of an already mapped topology."
+                )
+        kwargs.pop("run_farm")
+        for name, value in kwargs.items():
+            assert hasattr(self, name), f"Unknown topology argument {name}"
+            setattr(self, name, value)
+
+        self.phase_one_passes()
+
+    @topology_pass(inputs=TOPOLOGY_INPUTS, outputs=["mac_addresses"])
     def pass_assign_mac_addresses(self) -> None:
         """DFS through the topology to assign mac addresses"""
-        self.passes_used.append("pass_assign_mac_addresses")
 
         nodes_dfs_order = self.firesimtopol.get_dfs_order()
         MacAddress.reset_allocator()
@@ -168,6 +244,9 @@ class FireSimTopologyWithPasses:
             if isinstance(node, FireSimServerNode) and node.mac_address_assignable():
                 node.assign_mac_address(MacAddress())
 
+    @topology_pass(
+        inputs=["mac_addresses", "uplink_routing"], outputs=["switching_tables"]
+    )
     def pass_compute_switching_tables(self) -> None:
         """This creates the MAC addr -> port lists for switch nodes.
 
@@ -181,14 +260,10 @@ class FireSimTopologyWithPasses:
         It is assumed that downlinks take ports [0, num downlinks) and
         uplinks take ports [num downlinks, num downlinks + num uplinks)
 
-        This will currently just assume that there is one uplink, since the
-        switch models do not handle load balancing across multiple paths.
+        Switches with multiple uplinks spread non-local MACs across them as
+        selected by uplink_routing (see runtools/topology/switching.py).
         """
 
-        # this pass requires mac addresses to already be assigned
-        assert "pass_assign_mac_addresses" in self.passes_used
-        self.passes_used.append("pass_compute_switching_tables")
-
         nodes_dfs_order = self.firesimtopol.get_dfs_order()
         for node in nodes_dfs_order:
             if isinstance(node, FireSimServerNode):
@@ -204,51 +279,36 @@ class FireSimTopologyWithPasses:
 
         switches_dfs_order = self.firesimtopol.get_dfs_order_switches()
 
+        num_macs = MacAddress.next_mac_to_allocate()
         for switch in switches_dfs_order:
-            uplinkportno = len(switch.downlinks)
-
-            # prepopulate the table with the last port, which will be
-            switchtab = [uplinkportno for x in range(MacAddress.next_mac_to_allocate())]
-            for port_no in range(len(switch.downlinks)):
-                portmacs = switch.downlinks[port_no].get_downlink_side().downlinkmacs
-                for mac in portmacs:
-                    switchtab[mac.as_int_no_prefix()] = port_no
-
-            switch.switch_table = switchtab
+            switch.switch_table = compute_switch_table(
+                switch, num_macs, self.uplink_routing
+            )
 
+        if self.uplink_routing == "ecmp":
+            check_path_diversity(switches_dfs_order)
+
+    @topology_pass(
+        inputs=[
+            "switching_tables",
+            "host_node_mapping",
+            "server_hardware_configs",
+            "jobs",
+            "diagram_config",
+        ],
+        outputs=[],
+    )
     def pass_create_topology_diagram(self) -> None:
-        """Produce a PDF that shows a diagram of the network.
+        """Produce a diagram of the network (see runtools/topology/diagram.py).
         Useful for debugging passes to see what has been done to particular
         nodes."""
-        from graphviz import Digraph  # type: ignore
-
-        gviz_graph = Digraph(
-            "gviz_graph",
-            filename="generated-topology-diagrams/firesim_topology"
-            + self.user_topology_name
-            + ".gv",
-            node_attr={"shape": "record", "height": ".1"},
+        create_topology_diagram(
+            self.user_topology_name,
+            self.firesimtopol.roots,
+            self.firesimtopol.get_dfs_order(),
+            self.diagram_config,
         )
 
-        # add all nodes to the graph
-        nodes_dfs_order = self.firesimtopol.get_dfs_order()
-        for node in nodes_dfs_order:
-            nodehost = node.get_host_instance()
-            with gviz_graph.subgraph(
-                name="cluster_" + str(nodehost), node_attr={"shape": "box"}
-            ) as cluster:
-                cluster.node(str(node), node.diagramstr())
-                cluster.attr(label=str(nodehost))
-
-        # add all edges to the graph
-        switches_dfs_order = self.firesimtopol.get_dfs_order_switches()
-        for node in switches_dfs_order:
-            for downlink in node.downlinks:
-                downlink_side = downlink.get_downlink_side()
-                gviz_graph.edge(str(node), str(downlink_side))
-
-        gviz_graph.render(view=False)
-
     def pass_no_net_host_mapping(self) -> None:
         # only if we have no networks - pack simulations
         # assumes the user has provided enough or more slots
@@ -308,6 +368,43 @@ class FireSimTopologyWithPasses:
             else:
                 assert False, "Mixed downlinks currently not supported." ""
 
+    def pass_min_cut_host_node_mapping(self) -> None:
+        """Map nodes to hosts such that the number of links crossing hosts
+        (weighted by link bandwidth) is minimized. Cross-host links are
+        implemented with TCP socket ports which are much slower than the
+        shared-memory ports used for links within a host."""
+        mapper = MinCutHostMapper(
+            self.firesimtopol.roots,
+            self.firesimtopol.get_dfs_order(),
+            self.run_farm,
+            self.defaultnetbandwidth,
+        )
+        assignment = mapper.map()
+
+        num_links, weight = mapper.cut_size(assignment)
+        greedy_cut = mapper.greedy_cut_size()
+        greedy_str = (
+            f"{greedy_cut[0]} links ({greedy_cut[1]} Gbit/s)"
+            if greedy_cut is not None
+            else "unsupported topology"
+        )
+        absl.logging.info(
+            f"Min-cut host mapping: {num_links} cross-host links ({weight} Gbit/s) on {len(mapper.used_bins())} hosts. Greedy mapping: {greedy_str}."
+        )
+
+        hosts = {}
+        for host_bin in mapper.used_bins():
+            hosts[host_bin] = self.run_farm.allocate_sim_host(host_bin.handle)
+
+        for node in self.firesimtopol.get_dfs_order():
+            if node not in assignment:
+                # FireSimDummyServerNodes are handled by their supernode
+                continue
+            if isinstance(node, FireSimSwitchNode):
+                hosts[assignment[node]].add_switch(node)
+            elif isinstance(node, FireSimServerNode):
+                hosts[assignment[node]].add_simulation(node)
+
     def pass_simple_partitioned_host_node_mapping(self) -> None:
         """A partitioned simulation topo without any networking simulation on top."""
         pipes = self.firesimtopol.get_dfs_order_pipes()
@@ -438,6 +535,12 @@ class FireSimTopologyWithPasses:
             elif any([isinstance(x, FireSimServerNode) for x in downlinknodes]):
                 assert False, "MIXED DOWNLINKS NOT SUPPORTED."
 
+    # host mapping consumes run farm hosts, so it must only run once per topology.
+    # reconfigure() rejects changes to the inputs listed here.
+    @topology_pass(
+        inputs=TOPOLOGY_INPUTS + ["host_mapping", "run_farm.args"],
+        outputs=["host_node_mapping"],
+    )
     def pass_perform_host_node_mapping(self) -> None:
         """This pass assigns host nodes to nodes in the abstract FireSim
         configuration tree.
@@ -464,7 +567,10 @@ class FireSimTopologyWithPasses:
             ):
                 # now, we're handling the cycle-accurate networked simulation case
                 # currently, we only handle the case where
-                self.pass_simple_networked_host_node_mapping()
+                if self.host_mapping == "min_cut":
+                    self.pass_min_cut_host_node_mapping()
+                else:
+                    self.pass_simple_networked_host_node_mapping()
             elif all(
                 [
                     isinstance(x, FireSimServerNode) or isinstance(x, FireSimPipeNode)
@@ -486,6 +592,11 @@ class FireSimTopologyWithPasses:
         else:
             assert False, "IMPROPER MAPPING CONFIGURATION"
 
+    @topology_pass(
+        inputs=TOPOLOGY_INPUTS
+        + ["hwdb", "build_recipes", "defaulthwconfig", "default_metasim_mode"],
+        outputs=["server_hardware_configs"],
+    )
     def pass_apply_default_hwconfig(self) -> None:
         """This is the default mapping pass for hardware configurations - it
         does 3 things:
@@ -501,8 +612,17 @@ class FireSimTopologyWithPasses:
         if self.default_metasim_mode:
             runtimehwconfig_lookup_fn = self.build_recipes.get_runtimehwconfig_from_name
 
+        if self.user_server_hardware_configs is None:
+            # remember what the topology specified so that this pass can be
+            # re-run when the defaults or the hwdb change
+            self.user_server_hardware_configs = {}
+            for server in servers:
+                user_hw_cfg = server.get_server_hardware_config()
+                if user_hw_cfg is not None:
+                    self.user_server_hardware_configs[server] = user_hw_cfg
+
         for server in servers:
-            hw_cfg = server.get_server_hardware_config()
+            hw_cfg = self.user_server_hardware_configs.get(server)
             if hw_cfg is None:
                 hw_cfg = runtimehwconfig_lookup_fn(self.defaulthwconfig)
             elif isinstance(hw_cfg, str):
@@ -510,51 +630,85 @@ class FireSimTopologyWithPasses:
             absl.logging.debug(f"pass_apply_default_hwconfig, {hw_cfg}")
             server.set_server_hardware_config(hw_cfg)
 
+    @topology_pass(
+        inputs=TOPOLOGY_INPUTS
+        + [
+            "defaultlinklatency",
+            "defaultswitchinglatency",
+            "defaultnetbandwidth",
+            "defaultprofileinterval",
+            "defaulttracervconfig",
+            "defaultautocounterconfig",
+            "defaulthostdebugconfig",
+            "defaultsynthprintconfig",
+            "defaultpartitionconfig",
+            "default_plusarg_passthrough",
+        ],
+        outputs=["node_params"],
+    )
     def pass_apply_default_params(self) -> None:
         """If the user has not set per-node parameters in the topology,
         apply the defaults."""
         allnodes = self.firesimtopol.get_dfs_order()
 
-        for node in allnodes:
+        def node_defaults(node: FireSimNode) -> Dict[str, Any]:
             if isinstance(node, FireSimSwitchNode):
-                if node.switch_link_latency is None:
-                    node.switch_link_latency = self.defaultlinklatency
-                if node.switch_switching_latency is None:
-                    node.switch_switching_latency = self.defaultswitchinglatency
-                if node.switch_bandwidth is None:
-                    node.switch_bandwidth = self.defaultnetbandwidth
-
+                return {
+                    "switch_link_latency": self.defaultlinklatency,
+                    "switch_switching_latency": self.defaultswitchinglatency,
+                    "switch_bandwidth": self.defaultnetbandwidth,
+                }
             if isinstance(node, FireSimServerNode):
-                if node.server_link_latency is None:
-                    node.server_link_latency = self.defaultlinklatency
-                if node.server_bw_max is None:
-                    node.server_bw_max = self.defaultnetbandwidth
-                if node.server_profile_interval is None:
-                    node.server_profile_interval = self.defaultprofileinterval
-                if node.tracerv_config is None:
-                    node.tracerv_config = self.defaulttracervconfig
-                if node.autocounter_config is None:
-                    node.autocounter_config = self.defaultautocounterconfig
-                if node.hostdebug_config is None:
-                    node.hostdebug_config = self.defaulthostdebugconfig
-                if node.synthprint_config is None:
-                    node.synthprint_config = self.defaultsynthprintconfig
-                if node.plusarg_passthrough is None:
-                    node.plusarg_passthrough = self.default_plusarg_passthrough
-                if node.partition_config is None:
-                    node.partition_config = self.defaultpartitionconfig
-
+                return {
+                    "server_link_latency": self.defaultlinklatency,
+                    "server_bw_max": self.defaultnetbandwidth,
+                    "server_profile_interval": self.defaultprofileinterval,
+                    "tracerv_config": self.defaulttracervconfig,
+                    "autocounter_config": self.defaultautocounterconfig,
+                    "hostdebug_config": self.defaulthostdebugconfig,
+                    "synthprint_config": self.defaultsynthprintconfig,
+                    "plusarg_passthrough": self.default_plusarg_passthrough,
+                    "partition_config": self.defaultpartitionconfig,
+                }
             if isinstance(node, FireSimPipeNode):
-                if node.partition_config is None:
-                    node.partition_config = self.defaultpartitionconfig
+                return {"partition_config": self.defaultpartitionconfig}
+            return {}
+
+        if self.user_node_params is None:
+            # remember the parameters set in the topology itself so that this
+            # pass can be re-run when the defaults change
+            self.user_node_params = {}
+            for node in allnodes:
+                user_params = {}
+                for param in node_defaults(node):
+                    if getattr(node, param) is not None:
+                        user_params[param] = getattr(node, param)
+                if user_params:
+                    self.user_node_params[node] = user_params
+
+        for node in allnodes:
+            user_params = self.user_node_params.get(node, {})
+            for param, default in node_defaults(node).items():
+                setattr(node, param, user_params.get(param, default))
 
+    @topology_pass(inputs=["host_node_mapping", "jobs"], outputs=["nbd_devices"])
     def pass_allocate_nbd_devices(self) -> None:
         """allocate NBD devices. this must be done here to preserve the
         data structure for use in runworkload teardown."""
         servers = self.firesimtopol.get_dfs_order_servers()
+        # start from scratch so that re-running this pass for a new workload
+        # allocates the same devices as a fresh run would
+        for server in servers:
+            if not server.has_assigned_host_instance():
+                # FireSimDummyServerNodes are handled by their supernode
+                continue
+            deploy_manager = server.get_host_instance().instance_deploy_manager
+            if deploy_manager.nbd_tracker is not None:
+                deploy_manager.nbd_tracker = NBDTracker()
         for server in servers:
             server.allocate_nbds()
 
+    @topology_pass(inputs=TOPOLOGY_INPUTS + ["workload"], outputs=["jobs"])
     def pass_assign_jobs(self) -> None:
         """assign jobs to simulations."""
         servers = self.firesimtopol.get_dfs_order_servers()
@@ -564,7 +718,8 @@ class FireSimTopologyWithPasses:
     def phase_one_passes(self) -> None:
         """These are passes that can run without requiring host-node binding.
         i.e. can be run before you have run launchrunfarm. They're run
-        automatically when creating this object."""
+        automatically when creating this object. Passes whose inputs have not
+        changed since their last run are skipped."""
         self.pass_assign_mac_addresses()
         self.pass_compute_switching_tables()
         self.pass_perform_host_node_mapping()  # TODO: we can know ports here?
@@ -575,11 +730,14 @@ class FireSimTopologyWithPasses:
 
         self.pass_create_topology_diagram()
 
-    def pass_build_required_drivers(self) -> None:
-        """Build all simulation drivers. The method we're calling here won't actually
-        repeat the build process more than once per run of the manager."""
+        self.pass_manager.log_timings(PHASE_ONE_PASSES)
 
-        def build_drivers_helper(servers: List[FireSimServerNode]) -> None:
+    def build_drivers(self, servers: List[FireSimServerNode]) -> None:
+        """Build the simulation drivers and driver tarballs of servers. Drivers
+        and tarballs that were already built are not built again."""
+
+        def build_drivers_helper(servers: List[FireSimServerNode], jobs: int) -> None:
+            to_build: List[FireSimServerNode] = []
             for server in servers:
                 resolved_cfg = server.get_resolved_server_hardware_config()
 
@@ -589,15 +747,32 @@ class FireSimTopologyWithPasses:
                     )
                     continue  # skip building or tarballing if we have a prebuilt one
 
-                resolved_cfg.build_sim_driver()
+                to_build.append(server)
+
+            # distinct drivers are built concurrently, see build_sim_drivers
+            build_sim_drivers(
+                [server.get_resolved_server_hardware_config() for server in to_build],
+                jobs,
+            )
+
+            for server in to_build:
+                resolved_cfg = server.get_resolved_server_hardware_config()
                 resolved_cfg.build_sim_tarball(
                     server.get_tarball_files_paths(),
                     resolved_cfg.get_driver_tar_filename(),
                 )
 
-        servers = self.firesimtopol.get_dfs_order_servers()
-        execute(build_drivers_helper, servers, hosts=["localhost"])
+        execute(
+            build_drivers_helper, servers, self.driver_build_jobs, hosts=["localhost"]
+        )
+
+    @topology_pass()
+    def pass_build_required_drivers(self) -> None:
+        """Build all simulation drivers. The method we're calling here won't actually
+        repeat the build process more than once per run of the manager."""
+        self.build_drivers(self.firesimtopol.get_dfs_order_servers())
 
+    @topology_pass()
     def pass_build_required_switches(self) -> None:
         """Build all the switches required for this simulation."""
         # the way the switch models are designed, this requires hosts to be
@@ -607,47 +782,191 @@ class FireSimTopologyWithPasses:
             switch.build_switch_sim_binary()
 
     # TODO : come up with a better name...
+    @topology_pass()
     def pass_build_required_pipes(self) -> None:
         pipes = self.firesimtopol.get_dfs_order_pipes()
         for pipe in pipes:
             pipe.build_pipe_sim_binary()
 
+    @staticmethod
+    def fetch_URI_resolve_runtime_cfg(resolved_cfg: RuntimeHWConfig, dir: str) -> None:
+        resolved_cfg.fetch_all_URI(dir)
+        resolved_cfg.resolve_hwcfg_values(dir)
+
+    @topology_pass()
     def pass_fetch_URI_resolve_runtime_cfg(self, dir: str) -> None:
         """Locally download URIs, and use any URI-contained metadata to resolve runtime config values"""
         servers = self.firesimtopol.get_dfs_order_servers()
         for server in servers:
-            resolved_cfg = server.get_resolved_server_hardware_config()
-            resolved_cfg.fetch_all_URI(dir)
-            resolved_cfg.resolve_hwcfg_values(dir)
+            self.fetch_URI_resolve_runtime_cfg(
+                server.get_resolved_server_hardware_config(), dir
+            )
 
     def infrasetup_passes(self, use_mock_instances_for_testing: bool) -> None:
         """extra passes needed to do infrasetup"""
         self.run_farm.post_launch_binding(use_mock_instances_for_testing)
 
-        @parallel
-        def infrasetup_node_wrapper(run_farm: RunFarm, dir: str) -> None:
+        def infrasetup_node(run_farm: RunFarm, dir: str) -> None:
             my_node = run_farm.lookup_by_host(env.host_string)
             assert my_node is not None
             assert my_node.instance_deploy_manager is not None
             my_node.instance_deploy_manager.infrasetup_instance(dir)
 
-        all_run_farm_ips = [
-            x.get_host() for x in self.run_farm.get_all_bound_host_nodes()
-        ]
-        execute(instance_liveness, hosts=all_run_farm_ips)
+        infrasetup_node_wrapper = parallel(infrasetup_node)
+
+        all_run_farm_hosts = self.run_farm.get_all_bound_host_nodes()
+        all_run_farm_ips = [x.get_host() for x in all_run_farm_hosts]
 
         # Steps occur within the context of a tempdir.
         # This allows URI's to survive until after deploy, and cleanup upon error
         with TemporaryDirectory() as uridir:
+            fanout = FLAGS.artifactdistribution == "fanout"
+            if FLAGS.pipelinedinfrasetup and fanout:
+                absl.logging.info(
+                    "Fan-out artifact distribution needs all artifacts before deploying. Building everything first."
+                )
+            elif FLAGS.pipelinedinfrasetup:
+                self.pipelined_infrasetup(uridir, infrasetup_node)
+                return
+
+            # all hosts are set up at once, so wait for the slowest to boot
+            readiness = self.run_farm.host_readiness(all_run_farm_hosts)
+            while readiness.pending:
+                readiness.wait_for_any()
+            execute(instance_liveness, hosts=all_run_farm_ips)
+
             self.pass_fetch_URI_resolve_runtime_cfg(uridir)
             self.pass_build_required_drivers()
             self.pass_build_required_pipes()
             self.pass_build_required_switches()
 
+            if fanout:
+                self.distribute_artifacts(uridir)
+
             execute(
                 infrasetup_node_wrapper, self.run_farm, uridir, hosts=all_run_farm_ips
             )
 
+    def distribute_artifacts(self, uridir: str) -> None:
+        """Fan out the large files that several run farm hosts need, see
+        ArtifactDistribution. Requires all artifacts to be built."""
+        hosts = [
+            host
+            for host in self.run_farm.get_all_bound_host_nodes()
+            if host.instance_deploy_manager.instance_assigned_simulations()
+        ]
+        distribution = ArtifactDistribution(hosts)
+        for host in hosts:
+            for slotno in range(len(host.sim_slots)):
+                distribution.add_files(
+                    host,
+                    [
+                        local_path
+                        for local_path, _ in host.instance_deploy_manager.get_sim_slot_files(
+                            slotno, uridir
+                        )
+                    ],
+                )
+        distribution.distribute()
+
+    def pipelined_infrasetup(
+        self, uridir: str, infrasetup_node: Callable[[RunFarm, str], None]
+    ) -> None:
+        """Build the artifacts of one run farm host at a time and deploy each
+        host as soon as its artifacts are built and it accepts SSH
+        connections, see DeploymentPipeline. Hosts that need the fewest new
+        artifacts go first."""
+        hosts = self.run_farm.get_all_bound_host_nodes()
+        host_nodes: Dict[RunHost, List[FireSimNode]] = {
+            host: [*host.sim_slots, *host.pipe_slots, *host.switch_slots]
+            for host in hosts
+        }
+        # simulations share the driver of their hardware config
+        host_artifacts: Dict[RunHost, List[Any]] = {
+            host: [
+                *(
+                    server.get_resolved_server_hardware_config()
+                    for server in host.sim_slots
+                ),
+                *host.pipe_slots,
+                *host.switch_slots,
+            ]
+            for host in hosts
+        }
+        built: Set[FireSimNode] = set()
+        resolved_cfgs: Set[RuntimeHWConfig] = set()
+
+        def build_nodes(pipeline: DeploymentPipeline, nodes: List[FireSimNode]) -> None:
+            """Build the artifacts of nodes that were not built yet, in the
+            order of the phased infrasetup."""
+            nodes = [node for node in nodes if node not in built]
+            built.update(nodes)
+            servers = [node for node in nodes if isinstance(node, FireSimServerNode)]
+            for server in servers:
+                resolved_cfg = server.get_resolved_server_hardware_config()
+                if resolved_cfg not in resolved_cfgs:
+                    resolved_cfgs.add(resolved_cfg)
+                    pipeline.build(
+                        f"URIs of {resolved_cfg.name}",
+                        self.fetch_URI_resolve_runtime_cfg,
+                        resolved_cfg,
+                        uridir,
+                    )
+            if servers:
+                pipeline.build(
+                    f"drivers of {len(servers)} simulations",
+                    self.build_drivers,
+                    servers,
+                )
+            for node in nodes:
+                if isinstance(node, FireSimPipeNode):
+                    pipeline.build(
+                        f"pipe{node.pipe_id_internal}", node.build_pipe_sim_binary
+                    )
+            for node in nodes:
+                if isinstance(node, FireSimSwitchNode):
+                    pipeline.build(
+                        f"switch{node.switch_id_internal}",
+                        node.build_switch_sim_binary,
+                    )
+
+        def deploy_host(host: RunHost) -> None:
+            execute(instance_liveness, hosts=[host.get_host()])
+            execute(infrasetup_node, self.run_farm, uridir, hosts=[host.get_host()])
+
+        # hosts may still be booting, deploy each one once it is built and ready
+        readiness = self.run_farm.host_readiness(hosts)
+        ready: Set[RunHost] = set()
+        built_hosts: List[RunHost] = []
+
+        def deploy_ready_hosts(pipeline: DeploymentPipeline) -> None:
+            ready.update(readiness.poll())
+            for host in [host for host in built_hosts if host in ready]:
+                built_hosts.remove(host)
+                pipeline.deploy(host.get_host(), deploy_host, host)
+
+        with DeploymentPipeline() as pipeline:
+            for host in order_by_missing_artifacts(hosts, host_artifacts):
+                build_nodes(pipeline, host_nodes[host])
+                built_hosts.append(host)
+                deploy_ready_hosts(pipeline)
+
+            # nodes without a host of their own (e.g. supernode dummies) were
+            # built by the phased infrasetup too
+            build_nodes(
+                pipeline,
+                [
+                    *self.firesimtopol.get_dfs_order_servers(),
+                    *self.firesimtopol.get_dfs_order_pipes(),
+                    *self.firesimtopol.get_dfs_order_switches(),
+                ],
+            )
+
+            deploy_ready_hosts(pipeline)
+            while built_hosts:
+                ready.update(readiness.wait_for_any())
+                deploy_ready_hosts(pipeline)
+
     def enumerate_fpgas_passes(self, use_mock_instances_for_testing: bool) -> None:
         """extra passes needed to do enumerate_fpgas"""
         self.run_farm.post_launch_binding(use_mock_instances_for_testing)
@@ -829,6 +1148,7 @@ class FireSimTopologyWithPasses:
         )
         return None
 
+    @topology_pass()
     def pass_set_partition_configs(self) -> None:
         servers = self.firesimtopol.get_dfs_order_servers()
 
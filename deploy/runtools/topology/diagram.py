@@ -0,0 +1,455 @@
+""" Render diagrams of a mapped FireSimTopologyWithPasses.
+
+Drawing one graphviz node per simulation does not scale past a few hundred
+nodes, so large topologies are drawn "collapsed": sibling subtrees that are
+identical (same node types, hardware configs and shape, e.g. a leaf switch with
+its 8 servers) are drawn as a single aggregate node labelled with counts.
+Chosen subtrees can be expanded back to full detail. The same diagram can also
+be written as JSON or GEXF for external graph viewers. """
+
+from __future__ import annotations
+
+from absl import logging
+import json
+import os
+import xml.etree.ElementTree as ET
+from collections import Counter
+from dataclasses import dataclass
+
+from runtools.topology.elements import (
+    FireSimNode,
+    FireSimPipeNode,
+    FireSimServerNode,
+    FireSimSwitchNode,
+)
+
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+DIAGRAM_DIR = "generated-topology-diagrams"
+DIAGRAM_MODES = ["auto", "full", "collapsed", "none"]
+DIAGRAM_FORMATS = ["pdf", "json", "gexf"]
+
+
+@dataclass
+class TopologyDiagramConfig:
+    """Settings from the optional topology_diagram section of
+    config_runtime.yaml."""
+
+    mode: str
+    collapse_threshold: int
+    formats: List[str]
+    expand: List[str]
+
+    def __init__(self, args: Dict[str, Any]) -> None:
+        self.mode = args.get("mode", "auto")
+        if self.mode not in DIAGRAM_MODES:
+            raise Exception(
+                f"Invalid topology_diagram mode {self.mode}. Must be one of: {', '.join(DIAGRAM_MODES)}."
+            )
+        # auto mode collapses topologies with more nodes than this
+        self.collapse_threshold = int(args.get("collapse_threshold", 256))
+        self.formats = list(args.get("formats", ["pdf"]))
+        for f in self.formats:
+            if f not in DIAGRAM_FORMATS:
+                raise Exception(
+                    f"Invalid topology_diagram format {f}. Must be one of: {', '.join(DIAGRAM_FORMATS)}."
+                )
+        # names of nodes (e.g. switch3, server12) whose subtrees are drawn in full
+        self.expand = list(args.get("expand", []))
+
+
+def node_name(node: FireSimNode) -> str:
+    """Short name of a node that is stable across runs, e.g. switch3."""
+    if isinstance(node, FireSimServerNode):
+        return f"server{node.server_id_internal}"
+    if isinstance(node, FireSimSwitchNode):
+        return f"switch{node.switch_id_internal}"
+    if isinstance(node, FireSimPipeNode):
+        return f"pipe{node.pipe_id_internal}"
+    raise Exception(f"Unknown topology node type {type(node).__name__}")
+
+
+def _hwconfig_name(node: FireSimNode) -> Optional[str]:
+    if not isinstance(node, FireSimServerNode):
+        return None
+    hwcfg = node.server_hardware_config
+    if hwcfg is None or isinstance(hwcfg, str):
+        return hwcfg
+    return hwcfg.name
+
+
+class DiagramNode:
+    """A node of the rendered diagram. Either a single topology node or an
+    aggregate of count identical subtrees rooted at members."""
+
+    __slots__ = ("id", "kind", "label", "count", "members", "hosts", "contents")
+
+    id: str
+    kind: str
+    label: str
+    count: int
+    members: List[str]
+    hosts: List[str]
+    # node type to number of topology nodes represented by this node
+    contents: Dict[str, int]
+
+    def __init__(
+        self,
+        id: str,
+        kind: str,
+        label: str,
+        count: int,
+        members: List[str],
+        hosts: List[str],
+        contents: Dict[str, int],
+    ) -> None:
+        self.id = id
+        self.kind = kind
+        self.label = label
+        self.count = count
+        self.members = members
+        self.hosts = hosts
+        self.contents = contents
+
+    def is_aggregate(self) -> bool:
+        return self.count > 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "label": self.label,
+            "count": self.count,
+            "members": self.members,
+            "hosts": self.hosts,
+            "contents": self.contents,
+        }
+
+
+class TopologyDiagram:
+    """Format-independent diagram of a topology.
+
+    Attributes:
+        nodes: diagram nodes, parents before children
+        edges: (source id, target id, number of links) tuples
+    """
+
+    topology_name: str
+    collapsed: bool
+    nodes: List[DiagramNode]
+    edges: List[Tuple[str, str, int]]
+
+    def __init__(
+        self,
+        topology_name: str,
+        roots: Sequence[FireSimNode],
+        nodes_dfs_order: Sequence[FireSimNode],
+        collapsed: bool,
+        expand: Optional[List[str]] = None,
+    ) -> None:
+        self.topology_name = topology_name
+        self.collapsed = collapsed
+        self.nodes = []
+        self.edges = []
+
+        self._host_names: Dict[int, str] = {}
+        self._signature_ids: Dict[Tuple[Any, ...], int] = {}
+        self._signature: Dict[FireSimNode, int] = {}
+        self._tree_like: Dict[FireSimNode, bool] = {}
+        self._contents: Dict[int, Counter] = {}
+        self._compute_signatures(nodes_dfs_order)
+
+        by_name = {node_name(n): n for n in nodes_dfs_order}
+        self._expanded: Set[FireSimNode] = set()
+        self._on_expand_path: Set[FireSimNode] = set()
+        for name in expand or []:
+            if name not in by_name:
+                raise Exception(
+                    f"Unable to expand {name} in the topology diagram: no such node."
+                )
+            self._mark_expanded(by_name[name])
+
+        self._build(roots)
+
+    def _host_name(self, node: FireSimNode) -> str:
+        if not node.has_assigned_host_instance():
+            return "unmapped"
+        host = node.get_host_instance()
+        # hosts are not launched yet when the diagram is created, so name them
+        # in order of appearance
+        if id(host) not in self._host_names:
+            self._host_names[id(host)] = f"host{len(self._host_names)}"
+        return self._host_names[id(host)]
+
+    def _compute_signatures(self, nodes_dfs_order: Sequence[FireSimNode]) -> None:
+        """Give every node an id that is equal for identical subtrees.
+        nodes_dfs_order has children before parents."""
+        for node in nodes_dfs_order:
+            children = [link.get_downlink_side() for link in node.downlinks]
+            key = (
+                type(node).__name__,
+                _hwconfig_name(node),
+                tuple(sorted(self._signature[c] for c in children)),
+            )
+            if key not in self._signature_ids:
+                sig = len(self._signature_ids)
+                self._signature_ids[key] = sig
+                contents: Counter = Counter({type(node).__name__: 1})
+                for c in children:
+                    contents.update(self._contents[self._signature[c]])
+                self._contents[sig] = contents
+            self._signature[node] = self._signature_ids[key]
+            # subtrees reachable from more than one uplink can't be merged
+            self._tree_like[node] = all(
+                len(c.uplinks) <= 1 and self._tree_like[c] for c in children
+            )
+
+    def _mark_expanded(self, node: FireSimNode) -> None:
+        stack = [node]
+        while stack:
+            n = stack.pop()
+            if n not in self._expanded:
+                self._expanded.add(n)
+                stack.extend(link.get_downlink_side() for link in n.downlinks)
+        stack = [link.get_uplink_side() for link in node.uplinks]
+        while stack:
+            n = stack.pop()
+            if n not in self._on_expand_path:
+                self._on_expand_path.add(n)
+                stack.extend(link.get_uplink_side() for link in n.uplinks)
+
+    def _collapsible(self, node: FireSimNode) -> bool:
+        return (
+            self.collapsed
+            and len(node.uplinks) <= 1
+            and self._tree_like[node]
+            and node not in self._expanded
+            and node not in self._on_expand_path
+        )
+
+    def _add_single(self, node: FireSimNode) -> None:
+        kind = type(node).__name__
+        if self.collapsed and node not in self._expanded:
+            label = f"{kind}:{node_name(node)}"
+            hwcfg = _hwconfig_name(node)
+            if hwcfg is not None:
+                label += f"\n{hwcfg}"
+        else:
+            label = node.diagramstr()
+        self.nodes.append(
+            DiagramNode(
+                node_name(node),
+                kind,
+                label,
+                1,
+                [node_name(node)],
+                [self._host_name(node)],
+                {kind: 1},
+            )
+        )
+
+    def _add_aggregate(self, group: List[FireSimNode]) -> DiagramNode:
+        hosts: Set[str] = set()
+        hwcfgs: Set[str] = set()
+        stack = list(group)
+        while stack:
+            n = stack.pop()
+            hosts.add(self._host_name(n))
+            hwcfg = _hwconfig_name(n)
+            if hwcfg is not None:
+                hwcfgs.add(hwcfg)
+            stack.extend(link.get_downlink_side() for link in n.downlinks)
+
+        kind = type(group[0]).__name__
+        contents = {
+            k: v * len(group)
+            for k, v in sorted(self._contents[self._signature[group[0]]].items())
+        }
+        label = f"{len(group)} x {kind}"
+        if sum(contents.values()) > len(group):
+            label += " subtree"
+        label += "\n----------"
+        for k, v in contents.items():
+            label += f"\n{k}: {v}"
+        for hwcfg in sorted(hwcfgs):
+            label += f"\nhw: {hwcfg}"
+        label += f"\nhosts: {len(hosts)}"
+        label += f"\n({node_name(group[0])} ... {node_name(group[-1])})"
+
+        dnode = DiagramNode(
+            f"agg_{node_name(group[0])}",
+            kind,
+            label,
+            len(group),
+            [node_name(n) for n in group],
+            sorted(hosts),
+            contents,
+        )
+        self.nodes.append(dnode)
+        return dnode
+
+    def _build(self, roots: Sequence[FireSimNode]) -> None:
+        drawn: Set[FireSimNode] = set()
+        stack = list(reversed(roots))
+        for root in roots:
+            self._add_single(root)
+            drawn.add(root)
+
+        while stack:
+            node = stack.pop()
+            children = [link.get_downlink_side() for link in node.downlinks]
+
+            # group identical collapsible children, keeping first-seen order
+            groups: Dict[int, List[FireSimNode]] = {}
+            singles: List[FireSimNode] = []
+            for child in children:
+                if self._collapsible(child):
+                    groups.setdefault(self._signature[child], []).append(child)
+                else:
+                    singles.append(child)
+
+            to_visit: List[FireSimNode] = []
+            for group in groups.values():
+                if len(group) > 1:
+                    dnode = self._add_aggregate(group)
+                    self.edges.append((node_name(node), dnode.id, len(group)))
+                else:
+                    singles.append(group[0])
+
+            for child in singles:
+                self.edges.append((node_name(node), node_name(child), 1))
+                if child not in drawn:
+                    drawn.add(child)
+                    self._add_single(child)
+                    to_visit.append(child)
+            stack.extend(reversed(to_visit))
+
+    def write_gv(self, path: str) -> None:
+        """Render with graphviz, grouping nodes on the same host."""
+        from graphviz import Digraph  # type: ignore
+
+        gviz_graph = Digraph(
+            "gviz_graph",
+            filename=path,
+            node_attr={"shape": "record", "height": ".1"},
+        )
+
+        clusters: Dict[str, List[DiagramNode]] = {}
+        for dnode in self.nodes:
+            if len(dnode.hosts) == 1:
+                clusters.setdefault(dnode.hosts[0], []).append(dnode)
+            else:
+                gviz_graph.node(dnode.id, dnode.label, shape="box3d")
+
+        for host, dnodes in clusters.items():
+            with gviz_graph.subgraph(
+                name="cluster_" + host, node_attr={"shape": "box"}
+            ) as cluster:
+                cluster.attr(label=host)
+                for dnode in dnodes:
+                    if dnode.is_aggregate():
+                        cluster.node(dnode.id, dnode.label, shape="box3d")
+                    else:
+                        cluster.node(dnode.id, dnode.label)
+
+        for source, target, count in self.edges:
+            if count > 1:
+                gviz_graph.edge(source, target, label=f"x{count}", penwidth="2")
+            else:
+                gviz_graph.edge(source, target)
+
+        gviz_graph.render(view=False)
+
+    def write_json(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "topology": self.topology_name,
+                    "collapsed": self.collapsed,
+                    "nodes": [dnode.to_dict() for dnode in self.nodes],
+                    "edges": [
+                        {"source": s, "target": t, "count": c} for s, t, c in self.edges
+                    ],
+                },
+                f,
+                indent=2,
+            )
+
+    def write_gexf(self, path: str) -> None:
+        gexf = ET.Element("gexf", {"xmlns": "http://gexf.net/1.2", "version": "1.2"})
+        graph = ET.SubElement(gexf, "graph", {"defaultedgetype": "directed"})
+        node_attrs = ["kind", "count", "hosts", "members"]
+        attributes = ET.SubElement(graph, "attributes", {"class": "node"})
+        for i, title in enumerate(node_attrs):
+            ET.SubElement(
+                attributes,
+                "attribute",
+                {
+                    "id": str(i),
+                    "title": title,
+                    "type": "integer" if title == "count" else "string",
+                },
+            )
+
+        nodes = ET.SubElement(graph, "nodes")
+        for dnode in self.nodes:
+            n = ET.SubElement(
+                nodes, "node", {"id": dnode.id, "label": dnode.label.split("\n")[0]}
+            )
+            attvalues = ET.SubElement(n, "attvalues")
+            values = [
+                dnode.kind,
+                str(dnode.count),
+                " ".join(dnode.hosts),
+                " ".join(dnode.members),
+            ]
+            for i, value in enumerate(values):
+                ET.SubElement(attvalues, "attvalue", {"for": str(i), "value": value})
+
+        edges = ET.SubElement(graph, "edges")
+        for i, (source, target, count) in enumerate(self.edges):
+            ET.SubElement(
+                edges,
+                "edge",
+                {
+                    "id": str(i),
+                    "source": source,
+                    "target": target,
+                    "weight": str(count),
+                },
+            )
+
+        ET.ElementTree(gexf).write(path, encoding="utf-8", xml_declaration=True)
+
+
+def create_topology_diagram(
+    topology_name: str,
+    roots: Sequence[FireSimNode],
+    nodes_dfs_order: Sequence[FireSimNode],
+    config: TopologyDiagramConfig,
+) -> None:
+    """Write the diagram of a topology in the formats selected by config."""
+    if config.mode == "none":
+        return
+
+    if config.mode == "auto":
+        collapsed = len(nodes_dfs_order) > config.collapse_threshold
+    else:
+        collapsed = config.mode == "collapsed"
+
+    diagram = TopologyDiagram(
+        topology_name, roots, nodes_dfs_order, collapsed, config.expand
+    )
+    logging.debug(
+        f"Topology diagram has {len(diagram.nodes)} nodes for {len(nodes_dfs_order)} topology nodes."
+    )
+
+    os.makedirs(DIAGRAM_DIR, exist_ok=True)
+    base_path = os.path.join(DIAGRAM_DIR, "firesim_topology" + topology_name)
+    for f in config.formats:
+        if f == "pdf":
+            diagram.write_gv(base_path + ".gv")
+        elif f == "json":
+            diagram.write_json(base_path + ".json")
+        elif f == "gexf":
+            diagram.write_gexf(base_path + ".gexf")
@@ -55,11 +55,14 @@ class FireSimLink:
 
     """
 
+    # links are created once per edge in the topology, so keep them slotted
+    # to avoid a per-instance __dict__ in very large topologies
+    __slots__ = ("id", "uplink_side", "downlink_side", "port")
+
     # links have a globally unique identifier, currently used for naming
     # shmem regions for Shmem Links
     next_unique_link_identifier: int = 0
     id: int
-    id_as_str: str
     uplink_side: Optional[FireSimNode]
     downlink_side: Optional[FireSimNode]
     port: Optional[int]
@@ -67,14 +70,18 @@ class FireSimLink:
     def __init__(self, uplink_side: FireSimNode, downlink_side: FireSimNode) -> None:
         self.id = FireSimLink.next_unique_link_identifier
         FireSimLink.next_unique_link_identifier += 1
-        # format as 100 char hex string padded with zeroes
-        self.id_as_str = format(self.id, "0100X")
         self.uplink_side = None
         self.downlink_side = None
         self.port = None
         self.set_uplink_side(uplink_side)
         self.set_downlink_side(downlink_side)
 
+    @property
+    def id_as_str(self) -> str:
+        """Return the id formatted as a 100 char hex string padded with zeroes.
+        This is computed on read since it is only needed for shmem port names."""
+        return format(self.id, "0100X")
+
     def set_uplink_side(self, fsimnode: FireSimNode) -> None:
         self.uplink_side = fsimnode
 
@@ -135,6 +142,8 @@ class FireSimNode(metaclass=abc.ABCMeta):
 
     """
 
+    __slots__ = ("downlinks", "downlinkmacs", "uplinks", "host_instance")
+
     downlinks: List[FireSimLink]
     downlinkmacs: List[MacAddress]
     uplinks: List[FireSimLink]
@@ -190,6 +199,22 @@ class FireSimNode(metaclass=abc.ABCMeta):
 class FireSimServerNode(FireSimNode):
     """This is a simulated server instance in FireSim."""
 
+    __slots__ = (
+        "server_hardware_config",
+        "server_link_latency",
+        "server_bw_max",
+        "server_profile_interval",
+        "tracerv_config",
+        "autocounter_config",
+        "hostdebug_config",
+        "synthprint_config",
+        "partition_config",
+        "job",
+        "server_id_internal",
+        "mac_address",
+        "plusarg_passthrough",
+    )
+
     SERVERS_CREATED: int = 0
     server_hardware_config: Optional[Union[RuntimeHWConfig, str]]
     server_link_latency: Optional[int]
@@ -685,6 +710,8 @@ class FireSimSuperNodeServerNode(FireSimServerNode):
     that models the N > 1 copies of a design present in a single simulator
     (e.g. a single FPGA or single metasim) in supernode mode."""
 
+    __slots__ = ()
+
     def __init__(self) -> None:
         super().__init__()
 
@@ -878,6 +905,8 @@ class FireSimSuperNodeServerNode(FireSimServerNode):
 class FireSimDummyServerNode(FireSimServerNode):
     """This is a dummy server node for supernode mode."""
 
+    __slots__ = ()
+
     def __init__(
         self,
         server_hardware_config: Optional[Union[RuntimeHWConfig, str]] = None,
@@ -898,6 +927,15 @@ class FireSimSwitchNode(FireSimNode):
     This is purposefully simple. Abstractly, switches don't do much/have
     much special configuration."""
 
+    __slots__ = (
+        "switch_id_internal",
+        "switch_table",
+        "switch_link_latency",
+        "switch_switching_latency",
+        "switch_bandwidth",
+        "switch_builder",
+    )
+
     # used to give switches a global ID
     SWITCHES_CREATED: int = 0
     switch_id_internal: int
@@ -981,6 +1019,13 @@ class FireSimSwitchNode(FireSimNode):
 
 class FireSimPipeNode(FireSimNode):
 
+    __slots__ = (
+        "pipe_id_internal",
+        "partition_config",
+        "pipe_builder",
+        "partition_edge",
+    )
+
     PIPES_CREATED: int = 0
     pipe_id_internal: int
     partition_config: Optional[PartitionConfig]
@@ -0,0 +1,440 @@
+""" Host mapping strategies that work on an abstract view of the run farm
+(host "bins" with slot capacities) before any RunHost is allocated. """
+
+from __future__ import annotations
+
+from absl import logging
+from collections import defaultdict
+
+from runtools.topology.elements import (
+    FireSimNode,
+    FireSimServerNode,
+    FireSimDummyServerNode,
+    FireSimSwitchNode,
+    FireSimPipeNode,
+    FireSimLink,
+)
+from runtools.run_farm import RunHost
+
+from typing import (
+    AbstractSet,
+    Dict,
+    List,
+    Mapping,
+    NoReturn,
+    Optional,
+    Tuple,
+    Sequence,
+    TYPE_CHECKING,
+)
+
+if TYPE_CHECKING:
+    from runtools.run_farm import RunFarm
+
+
+def link_weight(link: FireSimLink, default_bandwidth: int) -> int:
+    """Return the weight of a link when computing cut sizes: the bandwidth
+    (in Gbit/s) the link is modeled at. Per-node parameters are applied after
+    mapping, so fall back to the default network bandwidth when unset."""
+    downlink_side = link.get_downlink_side()
+    if isinstance(downlink_side, FireSimServerNode):
+        bandwidth = downlink_side.server_bw_max
+    else:
+        switch_bandwidths = [
+            node.switch_bandwidth
+            for node in (link.get_uplink_side(), downlink_side)
+            if isinstance(node, FireSimSwitchNode) and node.switch_bandwidth is not None
+        ]
+        bandwidth = min(switch_bandwidths) if switch_bandwidths else None
+    return bandwidth if bandwidth is not None else default_bandwidth
+
+
+class HostBin:
+    """An unallocated run farm host that nodes can be mapped onto.
+
+    Attributes:
+        handle: run host handle (type of host)
+        ordinal: index of this host among the hosts of the same handle
+        sim_capacity: number of simulation slots on the host
+        switch_only_ok: whether the host may hold only switches
+        num_sims: number of simulations mapped to this host so far
+        num_switches: number of switches mapped to this host so far
+        num_ports: number of socket ports this host serves, one per link that
+            crosses hosts and has its uplink side on this host
+    """
+
+    handle: str
+    ordinal: int
+    sim_capacity: int
+    switch_only_ok: bool
+    num_sims: int
+    num_switches: int
+    num_ports: int
+
+    def __init__(
+        self, handle: str, ordinal: int, sim_capacity: int, switch_only_ok: bool
+    ) -> None:
+        self.handle = handle
+        self.ordinal = ordinal
+        self.sim_capacity = sim_capacity
+        self.switch_only_ok = switch_only_ok
+        self.num_sims = 0
+        self.num_switches = 0
+        self.num_ports = 0
+
+    def remaining_sims(self) -> int:
+        return self.sim_capacity - self.num_sims
+
+    def is_used(self) -> bool:
+        return self.num_sims > 0 or self.num_switches > 0
+
+    def can_hold(self, num_sims: int, num_switches: int, num_ports: int = 0) -> bool:
+        """Return True if num_sims/num_switches more nodes (serving num_ports
+        more socket ports) can be added without exceeding slots or ports or
+        producing an illegal switch-only host."""
+        if self.remaining_sims() < num_sims:
+            return False
+        if self.num_switches + num_switches > RunHost.MAX_SWITCH_AND_PIPE_SLOTS_ALLOWED:
+            return False
+        if self.num_ports + num_ports > RunHost.MAX_HOST_PORTS_ALLOWED:
+            return False
+        if self.num_sims + num_sims == 0 and num_switches > 0:
+            return self.switch_only_ok
+        return True
+
+    def __repr__(self) -> str:
+        return f"{self.handle}[{self.ordinal}]"
+
+
+class MinCutHostMapper:
+    """Map switches and simulations onto run farm hosts such that the
+    bandwidth-weighted number of links crossing hosts (i.e. links implemented
+    with SocketServerPort/SocketClientPort instead of ShmemPorts) is minimized.
+
+    The mapping is done in two steps:
+        1) Top-down packing: each subtree of the topology (following the first
+        uplink of each node) is placed whole on a single host if one has
+        enough free slots. Otherwise its children are packed individually
+        (largest first, co-locating siblings when possible) and the switch is
+        placed on the host that keeps the most link bandwidth local.
+        2) Refinement: nodes are greedily moved to the host of a neighbor while
+        that strictly reduces the weighted cut and respects slot capacities.
+        This also handles topologies with multiple uplinks per node.
+
+    Supernode FireSimDummyServerNodes are skipped, like the other mappers,
+    since they are deployed along with their FireSimSuperNodeServerNode.
+    """
+
+    MAX_REFINEMENT_PASSES: int = 8
+
+    nodes: List[FireSimNode]
+    roots: Sequence[FireSimNode]
+    edges: List[Tuple[FireSimNode, FireSimNode, int]]
+    neighbors: Dict[FireSimNode, List[Tuple[FireSimNode, int]]]
+    incident_edges: Dict[FireSimNode, List[int]]
+    children: Dict[FireSimNode, List[FireSimNode]]
+    subtree_sims: Dict[FireSimNode, int]
+    subtree_switches: Dict[FireSimNode, int]
+    bins: List[HostBin]
+    assignment: Dict[FireSimNode, HostBin]
+
+    def __init__(
+        self,
+        roots: Sequence[FireSimNode],
+        nodes_dfs_order: List[FireSimNode],
+        run_farm: RunFarm,
+        default_bandwidth: int,
+    ) -> None:
+        assert not any(
+            [isinstance(x, FireSimPipeNode) for x in nodes_dfs_order]
+        ), "The min-cut host mapper does not support partitioned simulations."
+
+        self.roots = roots
+        self.nodes = [
+            x for x in nodes_dfs_order if not isinstance(x, FireSimDummyServerNode)
+        ]
+        self.edges = []
+        self.neighbors = defaultdict(list)
+        self.incident_edges = defaultdict(list)
+        self.children = defaultdict(list)
+        for node in self.nodes:
+            for link in node.downlinks:
+                downlink_side = link.get_downlink_side()
+                if isinstance(downlink_side, FireSimDummyServerNode):
+                    continue
+                weight = link_weight(link, default_bandwidth)
+                self.incident_edges[node].append(len(self.edges))
+                self.incident_edges[downlink_side].append(len(self.edges))
+                self.edges.append((node, downlink_side, weight))
+                self.neighbors[node].append((downlink_side, weight))
+                self.neighbors[downlink_side].append((node, weight))
+                # a node belongs to the subtree of its first uplink
+                if downlink_side.uplinks[0] is link:
+                    self.children[node].append(downlink_side)
+
+        self.subtree_sims = {}
+        self.subtree_switches = {}
+        # dfs order lists children before their parents
+        for node in self.nodes:
+            self.subtree_sims[node] = int(isinstance(node, FireSimServerNode)) + sum(
+                [self.subtree_sims[c] for c in self.children[node]]
+            )
+            self.subtree_switches[node] = int(
+                isinstance(node, FireSimSwitchNode)
+            ) + sum([self.subtree_switches[c] for c in self.children[node]])
+
+        if run_farm.metasimulation_enabled:
+            slots = run_farm.SIM_HOST_HANDLE_TO_MAX_METASIM_SLOTS
+        else:
+            slots = run_farm.SIM_HOST_HANDLE_TO_MAX_FPGA_SLOTS
+
+        self.bins = []
+        for handle, hosts in sorted(run_farm.run_farm_hosts_dict.items()):
+            for ordinal in range(run_farm.mapper_consumed[handle], len(hosts)):
+                self.bins.append(
+                    HostBin(
+                        handle,
+                        ordinal,
+                        slots.get(handle, 0),
+                        run_farm.SIM_HOST_HANDLE_TO_SWITCH_ONLY_OK.get(handle, False),
+                    )
+                )
+
+        self.assignment = {}
+
+    def _port_host(
+        self,
+        edge: int,
+        moved: AbstractSet[FireSimNode] = frozenset(),
+        host_bin: Optional[HostBin] = None,
+    ) -> Optional[HostBin]:
+        """Return the host serving the socket port of an edge (its uplink
+        side's host) if the edge crosses hosts, with the moved nodes on
+        host_bin. Edges with an unmapped side have no port yet."""
+        uplink_side, downlink_side, _ = self.edges[edge]
+        uplink_bin = (
+            host_bin if uplink_side in moved else self.assignment.get(uplink_side)
+        )
+        downlink_bin = (
+            host_bin if downlink_side in moved else self.assignment.get(downlink_side)
+        )
+        if uplink_bin is None or downlink_bin is None or uplink_bin is downlink_bin:
+            return None
+        return uplink_bin
+
+    def _port_deltas(
+        self, nodes: List[FireSimNode], host_bin: HostBin
+    ) -> Dict[HostBin, int]:
+        """Return the change in socket ports of each host if nodes were
+        (re)mapped to host_bin."""
+        moved = set(nodes)
+        edges = set([e for node in nodes for e in self.incident_edges[node]])
+        deltas: Dict[HostBin, int] = defaultdict(int)
+        for edge in edges:
+            before = self._port_host(edge)
+            after = self._port_host(edge, moved, host_bin)
+            if before is not None:
+                deltas[before] -= 1
+            if after is not None:
+                deltas[after] += 1
+        return deltas
+
+    def _fits(
+        self,
+        nodes: List[FireSimNode],
+        host_bin: HostBin,
+        num_sims: int,
+        num_switches: int,
+    ) -> bool:
+        """Return True if nodes (num_sims/num_switches of which are not on
+        host_bin yet) can be mapped to host_bin without exceeding the slots of
+        host_bin or the socket ports of any host."""
+        deltas = self._port_deltas(nodes, host_bin)
+        if not host_bin.can_hold(num_sims, num_switches, deltas.get(host_bin, 0)):
+            return False
+        return all(
+            [
+                b.num_ports + delta <= RunHost.MAX_HOST_PORTS_ALLOWED
+                for b, delta in deltas.items()
+                if b is not host_bin and delta > 0
+            ]
+        )
+
+    def _add(self, node: FireSimNode, host_bin: HostBin) -> None:
+        for b, delta in self._port_deltas([node], host_bin).items():
+            b.num_ports += delta
+        self.assignment[node] = host_bin
+        if isinstance(node, FireSimServerNode):
+            host_bin.num_sims += 1
+        else:
+            host_bin.num_switches += 1
+
+    def _remove(self, node: FireSimNode) -> HostBin:
+        for edge in self.incident_edges[node]:
+            port_host = self._port_host(edge)
+            if port_host is not None:
+                port_host.num_ports -= 1
+        host_bin = self.assignment.pop(node)
+        if isinstance(node, FireSimServerNode):
+            host_bin.num_sims -= 1
+        else:
+            host_bin.num_switches -= 1
+        return host_bin
+
+    def _subtree(self, node: FireSimNode) -> List[FireSimNode]:
+        nodes = []
+        stack = [node]
+        while stack:
+            cur = stack.pop()
+            nodes.append(cur)
+            stack.extend(self.children[cur])
+        return nodes
+
+    def _best_fit_bin(
+        self, nodes: List[FireSimNode], num_sims: int, num_switches: int
+    ) -> Optional[HostBin]:
+        """Return the host that fits the request with the least slots left over,
+        preferring hosts that are already in use."""
+        candidates = [
+            b for b in self.bins if self._fits(nodes, b, num_sims, num_switches)
+        ]
+        if not candidates:
+            return None
+        return min(
+            candidates,
+            key=lambda b: (not b.is_used(), b.remaining_sims() - num_sims),
+        )
+
+    def _pack(self, node: FireSimNode, preferred: Optional[HostBin]) -> HostBin:
+        """Place the subtree rooted at node. Return the host of node itself."""
+        num_sims = self.subtree_sims[node]
+        num_switches = self.subtree_switches[node]
+        subtree = self._subtree(node)
+        if preferred is not None and self._fits(
+            subtree, preferred, num_sims, num_switches
+        ):
+            for cur in subtree:
+                self._add(cur, preferred)
+            return preferred
+        host_bin = self._best_fit_bin(subtree, num_sims, num_switches)
+        if host_bin is not None:
+            for cur in subtree:
+                self._add(cur, host_bin)
+            return host_bin
+
+        if not self.children[node]:
+            self._no_host_for(node)
+
+        # the subtree does not fit on any single host, so split it across hosts
+        current = preferred
+        for child in sorted(
+            self.children[node], key=lambda c: self.subtree_sims[c], reverse=True
+        ):
+            current = self._pack(child, current)
+
+        # keep as much of the switch's link bandwidth local as possible
+        local_weight: Dict[HostBin, int] = defaultdict(int)
+        for neighbor, weight in self.neighbors[node]:
+            if neighbor in self.assignment:
+                local_weight[self.assignment[neighbor]] += weight
+        candidates = [b for b in self.bins if self._fits([node], b, 0, 1)]
+        if not candidates:
+            self._no_host_for(node)
+        host_bin = max(candidates, key=lambda b: (local_weight[b], b.is_used()))
+        self._add(node, host_bin)
+        return host_bin
+
+    def _no_host_for(self, node: FireSimNode) -> NoReturn:
+        error_msg = f"ERROR: No hosts are available to hold {node}. Add more hosts in your run farm configuration (e.g., config_runtime.yaml)."
+        logging.error(error_msg)
+        raise Exception(error_msg)
+
+    def _refine(self) -> None:
+        for _ in range(self.MAX_REFINEMENT_PASSES):
+            moved = False
+            for node in self.nodes:
+                cur_bin = self.assignment[node]
+                local_weight: Dict[HostBin, int] = defaultdict(int)
+                for neighbor, weight in self.neighbors[node]:
+                    local_weight[self.assignment[neighbor]] += weight
+
+                is_sim = isinstance(node, FireSimServerNode)
+                # moving the last sim off a host must not leave an illegal
+                # switch-only host behind
+                if (
+                    is_sim
+                    and cur_bin.num_sims == 1
+                    and cur_bin.num_switches > 0
+                    and not cur_bin.switch_only_ok
+                ):
+                    continue
+
+                cur_weight = local_weight[cur_bin]
+                best_bin = None
+                best_gain = 0
+                for host_bin, weight in local_weight.items():
+                    gain = weight - cur_weight
+                    if host_bin is cur_bin or gain <= best_gain:
+                        continue
+                    if not self._fits([node], host_bin, int(is_sim), int(not is_sim)):
+                        continue
+                    best_bin = host_bin
+                    best_gain = gain
+
+                if best_bin is not None:
+                    self._remove(node)
+                    self._add(node, best_bin)
+                    moved = True
+            if not moved:
+                return
+
+    def map(self) -> Dict[FireSimNode, HostBin]:
+        """Compute the node to host assignment."""
+        preferred = None
+        for root in sorted(
+            self.roots, key=lambda r: self.subtree_sims[r], reverse=True
+        ):
+            preferred = self._pack(root, preferred)
+        self._refine()
+        return self.assignment
+
+    def used_bins(self) -> List[HostBin]:
+        """Return hosts used by the assignment, in allocation order."""
+        return sorted(
+            [b for b in self.bins if b.is_used()], key=lambda b: (b.handle, b.ordinal)
+        )
+
+    def cut_size(self, assignment: Mapping[FireSimNode, object]) -> Tuple[int, int]:
+        """Return (number of links, total bandwidth) crossing hosts."""
+        num_links = 0
+        weight = 0
+        for uplink_side, downlink_side, link_w in self.edges:
+            if assignment[uplink_side] != assignment[downlink_side]:
+                num_links += 1
+                weight += link_w
+        return num_links, weight
+
+    def greedy_cut_size(self) -> Optional[Tuple[int, int]]:
+        """Return the cut size of pass_simple_networked_host_node_mapping, which
+        puts every switch on its own host along with its downlink sims. Return
+        None if that mapper does not support this topology (mixed downlinks)."""
+        assignment: Dict[FireSimNode, object] = {}
+        for node in self.nodes:
+            if isinstance(node, FireSimSwitchNode):
+                assignment[node] = node
+                kinds = set(
+                    [
+                        isinstance(x.get_downlink_side(), FireSimServerNode)
+                        for x in node.downlinks
+                        if not isinstance(x.get_downlink_side(), FireSimDummyServerNode)
+                    ]
+                )
+                if len(kinds) > 1:
+                    return None
+        for node in self.nodes:
+            if isinstance(node, FireSimServerNode):
+                if node.uplinks:
+                    assignment[node] = node.uplinks[0].get_uplink_side()
+                else:
+                    assignment[node] = node
+        return self.cut_size(assignment)
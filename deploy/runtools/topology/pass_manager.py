@@ -0,0 +1,209 @@
+""" A small framework to run FireSimTopologyWithPasses passes incrementally.
+
+Each pass declares its inputs and outputs:
+    inputs: either attribute paths on the FireSimTopologyWithPasses object
+        (e.g. "defaultlinklatency", "run_farm.args"), which are fingerprinted
+        by value, or outputs of other passes.
+    outputs: names of the results a pass produces, which other passes can
+        depend on.
+
+A pass is skipped if the fingerprint of its inputs matches the one of its last
+run. When a pass runs, all of its outputs are invalidated so that passes
+depending on them run again. """
+
+from __future__ import annotations
+
+from absl import logging
+import functools
+import hashlib
+import pprint
+import time
+
+from typing import Any, Callable, Dict, List, Optional, Set, TypeVar, cast
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+# max depth to descend into objects when fingerprinting inputs
+FINGERPRINT_MAX_DEPTH = 8
+
+
+class TopologyPassSpec:
+    """Declaration of a single pass."""
+
+    name: str
+    inputs: Optional[List[str]]
+    outputs: List[str]
+
+    def __init__(
+        self, name: str, inputs: Optional[List[str]], outputs: List[str]
+    ) -> None:
+        self.name = name
+        self.inputs = inputs
+        self.outputs = outputs
+
+    def memoized(self) -> bool:
+        return self.inputs is not None
+
+
+# all declared passes and the pass that produces each output
+PASS_SPECS: Dict[str, TopologyPassSpec] = {}
+OUTPUT_PRODUCERS: Dict[str, str] = {}
+
+
+def topology_pass(
+    inputs: Optional[List[str]] = None, outputs: Optional[List[str]] = None
+) -> Callable[[F], F]:
+    """Decorator to declare a method of FireSimTopologyWithPasses as a pass.
+    Passes without inputs are always run, but are still timed."""
+
+    def decorator(func: F) -> F:
+        spec = TopologyPassSpec(func.__name__, inputs, outputs or [])
+        PASS_SPECS[spec.name] = spec
+        for output in spec.outputs:
+            assert (
+                output not in OUTPUT_PRODUCERS
+            ), f"{output} is already produced by {OUTPUT_PRODUCERS[output]}"
+            OUTPUT_PRODUCERS[output] = spec.name
+
+        @functools.wraps(func)
+        def wrapper(self: Any, *args: Any, **kwargs: Any) -> Any:
+            return self.pass_manager.run(self, spec, func, *args, **kwargs)
+
+        return cast(F, wrapper)
+
+    return decorator
+
+
+def _instance_attributes(value: Any) -> Optional[Dict[str, Any]]:
+    """Return the attributes of an object, whether they are kept in its
+    __dict__ or in the __slots__ of any class in its MRO, or None for objects
+    without either."""
+    slot_names = []
+    for klass in type(value).__mro__:
+        slots = klass.__dict__.get("__slots__", ())
+        slot_names += [slots] if isinstance(slots, str) else list(slots)
+    if not slot_names and not hasattr(value, "__dict__"):
+        return None
+    attrs = dict(getattr(value, "__dict__", {}))
+    for name in slot_names:
+        if name in ("__dict__", "__weakref__"):
+            continue
+        if hasattr(value, name):
+            attrs[name] = getattr(value, name)
+    return attrs
+
+
+def _fingerprint_state(value: Any, depth: int, visited: Set[int]) -> Any:
+    """Convert value to a structure whose repr is deterministic across runs."""
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if depth > FINGERPRINT_MAX_DEPTH or id(value) in visited:
+        return type(value).__name__
+    visited = visited | {id(value)}
+    if isinstance(value, dict):
+        return sorted(
+            [
+                (repr(k), _fingerprint_state(v, depth + 1, visited))
+                for k, v in value.items()
+            ]
+        )
+    if isinstance(value, (list, tuple)):
+        return [_fingerprint_state(v, depth + 1, visited) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted([repr(_fingerprint_state(v, depth + 1, visited)) for v in value])
+    attrs = _instance_attributes(value)
+    if attrs is not None:
+        return (
+            type(value).__name__,
+            _fingerprint_state(attrs, depth + 1, visited),
+        )
+    value_repr = repr(value)
+    if " at 0x" in value_repr:
+        # default reprs contain addresses that change run to run
+        return type(value).__name__
+    return value_repr
+
+
+def fingerprint(value: Any) -> str:
+    """Return a hash of the contents of value."""
+    state = _fingerprint_state(value, 0, set())
+    return hashlib.sha256(pprint.pformat(state).encode()).hexdigest()
+
+
+class PassManager:
+    """Runs declared passes, skipping those whose inputs are unchanged.
+
+    Attributes:
+        input_fingerprints: pass name to the input fingerprint of its last run
+        output_versions: output name to the number of times it was produced
+        timings: pass name to the duration of its last run (None if skipped)
+    """
+
+    input_fingerprints: Dict[str, str]
+    output_versions: Dict[str, int]
+    timings: Dict[str, Optional[float]]
+
+    def __init__(self) -> None:
+        self.input_fingerprints = {}
+        self.output_versions = {}
+        self.timings = {}
+
+    def _resolve(self, owner: Any, path: str) -> Any:
+        value = owner
+        for attr in path.split("."):
+            value = getattr(value, attr)
+        return value
+
+    def _input_fingerprint(self, owner: Any, spec: TopologyPassSpec) -> str:
+        assert spec.inputs is not None
+        parts = []
+        for inp in spec.inputs:
+            if inp in OUTPUT_PRODUCERS:
+                if inp not in self.output_versions:
+                    raise Exception(
+                        f"{spec.name} requires {inp}, which is produced by {OUTPUT_PRODUCERS[inp]}. Run {OUTPUT_PRODUCERS[inp]} first."
+                    )
+                parts.append(f"{inp}@{self.output_versions[inp]}")
+            else:
+                parts.append(f"{inp}={fingerprint(self._resolve(owner, inp))}")
+        return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+    def run(
+        self,
+        owner: Any,
+        spec: TopologyPassSpec,
+        func: Callable[..., Any],
+        *args: Any,
+        **kwargs: Any,
+    ) -> Any:
+        input_fingerprint = None
+        if spec.memoized():
+            input_fingerprint = self._input_fingerprint(owner, spec)
+            if self.input_fingerprints.get(spec.name) == input_fingerprint:
+                logging.debug(f"Skipping {spec.name}: inputs are unchanged.")
+                self.timings[spec.name] = None
+                return None
+
+        start = time.monotonic()
+        ret = func(owner, *args, **kwargs)
+        self.timings[spec.name] = time.monotonic() - start
+
+        for output in spec.outputs:
+            self.output_versions[output] = self.output_versions.get(output, 0) + 1
+        if input_fingerprint is not None:
+            self.input_fingerprints[spec.name] = input_fingerprint
+        return ret
+
+    def log_timings(self, names: List[str]) -> None:
+        """Log the duration of the last run of each of the given passes."""
+        lines = []
+        for name in names:
+            if name not in self.timings:
+                continue
+            duration = self.timings[name]
+            if duration is None:
+                lines.append(f"  {name}: skipped (inputs unchanged)")
+            else:
+                lines.append(f"  {name}: {duration:.3f}s")
+        if lines:
+            logging.info("Topology pass timings:\n" + "\n".join(lines))
@@ -0,0 +1,210 @@
+""" Switching table generation for FireSimSwitchNodes. The tables produced here
+are emitted as the mac2port array of the switch models (see
+switch_model_config.py and target-design/switch/flit.h). """
+
+from __future__ import annotations
+
+from absl import logging
+from collections import Counter
+
+from runtools.topology.elements import FireSimNode, FireSimSwitchNode
+
+from typing import Dict, FrozenSet, List, Set, Tuple
+
+# ecmp: each destination MAC is pinned to one uplink, chosen per switch, so
+#   all uplinks carry traffic and packets of a flow are never reordered.
+# random: the switch model picks a random uplink for every packet.
+UPLINK_ROUTING_MODES = ["ecmp", "random"]
+
+# mac2port entry that tells the switch model to pick a random uplink. must
+# match ANY_UPLINK in target-design/switch/flit.h
+ANY_UPLINK_PORT = 0xFFFE
+
+_MASK64 = (1 << 64) - 1
+
+
+def ecmp_hash(switch_id: int, mac: int) -> int:
+    """Hash a destination MAC (without prefix), salted by the switch id. The
+    salt keeps switches at different levels of the topology from making
+    correlated choices, which would send all traffic that was spread by one
+    level through the same uplinks of the next (hash polarization)."""
+    x = (mac * 0x9E3779B97F4A7C15 + (switch_id + 1) * 0xBF58476D1CE4E5B9) & _MASK64
+    x ^= x >> 30
+    x = (x * 0xBF58476D1CE4E5B9) & _MASK64
+    x ^= x >> 27
+    x = (x * 0x94D049BB133111EB) & _MASK64
+    x ^= x >> 31
+    return x
+
+
+def compute_switch_table(
+    switch: FireSimSwitchNode, num_macs: int, uplink_routing: str
+) -> List[int]:
+    """Return the MAC addr -> port list of a switch whose downlink nodes
+    already have their downlinkmacs set.
+
+    It is assumed that downlinks take ports [0, num downlinks) and
+    uplinks take ports [num downlinks, num downlinks + num uplinks)
+
+    Every MAC that is not reachable through a downlink is sent up. With
+    multiple uplinks and ecmp routing, the non-local MACs are ordered by
+    ecmp_hash and dealt out to the uplinks round-robin, so each uplink gets
+    the same number of destinations (+-1)."""
+    numdownlinks = len(switch.downlinks)
+    numuplinks = len(switch.uplinks)
+
+    # prepopulate the table with the first uplink port
+    switchtab = [numdownlinks for x in range(num_macs)]
+    for port_no in range(numdownlinks):
+        portmacs = switch.downlinks[port_no].get_downlink_side().downlinkmacs
+        for mac in portmacs:
+            switchtab[mac.as_int_no_prefix()] = port_no
+
+    if numuplinks > 1:
+        nonlocal_macs = [
+            dest for dest in range(num_macs) if switchtab[dest] >= numdownlinks
+        ]
+        if uplink_routing == "random":
+            for dest in nonlocal_macs:
+                switchtab[dest] = ANY_UPLINK_PORT
+        else:
+            switch_id = switch.switch_id_internal
+            nonlocal_macs.sort(key=lambda dest: ecmp_hash(switch_id, dest))
+            for i, dest in enumerate(nonlocal_macs):
+                switchtab[dest] = numdownlinks + (i % numuplinks)
+
+    return switchtab
+
+
+def _turnaround_switch(switch: FireSimSwitchNode, mac: int) -> FireSimSwitchNode:
+    """Follow the switching tables up from switch until reaching the switch
+    that sends mac down again."""
+    current = switch
+    while True:
+        port = current.switch_table[mac]
+        numdownlinks = len(current.downlinks)
+        if port < numdownlinks or port - numdownlinks >= len(current.uplinks):
+            return current
+        upper = current.uplinks[port - numdownlinks].get_uplink_side()
+        if not isinstance(upper, FireSimSwitchNode):
+            return current
+        current = upper
+
+
+class _TurnaroundFinder:
+    """Finds all switches where traffic from a switch to a destination could
+    turn back down, i.e. the first switch that can reach the destination on
+    each upward path, regardless of the switching tables.
+
+    Attributes:
+        switch_macs: MACs (without prefix) reachable below each switch.
+        memo: Answer for each (switch, destination). Every destination attached
+            to the same switch has the same answer, so callers use one
+            representative MAC of that switch.
+        answers: One copy of each distinct answer. Most switches share a
+            handful of them (e.g. all roots).
+    """
+
+    switch_macs: Dict[FireSimSwitchNode, Set[int]]
+    memo: Dict[Tuple[FireSimSwitchNode, int], FrozenSet[FireSimSwitchNode]]
+    answers: Dict[FrozenSet[FireSimSwitchNode], FrozenSet[FireSimSwitchNode]]
+
+    def __init__(self, switch_macs: Dict[FireSimSwitchNode, Set[int]]) -> None:
+        self.switch_macs = switch_macs
+        self.memo = {}
+        self.answers = {}
+
+    def find(self, switch: FireSimSwitchNode, mac: int) -> FrozenSet[FireSimSwitchNode]:
+        key = (switch, mac)
+        if key not in self.memo:
+            turnarounds: Set[FireSimSwitchNode] = set()
+            for uplink in switch.uplinks:
+                upper = uplink.get_uplink_side()
+                if not isinstance(upper, FireSimSwitchNode):
+                    continue
+                if mac in self.switch_macs[upper]:
+                    turnarounds.add(upper)
+                else:
+                    turnarounds |= self.find(upper, mac)
+            answer = frozenset(turnarounds)
+            self.memo[key] = self.answers.setdefault(answer, answer)
+        return self.memo[key]
+
+
+def path_diversity_warnings(switches: List[FireSimSwitchNode]) -> List[str]:
+    """Check that the ecmp switching tables of a topology with multiple uplinks
+    actually use the redundant paths: for each switch with attached
+    simulations, trace the path to every other simulation that could be
+    reached through more than one switch where the traffic turns back down,
+    and count the distinct turnaround switches used. Destinations with a
+    single possible path (e.g. the only simulation behind a leaf) are not
+    counted.
+
+    Returns:
+        A description of each switch whose tables send all of that traffic
+        through a single one of several possible turnaround switches (e.g.
+        everything through one root of a Clos network).
+    """
+    if all(len(switch.uplinks) <= 1 for switch in switches):
+        return []
+
+    switch_macs = {
+        switch: set(mac.as_int_no_prefix() for mac in switch.downlinkmacs)
+        for switch in switches
+    }
+    # the switch each simulation is attached to. destinations attached to the
+    # same switch are reached through the same switches
+    attached_to: Dict[int, FireSimSwitchNode] = {}
+    for switch in switches:
+        for link in switch.downlinks:
+            node = link.get_downlink_side()
+            if not isinstance(node, FireSimSwitchNode):
+                attached_to.update(
+                    (mac.as_int_no_prefix(), switch) for mac in node.downlinkmacs
+                )
+    representative_mac = {switch: mac for mac, switch in attached_to.items()}
+
+    finder = _TurnaroundFinder(switch_macs)
+    warnings = []
+    used_total = 0
+    possible_total = 0
+    for switch in switches:
+        if not switch.uplinks or switch not in representative_mac:
+            continue
+
+        turnarounds: Counter[FireSimSwitchNode] = Counter()
+        possible: Set[FireSimSwitchNode] = set()
+        for mac in sorted(set(attached_to) - switch_macs[switch]):
+            candidates = finder.find(switch, representative_mac[attached_to[mac]])
+            if len(candidates) > 1:
+                possible |= candidates
+                turnarounds[_turnaround_switch(switch, mac)] += 1
+
+        used_total += len(turnarounds)
+        possible_total += len(possible)
+        logging.debug(
+            f"switch{switch.switch_id_internal}: traffic turns around at "
+            + ", ".join(
+                f"switch{s.switch_id_internal} ({n} dests)"
+                for s, n in sorted(
+                    turnarounds.items(), key=lambda x: x[0].switch_id_internal
+                )
+            )
+        )
+        spreadable = min(len(possible), sum(turnarounds.values()))
+        if spreadable > 1 and len(turnarounds) <= 1:
+            warnings.append(
+                f"switch{switch.switch_id_internal} could spread traffic over {len(possible)} upper switches, but its switching tables send all of it through one of them."
+            )
+
+    logging.info(
+        f"Switching tables use {used_total} of {possible_total} upper switches where traffic from leaf switches could turn around."
+    )
+    return warnings
+
+
+def check_path_diversity(switches: List[FireSimSwitchNode]) -> None:
+    """Log a warning for each switch that does not spread its traffic over
+    the redundant paths of the topology (see path_diversity_warnings)."""
+    for warning in path_diversity_warnings(switches):
+        logging.warning(warning)
@@ -0,0 +1,139 @@
+""" Save/restore a fully mapped FireSimTopologyWithPasses so that manager
+commands run after infrasetup can skip re-running the phase one passes. """
+
+from __future__ import annotations
+
+from absl import logging
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+from runtools.topology.elements import (
+    FireSimLink,
+    FireSimServerNode,
+    FireSimSwitchNode,
+    FireSimPipeNode,
+)
+from runtools.utils import MacAddress
+
+from typing import Dict, List, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from runtools.topology.core_with_passes import FireSimTopologyWithPasses
+
+# bump this whenever the pickled classes change in an incompatible way
+SNAPSHOT_VERSION = 1
+SNAPSHOT_DIR = "topology-snapshots"
+
+# sources that define topologies, hashed alongside the config files since
+# a topology change also changes the mapping
+TOPOLOGY_SOURCE_FILES = ["runtools/topology/user_topologies.py"]
+
+# environment variables that change how the run farm is constructed
+SNAPSHOT_ENV_VARS = ["FIRESIM_RUNFARM_PREFIX"]
+
+
+def snapshot_key(config_files: List[str], extra_data: List[str]) -> str:
+    """Return a hash of the contents of config_files, the topology sources,
+    extra_data (e.g. config values) and the snapshot version."""
+    h = hashlib.sha256()
+    h.update(f"version:{SNAPSHOT_VERSION}\n".encode())
+    for f in config_files + TOPOLOGY_SOURCE_FILES:
+        h.update(f"file:{f}\n".encode())
+        if os.path.exists(f):
+            with open(f, "rb") as fh:
+                h.update(fh.read())
+    for d in extra_data:
+        h.update(f"data:{d}\n".encode())
+    for v in SNAPSHOT_ENV_VARS:
+        h.update(f"env:{v}={os.environ.get(v)}\n".encode())
+    return h.hexdigest()
+
+
+def snapshot_path(key: str) -> Path:
+    return Path(SNAPSHOT_DIR) / f"topology-{key[:32]}.pickle"
+
+
+def _class_state() -> Dict[str, int]:
+    """Global allocators that must match the snapshotted topology."""
+    return {
+        "next_mac_alloc": MacAddress.next_mac_alloc,
+        "next_unique_link_identifier": FireSimLink.next_unique_link_identifier,
+        "SERVERS_CREATED": FireSimServerNode.SERVERS_CREATED,
+        "SWITCHES_CREATED": FireSimSwitchNode.SWITCHES_CREATED,
+        "PIPES_CREATED": FireSimPipeNode.PIPES_CREATED,
+    }
+
+
+def _restore_class_state(state: Dict[str, int]) -> None:
+    MacAddress.next_mac_alloc = state["next_mac_alloc"]
+    FireSimLink.next_unique_link_identifier = state["next_unique_link_identifier"]
+    FireSimServerNode.SERVERS_CREATED = state["SERVERS_CREATED"]
+    FireSimSwitchNode.SWITCHES_CREATED = state["SWITCHES_CREATED"]
+    FireSimPipeNode.PIPES_CREATED = state["PIPES_CREATED"]
+
+
+def save_topology_snapshot(topology: FireSimTopologyWithPasses, key: str) -> None:
+    """Persist a mapped topology that has not been bound to launched hosts yet.
+    Failing to write a snapshot is not fatal, later commands recompute it."""
+    path = snapshot_path(key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # custom mappers are usually closures and can't be pickled. mapping is
+    # already done at this point so they are not needed anymore.
+    custom_mapper = topology.firesimtopol.custom_mapper
+    topology.firesimtopol.custom_mapper = None
+    tmp_path = path.with_suffix(".tmp")
+    try:
+        with open(tmp_path, "wb") as f:
+            # the header is a separate pickle so that it can be checked without
+            # loading the (large) topology
+            pickle.dump({"version": SNAPSHOT_VERSION, "key": key}, f)
+            pickle.dump(
+                {"class_state": _class_state(), "topology": topology},
+                f,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(tmp_path, path)
+    except Exception as e:
+        logging.warning(f"Unable to save topology snapshot to {path}: {e}")
+        if tmp_path.exists():
+            tmp_path.unlink()
+        return
+    finally:
+        topology.firesimtopol.custom_mapper = custom_mapper
+
+    # only the latest snapshot is useful
+    for stale in path.parent.glob("topology-*.pickle"):
+        if stale != path:
+            stale.unlink()
+    logging.info(f"Saved mapped topology snapshot to {path}")
+
+
+def load_topology_snapshot(key: str) -> Optional[FireSimTopologyWithPasses]:
+    """Return the snapshotted topology for key, or None if there is no
+    snapshot for these inputs (or it can't be used)."""
+    path = snapshot_path(key)
+    if not path.exists():
+        logging.info(
+            "No topology snapshot matches the current configuration. Recomputing topology."
+        )
+        return None
+
+    try:
+        with open(path, "rb") as f:
+            header = pickle.load(f)
+            if header.get("version") != SNAPSHOT_VERSION or header.get("key") != key:
+                logging.info("Topology snapshot is out of date. Recomputing topology.")
+                return None
+            payload = pickle.load(f)
+    except Exception as e:
+        logging.warning(
+            f"Unable to load topology snapshot {path}: {e}. Recomputing topology."
+        )
+        return None
+
+    _restore_class_state(payload["class_state"])
+    logging.info(f"Loaded mapped topology snapshot from {path}")
+    return payload["topology"]
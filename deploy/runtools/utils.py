@@ -2,6 +2,8 @@
 
 from __future__ import annotations
 
+import json
+import os
 import sys
 import lddwrap
 from absl import logging
@@ -12,10 +14,10 @@ from fabric.api import run, warn_only, hide, get, local, settings  # type: ignor
 import hashlib
 from tempfile import TemporaryDirectory
 
-from awstools.awstools import get_localhost_instance_id
+from awstools.awstools import get_localhost_instance_info
 from buildtools.utils import get_deploy_dir
 
-from typing import List, Tuple, Type, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple, Type
 
 
 def has_sudo() -> bool:
@@ -23,40 +25,101 @@ def has_sudo() -> bool:
         return run("sudo -ln true").return_code == 0
 
 
-def get_local_shared_libraries(elf: str) -> List[Tuple[str, str]]:
-    """Given path to executable `exe`, returns a list of path tuples, (A, B), where:
-    A is the local file path on the manager instance to the library
-    B is the destination file path on the run farm instance relative to the driver
-
-    NOTE: ignores the following dso's reported by ldd:
-     * linux-vdso : special dso injected by the kernel, not copyable
-     * ld-linux : is the dynamic loader, not copyable
-     * known members of glibc.  These could be copyable but
-       glibc is very coupled to the kernel version and following the pattern
-       of the conda packages we build from, we will not copy glibc around.
-       We compile against glibc and given the backwards compatibility of glibc
-       should be able to copy everything else to most other hosts
-       and they will work from a DSO linker/loader perspective (i.e.
-       if you're building a driver for AWS, it doesn't magically work
-       on a different platform just because you have libraries that will
-       link and load)
-    """
-
-    os_flavor = local(
-        "grep '^ID=' /etc/os-release | awk -F= '{print $2}' | tr -d '\"'", capture=True
-    )
+# on-disk cache of shared library resolution (see get_local_shared_libraries),
+# relative to the deploy dir
+SHARED_LIBRARY_CACHE_DIR = "shared-library-cache"
+# bump this whenever the format of the cached results changes
+SHARED_LIBRARY_CACHE_VERSION = 1
+
+# files whose packages are considered part of glibc, per OS flavor
+GLIBC_PROBE_GLOBS = {
+    "ubuntu": "/usr/lib/x86_64-linux-gnu/libc.so*",
+    "debian": "/usr/lib/x86_64-linux-gnu/libc.so*",
+    "centos": "/lib64/libc.so*",
+    "amzn": "/lib64/libc.so*",
+    "rhel": "/lib64/libc.so*",
+}
+
+# on-disk record of the environment probe (see is_on_aws), relative to the
+# deploy dir
+ENVIRONMENT_CACHE_FILE = "environment-cache.json"
+# seconds to wait for the instance metadata service, which answers instantly
+# on EC2 instances
+ENVIRONMENT_PROBE_TIMEOUT = 1
+# seconds to wait on a second try before recording that the manager is not on
+# EC2, so that one slow answer is not remembered for the whole boot
+ENVIRONMENT_PROBE_RETRY_TIMEOUT = 10
+
+# result of the environment probe of this process
+_on_aws: Optional[bool] = None
+
+# in-process caches, keyed by OS image key and by (ELF path, size, mtime)
+_glibc_shared_libs: Dict[str, Set[str]] = {}
+_elf_shared_libs: Dict[Tuple[str, int, int], List[Tuple[str, str]]] = {}
+
+
+def file_digest(path: Path | str) -> str:
+    """Return the sha256 of the contents of a file."""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _os_image() -> Tuple[str, str]:
+    """Return the OS flavor of the manager and a key that changes whenever its
+    OS release or glibc installation changes."""
+    with open("/etc/os-release", "r") as f:
+        os_release = f.read()
+    os_flavor = ""
+    for line in os_release.splitlines():
+        if line.startswith("ID="):
+            os_flavor = line[len("ID=") :].strip().strip('"')
     logging.debug(f"Running on OS: {os_flavor}")
 
-    if os_flavor not in ["ubuntu", "centos", "amzn", "debian", "rhel"]:
+    if os_flavor not in GLIBC_PROBE_GLOBS:
         raise ValueError(f"Unknown OS: {os_flavor}")
 
+    h = hashlib.sha256()
+    h.update(f"version:{SHARED_LIBRARY_CACHE_VERSION}\n{os_release}".encode())
+    probe = Path(GLIBC_PROBE_GLOBS[os_flavor])
+    for libc in sorted(probe.parent.glob(probe.name)):
+        st = libc.stat()
+        h.update(f"{libc}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return os_flavor, h.hexdigest()
+
+
+def _read_shared_library_cache(name: str) -> Optional[Any]:
+    path = Path(get_deploy_dir()) / SHARED_LIBRARY_CACHE_DIR / name
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_shared_library_cache(name: str, value: Any) -> None:
+    """Save value in the on-disk cache. Failing to do so is not fatal."""
+    path = Path(get_deploy_dir()) / SHARED_LIBRARY_CACHE_DIR / name
+    tmp = path.with_name(path.name + ".tmp")
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(tmp, "w") as f:
+            json.dump(value, f)
+        os.replace(tmp, path)
+    except OSError as e:
+        logging.warning(f"Unable to save shared library cache {path}: {e}")
+
+
+def _query_glibc_shared_libs(os_flavor: str) -> List[str]:
+    """Ask the package manager for the shared libraries of the packages that
+    provide glibc."""
     glibc_shared_libs = []
     if os_flavor in ["ubuntu", "debian"]:
         lines = []
         with settings(warn_only=True):
-            dpkg_output = local(
-                "dpkg -S /usr/lib/x86_64-linux-gnu/libc.so*", capture=True
-            )
+            dpkg_output = local(f"dpkg -S {GLIBC_PROBE_GLOBS[os_flavor]}", capture=True)
             if dpkg_output.return_code == 1:
                 print(f"Warning got:\n{dpkg_output.stderr}")
             lines = dpkg_output.split("\n")
@@ -68,19 +131,38 @@ def get_local_shared_libraries(elf: str) -> List[Tuple[str, str]]:
             dpkg_output_paths = local(
                 f"dpkg -L {pkg} | grep -P '\.so(\.|\s*$)'", capture=True
             )
-            lines = dpkg_output.split("\n")
             glibc_shared_libs.extend(dpkg_output_paths.stdout.split("\n"))
 
         logging.debug(glibc_shared_libs)
     elif os_flavor in ["centos", "amzn", "rhel"]:
         with settings(warn_only=True):
             rpm_output = local(
-                "rpm -q -f /lib64/libc.so* --filesbypkg | grep -P '\.so(\.|\s*$)'"
+                f"rpm -q -f {GLIBC_PROBE_GLOBS[os_flavor]} --filesbypkg | grep -P '\.so(\.|\s*$)'"
             )
             if rpm_output.return_code == 1:
                 print(f"Warning got:\n{rpm_output.stderr}")
             glibc_shared_libs.extend(rpm_output.split("\n"))
+    return glibc_shared_libs
+
+
+def get_glibc_shared_libs(os_flavor: str, os_key: str) -> Set[str]:
+    """Return the shared libraries that belong to glibc. Cached per OS image,
+    in-process and on disk."""
+    if os_key not in _glibc_shared_libs:
+        cache_name = f"glibc-{os_key[:32]}.json"
+        cached = _read_shared_library_cache(cache_name)
+        if cached is None:
+            cached = _query_glibc_shared_libs(os_flavor)
+            _write_shared_library_cache(cache_name, cached)
+        else:
+            logging.debug(f"Using cached glibc shared library list {cache_name}")
+        _glibc_shared_libs[os_key] = set(cached)
+    return _glibc_shared_libs[os_key]
+
 
+def _resolve_shared_libraries(
+    elf: str, glibc_shared_libs: Set[str]
+) -> List[Tuple[str, str]]:
     libs = []
     logging.debug(f"Identifying ldd dependencies for: {elf}")
     for dso in lddwrap.list_dependencies(Path(elf)):
@@ -113,6 +195,53 @@ def get_local_shared_libraries(elf: str) -> List[Tuple[str, str]]:
     return libs
 
 
+def get_local_shared_libraries(elf: str) -> List[Tuple[str, str]]:
+    """Given path to executable `exe`, returns a list of path tuples, (A, B), where:
+    A is the local file path on the manager instance to the library
+    B is the destination file path on the run farm instance relative to the driver
+
+    NOTE: ignores the following dso's reported by ldd:
+     * linux-vdso : special dso injected by the kernel, not copyable
+     * ld-linux : is the dynamic loader, not copyable
+     * known members of glibc.  These could be copyable but
+       glibc is very coupled to the kernel version and following the pattern
+       of the conda packages we build from, we will not copy glibc around.
+       We compile against glibc and given the backwards compatibility of glibc
+       should be able to copy everything else to most other hosts
+       and they will work from a DSO linker/loader perspective (i.e.
+       if you're building a driver for AWS, it doesn't magically work
+       on a different platform just because you have libraries that will
+       link and load)
+
+    Results are cached in-process per ELF file and on disk per ELF content
+    hash (and OS image and LD_LIBRARY_PATH), so that many servers sharing a
+    driver resolve its dependencies once.
+    """
+    st = os.stat(elf)
+    memo_key = (realpath(elf), st.st_size, st.st_mtime_ns)
+    if memo_key in _elf_shared_libs:
+        return list(_elf_shared_libs[memo_key])
+
+    os_flavor, os_key = _os_image()
+    h = hashlib.sha256()
+    h.update(f"os:{os_key}\n".encode())
+    h.update(f"ld_library_path:{os.environ.get('LD_LIBRARY_PATH')}\n".encode())
+    h.update(f"elf:{file_digest(elf)}\n".encode())
+    cache_name = f"ldd-{h.hexdigest()[:32]}.json"
+
+    cached = _read_shared_library_cache(cache_name)
+    libs: Optional[List[Tuple[str, str]]] = None
+    if cached is not None and all(os.path.exists(path) for path, _ in cached):
+        logging.debug(f"Using cached shared libraries of {elf} from {cache_name}")
+        libs = [(path, soname) for path, soname in cached]
+    if libs is None:
+        libs = _resolve_shared_libraries(elf, get_glibc_shared_libs(os_flavor, os_key))
+        _write_shared_library_cache(cache_name, libs)
+
+    _elf_shared_libs[memo_key] = libs
+    return list(libs)
+
+
 class MacAddress:
     """This class allows globally allocating/assigning MAC addresses.
     It also wraps up the code necessary to get a string version of a mac
@@ -173,8 +302,54 @@ class MacAddress:
         return cls.next_mac_alloc
 
 
+def _boot_id() -> str:
+    """Return an id that changes whenever the manager reboots (or moves to
+    another machine)."""
+    try:
+        with open("/proc/sys/kernel/random/boot_id", "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _probe_environment() -> bool:
+    """Return whether the manager runs on an EC2 instance, from the on-disk
+    record of an earlier probe in the same boot if there is one."""
+    path = Path(get_deploy_dir()) / ENVIRONMENT_CACHE_FILE
+    boot_id = _boot_id()
+    try:
+        with open(path, "r") as f:
+            cached = json.load(f)
+        if boot_id and cached.get("boot_id") == boot_id:
+            logging.debug(f"Using environment probe result from {path}")
+            return bool(cached["on_aws"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    on_aws = any(
+        get_localhost_instance_info("meta-data/instance-id", timeout) is not None
+        for timeout in (ENVIRONMENT_PROBE_TIMEOUT, ENVIRONMENT_PROBE_RETRY_TIMEOUT)
+    )
+
+    if boot_id:
+        tmp = path.with_name(path.name + f".{os.getpid()}.tmp")
+        try:
+            with open(tmp, "w") as f:
+                json.dump({"boot_id": boot_id, "on_aws": on_aws}, f)
+            os.replace(tmp, path)
+        except OSError as e:
+            logging.warning(f"Unable to save environment probe result to {path}: {e}")
+    return on_aws
+
+
 def is_on_aws() -> bool:
-    return get_localhost_instance_id() is not None
+    """Return whether the manager runs on an EC2 instance. The instance
+    metadata service is asked at most once per process (and, thanks to the
+    on-disk record, once per boot of the manager)."""
+    global _on_aws
+    if _on_aws is None:
+        _on_aws = _probe_environment()
+    return _on_aws
 
 
 def run_only_aws(*args, **kwargs) -> None:
@@ -0,0 +1,110 @@
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+from buildtools import bitstream_cache
+from buildtools.bitstream_cache import BuildInput, hash_build_inputs
+
+PARAMS = {"frequency": "60.0", "strategy": "TIMING"}
+
+
+@pytest.fixture
+def board(tmp_path: Path) -> Path:
+    """A platform directory with a script, a board file and two CL_DIRs."""
+    board = tmp_path / "board"
+    (board / "scripts").mkdir(parents=True)
+    (board / "scripts" / "main.tcl").write_text("synth_design\n")
+    (board / "board.xdc").write_text("set_property PACKAGE_PIN A1\n")
+    for quintuplet in ["a", "b"]:
+        (board / f"cl_{quintuplet}" / "design").mkdir(parents=True)
+        (board / f"cl_{quintuplet}" / "design" / "top.sv").write_text(
+            f"module {quintuplet};\n"
+        )
+    return board
+
+
+def key(board: Path, params: dict = PARAMS) -> str:
+    return hash_build_inputs(
+        [BuildInput(str(board), exclude=["cl_*"]), BuildInput(str(board / "cl_a"))],
+        params,
+    )
+
+
+def test_key_is_stable(board: Path) -> None:
+    assert key(board) == key(board)
+
+
+@pytest.mark.parametrize(
+    "path", ["scripts/main.tcl", "board.xdc", "cl_a/design/top.sv"]
+)
+def test_key_covers_copied_files(board: Path, path: str) -> None:
+    before = key(board)
+    with open(board / path, "a") as f:
+        f.write("# changed\n")
+    assert key(board) != before
+
+
+def test_key_covers_params(board: Path) -> None:
+    assert key(board) != key(board, dict(PARAMS, frequency="50.0"))
+
+
+def test_key_ignores_files_not_copied(board: Path) -> None:
+    before = key(board)
+    # other CL_DIRs are excluded from the copy, and stamps don't change the build
+    (board / "cl_b" / "design" / "top.sv").write_text("module changed;\n")
+    (board / "cl_a" / "stamp").write_text("now\n")
+    assert key(board) == before
+
+
+def test_anchored_exclude(tmp_path: Path) -> None:
+    (tmp_path / "build" / "checkpoints").mkdir(parents=True)
+    (tmp_path / "build" / "scripts").mkdir()
+    (tmp_path / "build" / "scripts" / "checkpoints").write_text("kept\n")
+    (tmp_path / "build" / "checkpoints" / "top.dcp").write_text("dcp\n")
+    build_input = BuildInput(str(tmp_path), exclude=["build/checkpoints"])
+    assert build_input.files() == [str(tmp_path / "build" / "scripts" / "checkpoints")]
+
+
+def test_missing_input_raises(board: Path) -> None:
+    with pytest.raises(FileNotFoundError):
+        hash_build_inputs([BuildInput(str(board / "cl_c"))], PARAMS)
+
+
+@pytest.fixture
+def cache(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setattr(bitstream_cache, "get_deploy_dir", lambda: str(tmp_path))
+    monkeypatch.setattr(bitstream_cache, "FLAGS", SimpleNamespace(bitstreamcache=True))
+    return tmp_path / bitstream_cache.CACHE_DIR_NAME
+
+
+def test_cache_miss_then_hit(cache: Path, tmp_path: Path) -> None:
+    bitstream = tmp_path / "firesim.tar.gz"
+    bitstream.write_bytes(b"bitstream")
+
+    assert bitstream_cache.lookup("k") is None
+    bitstream_cache.store(
+        "k",
+        "build_a",
+        {"bitstream_tar": "file://{cache_dir}/firesim.tar.gz"},
+        [str(bitstream)],
+    )
+    assert bitstream_cache.lookup("k") == {
+        "bitstream_tar": f"file://{cache}/k/firesim.tar.gz"
+    }
+    assert (cache / "k" / "firesim.tar.gz").read_bytes() == b"bitstream"
+    assert bitstream_cache.lookup("other") is None
+
+
+def test_first_stored_entry_wins(cache: Path) -> None:
+    bitstream_cache.store("k", "build_a", {"agfi": "agfi-a"})
+    bitstream_cache.store("k", "build_b", {"agfi": "agfi-b"})
+    assert bitstream_cache.lookup("k") == {"agfi": "agfi-a"}
+    # no staging directories are left behind
+    assert [p.name for p in cache.iterdir()] == ["k"]
+
+
+def test_disabled_cache(cache: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    bitstream_cache.store("k", "build_a", {"agfi": "agfi-a"})
+    monkeypatch.setattr(bitstream_cache, "FLAGS", SimpleNamespace(bitstreamcache=False))
+    assert bitstream_cache.lookup("k") is None
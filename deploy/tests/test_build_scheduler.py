@@ -0,0 +1,148 @@
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import pytest
+
+from buildtools import build_scheduler
+from buildtools.build_farm import BuildFarm, BuildHost
+from buildtools.build_scheduler import BuildScheduler
+
+
+class FakeBuildFarm(BuildFarm):
+    """Build farm with a fixed number of slots, whose build hosts finish
+    booting after a number of polls."""
+
+    def __init__(self, slots: int, boot_polls: int = 0) -> None:
+        super().__init__({})
+        self.slots = slots
+        self.boot_polls = boot_polls
+        self.requested: List[str] = []
+        self.polls: List[List[str]] = []
+        self.polls_left: Dict[str, int] = {}
+        self.running: List[str] = []
+        self.max_running = 0
+
+    def request_build_host(self, build_config: Any) -> None:
+        self.requested.append(build_config.name)
+        self.polls_left[build_config.name] = self.boot_polls
+
+    def wait_on_build_host_initialization(self, build_config: Any) -> None:
+        raise AssertionError("build hosts must be polled")
+
+    def poll_build_host_initializations(self, build_configs: List[Any]) -> List[Any]:
+        self.polls.append([b.name for b in build_configs])
+        for b in build_configs:
+            self.polls_left[b.name] -= 1
+        return [b for b in build_configs if self.polls_left[b.name] < 0]
+
+    def assign_build_host(self, build_config: Any) -> bool:
+        assert self.polls_left[build_config.name] < 0, "dispatched before ready"
+        if len(self.running) == self.slots:
+            return False
+        self.running.append(build_config.name)
+        self.max_running = max(self.max_running, len(self.running))
+        self.build_hosts.append(
+            BuildHost("builddir", build_config, f"10.0.0.{len(self.running)}")
+        )
+        return True
+
+    def finish_build(self, build_config: Any) -> None:
+        self.running.remove(build_config.name)
+        self.build_hosts = [
+            h for h in self.build_hosts if h.build_config != build_config
+        ]
+
+    def release_build_host(self, build_config: Any) -> None:
+        pass
+
+
+def build(name: str, quintuplet: str = "") -> Any:
+    return SimpleNamespace(
+        name=name, get_chisel_quintuplet=lambda: quintuplet or f"q-{name}"
+    )
+
+
+def builds(*names: str) -> List[Any]:
+    return [build(name) for name in names]
+
+
+@pytest.fixture(autouse=True)
+def fast_polls(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setattr(build_scheduler, "BUILD_HOST_POLL_INTERVAL", 0.01)
+
+
+def passing_build(build_config: Any) -> bool:
+    time.sleep(0.05)
+    return True
+
+
+def test_queue_larger_than_pool() -> None:
+    farm = FakeBuildFarm(slots=2)
+    results = BuildScheduler(farm, builds("a", "b", "c", "d", "e")).run(passing_build)
+    assert results == {name: True for name in "abcde"}
+    assert farm.max_running == 2
+    assert farm.running == []
+
+
+def test_booting_build_hosts_are_polled_together() -> None:
+    farm = FakeBuildFarm(slots=3, boot_polls=2)
+    results = BuildScheduler(farm, builds("a", "b", "c")).run(passing_build)
+    assert results == {"a": True, "b": True, "c": True}
+    # every poll checks all booting build hosts, builds only start once ready
+    assert farm.polls == [["a", "b", "c"]] * 3
+
+
+def test_failed_builds() -> None:
+    def build_fn(build_config: Any) -> bool:
+        if build_config.name == "raises":
+            raise Exception("build failed")
+        return build_config.name == "passes"
+
+    farm = FakeBuildFarm(slots=1)
+    results = BuildScheduler(farm, builds("passes", "fails", "raises")).run(build_fn)
+    assert results == {"passes": True, "fails": False, "raises": False}
+
+
+def test_only_prepared_builds_get_a_build_host() -> None:
+    def prepare(build_config: Any) -> bool:
+        if build_config.name == "broken":
+            raise Exception("RTL generation failed")
+        # cached builds are finished by their preparation
+        return build_config.name != "cached"
+
+    farm = FakeBuildFarm(slots=2, boot_polls=1)
+    scheduler = BuildScheduler(farm, builds("built", "cached", "broken"))
+    scheduler.prepare(prepare, jobs=2)
+    results = scheduler.run(passing_build)
+    assert results == {"built": True, "cached": True, "broken": False}
+    assert farm.requested == ["built"]
+
+
+def test_same_quintuplet_is_prepared_serially(tmp_path: Path) -> None:
+    log = tmp_path / "log"
+
+    def prepare(build_config: Any) -> bool:
+        with open(log, "a") as f:
+            f.write(f"start {build_config.name}\n")
+        time.sleep(0.3)
+        with open(log, "a") as f:
+            f.write(f"end {build_config.name}\n")
+        return True
+
+    farm = FakeBuildFarm(slots=3)
+    scheduler = BuildScheduler(farm, [build("a1", "a"), build("a2", "a"), build("b")])
+    scheduler.prepare(prepare, jobs=3)
+    assert scheduler.run(passing_build) == {"a1": True, "a2": True, "b": True}
+
+    events = log.read_text().splitlines()
+    # b is prepared alongside a1, a2 only starts once a1 is done
+    assert events.index("start b") < events.index("end a1")
+    assert events.index("end a1") < events.index("start a2")
+
+
+def test_no_build_host_for_queued_builds() -> None:
+    farm = FakeBuildFarm(slots=0)
+    with pytest.raises(Exception, match="No build host can run"):
+        BuildScheduler(farm, builds("a")).run(passing_build)
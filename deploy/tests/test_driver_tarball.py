@@ -0,0 +1,99 @@
+import os
+import shutil
+import tarfile
+from pathlib import Path
+
+import pytest
+
+from runtools.driver_tarball import tarball_members, write_driver_tarball
+
+PATHS = [
+    ("driver/FireSim-f1", ""),
+    ("driver/runtime.conf", "conf/"),
+    ("driver/libdwarf.so", "lib/libdwarf.so.1"),
+    ("driver/firesim-lib", ""),
+]
+
+
+@pytest.fixture
+def base_dir(tmp_path: Path) -> Path:
+    """A driver directory with files, a library directory and a symlink."""
+    base = tmp_path / "base"
+    driver = base / "driver"
+    (driver / "firesim-lib" / "include").mkdir(parents=True)
+    (driver / "FireSim-f1").write_bytes(b"\x7fELF driver")
+    os.chmod(driver / "FireSim-f1", 0o755)
+    (driver / "runtime.conf").write_text("+macaddr0=00:12:6D:00:00:02\n")
+    (driver / "libdwarf.so").write_bytes(b"\x7fELF lib")
+    (driver / "firesim-lib" / "include" / "bridge.h").write_text("#pragma once\n")
+    os.symlink(driver / "runtime.conf", driver / "firesim-lib" / "runtime.conf")
+    return base
+
+
+def write(base_dir: Path, output: Path, codec: str = "gzip") -> bytes:
+    write_driver_tarball(PATHS, base_dir, output, codec)
+    return output.read_bytes()
+
+
+def touch_all(base_dir: Path, mtime: int) -> None:
+    for dirpath, dirnames, filenames in os.walk(base_dir):
+        for name in dirnames + filenames:
+            os.utime(os.path.join(dirpath, name), (mtime, mtime))
+
+
+@pytest.mark.parametrize(
+    "codec",
+    [
+        "gzip",
+        pytest.param(
+            "zstd",
+            marks=pytest.mark.skipif(
+                shutil.which("zstd") is None, reason="zstd is not installed"
+            ),
+        ),
+    ],
+)
+def test_repeated_runs_are_byte_identical(
+    base_dir: Path, tmp_path: Path, codec: str
+) -> None:
+    first = write(base_dir, tmp_path / "a" / "driver-bundle.tar", codec)
+    # rebuilt drivers get new mtimes, the archive must not change
+    touch_all(base_dir, 1_000_000_000)
+    second = write(base_dir, tmp_path / "b" / "driver-bundle.tar", codec)
+    assert first == second
+    # rewriting in place gives the same bytes too, without leftovers
+    assert write(base_dir, tmp_path / "a" / "driver-bundle.tar", codec) == first
+    assert os.listdir(tmp_path / "a") == ["driver-bundle.tar"]
+
+
+def test_changed_contents_change_the_tarball(base_dir: Path, tmp_path: Path) -> None:
+    before = write(base_dir, tmp_path / "driver-bundle.tar")
+    (base_dir / "driver" / "runtime.conf").write_text("+macaddr0=00:12:6D:00:00:03\n")
+    assert write(base_dir, tmp_path / "driver-bundle.tar") != before
+
+
+def test_members_and_metadata(base_dir: Path, tmp_path: Path) -> None:
+    members = [name for name, _ in tarball_members(PATHS, base_dir)]
+    assert members == [
+        "FireSim-f1",
+        "conf/runtime.conf",
+        "firesim-lib",
+        "firesim-lib/include",
+        "firesim-lib/include/bridge.h",
+        "firesim-lib/runtime.conf",
+        "lib/libdwarf.so.1",
+    ]
+
+    output = tmp_path / "driver-bundle.tar"
+    write(base_dir, output)
+    with tarfile.open(output) as tar:
+        infos = {info.name: info for info in tar.getmembers()}
+        assert sorted(infos) == members
+        assert all(info.mtime == 0 and info.uid == 0 for info in infos.values())
+        assert infos["FireSim-f1"].mode == 0o755
+        # symlinks are followed, like rsync -L
+        link = infos["firesim-lib/runtime.conf"]
+        assert link.isfile()
+        contents = tar.extractfile(link)
+        assert contents is not None
+        assert contents.read() == b"+macaddr0=00:12:6D:00:00:02\n"
@@ -0,0 +1,119 @@
+import threading
+from datetime import timedelta
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from awstools import awstools
+
+
+class FakeEC2:
+    """Stands in for an EC2 service resource. Launches up to the remaining
+    capacity of a subnet, and raises a ClientError when it has none, like EC2
+    does for MinCount=1."""
+
+    def __init__(self, capacity: Dict[str, int]) -> None:
+        self.capacity = capacity
+        self.requests: List[Tuple[str, int]] = []
+        self.lock = threading.Lock()
+
+    def create_instances(self, **kwargs: Any) -> List[str]:
+        subnet_id = kwargs["NetworkInterfaces"][0]["SubnetId"]
+        max_count = kwargs["MaxCount"]
+        assert kwargs["MinCount"] == 1
+        with self.lock:
+            self.requests.append((subnet_id, max_count))
+            launched = min(max_count, self.capacity[subnet_id])
+            if launched == 0:
+                raise awstools.exceptions.ClientError(
+                    {
+                        "Error": {
+                            "Code": "InsufficientInstanceCapacity",
+                            "Message": "no capacity",
+                        }
+                    },
+                    "RunInstances",
+                )
+            self.capacity[subnet_id] -= launched
+            return [f"{subnet_id}-i{i}" for i in range(launched)]
+
+
+def launch(
+    fake: FakeEC2, subnet_ids: List[str], count: int
+) -> Tuple[List[Any], List[str]]:
+    return awstools.launch_instances_in_subnets(
+        {}, "sg", subnet_ids, count, ec2_factory=lambda: fake
+    )
+
+
+@pytest.mark.parametrize(
+    "count, num_subnets, expected",
+    [
+        (7, 3, [3, 2, 2]),
+        (6, 3, [2, 2, 2]),
+        (2, 5, [1, 1]),
+        (1, 1, [1]),
+    ],
+)
+def test_split_launch_count(count: int, num_subnets: int, expected: List[int]) -> None:
+    assert awstools.split_launch_count(count, num_subnets) == expected
+
+
+def test_first_subnet_launches_everything() -> None:
+    fake = FakeEC2({"a": 10, "b": 10})
+    launched, exhausted = launch(fake, ["a", "b"], 4)
+    assert len(launched) == 4
+    assert exhausted == []
+    assert fake.requests == [("a", 4)]
+
+
+def test_shortfall_spreads_across_other_subnets() -> None:
+    fake = FakeEC2({"a": 2, "b": 10, "c": 10})
+    launched, exhausted = launch(fake, ["a", "b", "c"], 7)
+    assert len(launched) == 7
+    assert exhausted == []
+    assert fake.requests[0] == ("a", 7)
+    assert sorted(fake.requests[1:]) == [("b", 3), ("c", 2)]
+
+
+def test_capacity_error_spills_into_next_subnets() -> None:
+    fake = FakeEC2({"a": 0, "b": 1, "c": 0, "d": 10})
+    launched, exhausted = launch(fake, ["a", "b", "c", "d"], 6)
+    # b and d launch what they can, a and c have no capacity at all
+    assert sorted(launched) == ["b-i0", "d-i0", "d-i1"]
+    assert exhausted == ["a", "c"]
+    assert sorted(fake.requests[1:]) == [("b", 2), ("c", 2), ("d", 2)]
+
+
+def test_retries_with_backoff_until_count(monkeypatch: pytest.MonkeyPatch) -> None:
+    fake = FakeEC2({"a": 0, "b": 1, "c": 0})
+    delays: List[float] = []
+
+    def sleep(delay: float) -> None:
+        delays.append(delay)
+        # capacity frees up in a after the second backoff
+        if len(delays) == 2:
+            fake.capacity["a"] = 10
+
+    monkeypatch.setattr(awstools.time, "sleep", sleep)
+    instances = awstools.launch_remaining_instances(
+        {},
+        "sg",
+        ["a", "b", "c"],
+        [],
+        3,
+        "f1.2xlarge",
+        timedelta(hours=1),
+        ec2_factory=lambda: fake,
+    )
+
+    assert len(instances) == 3
+    # only rounds that launched nothing back off, with jittered, growing delays
+    assert len(delays) == 2
+    initial = awstools.LAUNCH_BACKOFF_INITIAL
+    assert initial / 2 <= delays[0] <= initial
+    assert initial <= delays[1] <= 2 * initial
+    # a had no capacity in the first round and moved to the back, it is
+    # tried first again once it launched something
+    assert fake.requests[0] == ("a", 3)
+    assert fake.requests[-1] == ("a", 1)
@@ -0,0 +1,95 @@
+from typing import Any, Dict, List
+
+import pytest
+
+from runtools.topology.pass_manager import PassManager, fingerprint, topology_pass
+
+
+class Topology:
+    """Owner of a few passes, like FireSimTopologyWithPasses."""
+
+    def __init__(self) -> None:
+        self.pass_manager = PassManager()
+        self.latency = 6405
+        self.config: Dict[str, Any] = {"a": [1, 2]}
+        self.runs: List[str] = []
+
+    @topology_pass(inputs=["latency", "config"], outputs=["test_links"])
+    def pass_links(self) -> str:
+        self.runs.append("links")
+        return "links"
+
+    @topology_pass(inputs=["test_links"], outputs=["test_tables"])
+    def pass_tables(self) -> None:
+        self.runs.append("tables")
+
+    @topology_pass(inputs=["test_tables", "latency"])
+    def pass_report(self) -> None:
+        self.runs.append("report")
+
+    @topology_pass()
+    def pass_always(self) -> None:
+        self.runs.append("always")
+
+
+def run_all(topology: Topology) -> List[str]:
+    topology.runs = []
+    topology.pass_links()
+    topology.pass_tables()
+    topology.pass_report()
+    topology.pass_always()
+    return topology.runs
+
+
+def test_unchanged_inputs_skip_passes() -> None:
+    topology = Topology()
+    assert run_all(topology) == ["links", "tables", "report", "always"]
+    assert run_all(topology) == ["always"]
+    assert topology.pass_manager.timings["pass_links"] is None
+    assert topology.pass_manager.timings["pass_always"] is not None
+
+
+def test_skipped_pass_returns_none() -> None:
+    topology = Topology()
+    assert topology.pass_links() == "links"
+    assert topology.pass_links() is None
+
+
+def test_changed_input_invalidates_dependent_passes() -> None:
+    topology = Topology()
+    run_all(topology)
+    topology.config["a"].append(3)
+    assert run_all(topology) == ["links", "tables", "report", "always"]
+
+
+def test_direct_input_of_later_pass() -> None:
+    topology = Topology()
+    run_all(topology)
+    # latency is an input of links, so all of them run again
+    topology.latency = 1
+    assert run_all(topology) == ["links", "tables", "report", "always"]
+
+
+def test_missing_producer_raises() -> None:
+    with pytest.raises(Exception, match="Run pass_links first"):
+        Topology().pass_tables()
+
+
+class Slotted:
+    __slots__ = ["value"]
+
+    def __init__(self, value: int) -> None:
+        self.value = value
+
+
+class Plain:
+    pass
+
+
+def test_fingerprint() -> None:
+    assert fingerprint({"a": 1, "b": 2}) == fingerprint({"b": 2, "a": 1})
+    assert fingerprint(Slotted(1)) == fingerprint(Slotted(1))
+    assert fingerprint(Slotted(1)) != fingerprint(Slotted(2))
+    # objects only differing in their address fingerprint the same
+    assert fingerprint([Plain()]) == fingerprint([Plain()])
+    assert fingerprint(object()) == fingerprint(object())
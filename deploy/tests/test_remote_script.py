@@ -0,0 +1,149 @@
+import subprocess
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from runtools import remote_script
+from runtools.remote_script import STEP_BEGIN_MARKER, STEP_END_MARKER, RemoteScript
+
+
+class Result(str):
+    """Output of a fabric run() call."""
+
+    return_code: int
+
+
+def bash(script: str) -> Result:
+    """Run script like fabric's run() does, with stderr merged into stdout."""
+    proc = subprocess.run(
+        ["bash", "-c", script],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+    )
+    result = Result(proc.stdout.rstrip("\n"))
+    result.return_code = proc.returncode
+    return result
+
+
+def run_locally(script: RemoteScript) -> Result:
+    result = bash(script.render())
+    script.parse(result)
+    return result
+
+
+def test_round_trip(tmp_path: Path) -> None:
+    (tmp_path / "sim_slot_0").mkdir()
+    script = RemoteScript("test")
+    listing = script.add("List", "ls", cwd=str(tmp_path))
+    no_newline = script.add("No newline", "printf 'a\\nb'")
+    newline = script.add("Newline", "echo a; echo b >&2")
+    silent = script.add("Silent", "true")
+    result = run_locally(script)
+
+    assert result.return_code == 0
+    assert listing.output == ["sim_slot_0"]
+    assert no_newline.output == ["a", "b"]
+    assert newline.output == ["a", "b"]
+    assert silent.output == []
+    for step in script.steps:
+        assert step.return_code == 0
+        assert step.millis is not None and step.millis >= 0
+
+
+def test_failing_step_stops_script() -> None:
+    script = RemoteScript("test")
+    first = script.add("Fails", "echo broken; exit 3")
+    second = script.add("Skipped", "echo never")
+    result = run_locally(script)
+
+    assert result.return_code == 3
+    assert first.failed() and first.return_code == 3
+    assert first.output == ["broken"]
+    assert second.return_code is None and not second.failed()
+    assert second.output == []
+
+
+def test_warn_only_step_does_not_stop_script() -> None:
+    script = RemoteScript("test")
+    first = script.add("Fails", "exit 1", warn_only=True)
+    second = script.add("Runs", "echo ran")
+    result = run_locally(script)
+
+    assert result.return_code == 0
+    assert first.failed()
+    assert second.return_code == 0 and second.output == ["ran"]
+
+
+def test_missing_end_marker() -> None:
+    # the connection dropped while the second step ran
+    output = "\n".join(
+        [
+            f"{STEP_BEGIN_MARKER} 0",
+            "done",
+            f"{STEP_END_MARKER} 0 0 12",
+            f"{STEP_BEGIN_MARKER} 1",
+            "partial",
+        ]
+    )
+    script = RemoteScript("test")
+    first = script.add("First", "echo done")
+    second = script.add("Second", "echo partial; sleep 100")
+    script.parse(output)
+
+    assert first.return_code == 0 and first.millis == 12
+    assert second.output == ["partial"]
+    assert second.return_code is None and not second.failed()
+
+
+def test_marker_like_output_is_kept() -> None:
+    output = "\n".join(
+        [
+            f"{STEP_BEGIN_MARKER} 0\r",
+            f"{STEP_END_MARKER} is not a marker",
+            f"{STEP_END_MARKER} 0 1 5\r",
+        ]
+    )
+    script = RemoteScript("test")
+    step = script.add("Step", "true")
+    script.parse(output)
+
+    assert step.output == [f"{STEP_END_MARKER} is not a marker"]
+    assert step.return_code == 1 and step.millis == 5
+
+
+@pytest.fixture
+def local_run(monkeypatch: pytest.MonkeyPatch) -> None:
+    def run(command: str, **kwargs: Any) -> Result:
+        return bash(command)
+
+    monkeypatch.setattr(remote_script, "run", run)
+
+
+def test_run_raises_on_failed_step(local_run: None) -> None:
+    script = RemoteScript("test")
+    script.add("Fine", "true")
+    script.add("Check", "false", error="the check failed")
+    with pytest.raises(Exception, match="the check failed"):
+        script.run()
+
+
+def test_run_returns_warn_only_failures(local_run: None) -> None:
+    script = RemoteScript("test")
+    script.add("Fails", "false", warn_only=True)
+    steps = script.run()
+    assert [step.return_code for step in steps] == [1]
+
+
+def test_run_raises_if_script_did_not_run(
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    def run(command: str, **kwargs: Any) -> Result:
+        return bash("echo 'bash: command not found'; exit 127")
+
+    monkeypatch.setattr(remote_script, "run", run)
+    script = RemoteScript("test")
+    script.add("Step", "true")
+    with pytest.raises(Exception, match="Unable to run test"):
+        script.run()
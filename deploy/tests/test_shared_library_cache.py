@@ -0,0 +1,156 @@
+import os
+from pathlib import Path
+from typing import List, Set, Tuple
+
+import pytest
+
+from runtools import utils
+
+
+class FakeResolver:
+    """Stands in for the package manager and ldd, counting how often each is
+    asked."""
+
+    def __init__(self, libs: List[Tuple[str, str]]) -> None:
+        self.libs = libs
+        self.os_key = "image-a"
+        self.glibc_queries: List[str] = []
+        self.resolved: List[str] = []
+
+    def os_image(self) -> Tuple[str, str]:
+        return "ubuntu", self.os_key
+
+    def query_glibc_shared_libs(self, os_flavor: str) -> List[str]:
+        self.glibc_queries.append(os_flavor)
+        return ["/lib/x86_64-linux-gnu/libc.so.6"]
+
+    def resolve_shared_libraries(
+        self, elf: str, glibc_shared_libs: Set[str]
+    ) -> List[Tuple[str, str]]:
+        assert glibc_shared_libs == {"/lib/x86_64-linux-gnu/libc.so.6"}
+        self.resolved.append(elf)
+        return list(self.libs)
+
+
+@pytest.fixture
+def lib(tmp_path: Path) -> Path:
+    lib = tmp_path / "libdwarf.so.1.0"
+    lib.write_bytes(b"\x7fELF lib")
+    return lib
+
+
+@pytest.fixture
+def elf(tmp_path: Path) -> Path:
+    elf = tmp_path / "FireSim-f1"
+    elf.write_bytes(b"\x7fELF driver")
+    return elf
+
+
+@pytest.fixture
+def resolver(
+    tmp_path: Path, lib: Path, monkeypatch: pytest.MonkeyPatch
+) -> FakeResolver:
+    resolver = FakeResolver([(str(lib), "libdwarf.so.1")])
+    monkeypatch.setattr(utils, "get_deploy_dir", lambda: str(tmp_path))
+    monkeypatch.setattr(utils, "_os_image", resolver.os_image)
+    monkeypatch.setattr(
+        utils, "_query_glibc_shared_libs", resolver.query_glibc_shared_libs
+    )
+    monkeypatch.setattr(
+        utils, "_resolve_shared_libraries", resolver.resolve_shared_libraries
+    )
+    monkeypatch.setattr(utils, "_glibc_shared_libs", {})
+    monkeypatch.setattr(utils, "_elf_shared_libs", {})
+    monkeypatch.delenv("LD_LIBRARY_PATH", raising=False)
+    return resolver
+
+
+def new_process(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Drop the in-process caches, leaving the on-disk ones."""
+    monkeypatch.setattr(utils, "_glibc_shared_libs", {})
+    monkeypatch.setattr(utils, "_elf_shared_libs", {})
+
+
+def test_resolved_once_per_process(
+    resolver: FakeResolver, elf: Path, lib: Path
+) -> None:
+    expected = [(str(lib), "libdwarf.so.1")]
+    assert utils.get_local_shared_libraries(str(elf)) == expected
+    assert utils.get_local_shared_libraries(str(elf)) == expected
+    assert resolver.resolved == [str(elf)]
+    assert resolver.glibc_queries == ["ubuntu"]
+
+
+def test_callers_cannot_modify_cached_results(
+    resolver: FakeResolver, elf: Path
+) -> None:
+    utils.get_local_shared_libraries(str(elf)).clear()
+    assert len(utils.get_local_shared_libraries(str(elf))) == 1
+
+
+def test_disk_cache_is_shared_across_processes(
+    resolver: FakeResolver, elf: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    first = utils.get_local_shared_libraries(str(elf))
+    new_process(monkeypatch)
+    # rebuilding the driver with the same contents only changes its mtime
+    os.utime(elf, (1_000_000_000, 1_000_000_000))
+    assert utils.get_local_shared_libraries(str(elf)) == first
+    assert resolver.resolved == [str(elf)]
+    assert resolver.glibc_queries == ["ubuntu"]
+
+
+def test_changed_elf_is_resolved_again(resolver: FakeResolver, elf: Path) -> None:
+    utils.get_local_shared_libraries(str(elf))
+    elf.write_bytes(b"\x7fELF rebuilt driver")
+    utils.get_local_shared_libraries(str(elf))
+    assert resolver.resolved == [str(elf)] * 2
+    # the glibc list does not depend on the ELF
+    assert resolver.glibc_queries == ["ubuntu"]
+
+
+def test_missing_library_invalidates_disk_cache(
+    resolver: FakeResolver, elf: Path, lib: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    utils.get_local_shared_libraries(str(elf))
+    new_process(monkeypatch)
+    lib.unlink()
+    utils.get_local_shared_libraries(str(elf))
+    assert resolver.resolved == [str(elf)] * 2
+
+
+def test_changed_os_image_invalidates_disk_cache(
+    resolver: FakeResolver, elf: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    utils.get_local_shared_libraries(str(elf))
+    new_process(monkeypatch)
+    resolver.os_key = "image-b"
+    utils.get_local_shared_libraries(str(elf))
+    assert resolver.resolved == [str(elf)] * 2
+    assert resolver.glibc_queries == ["ubuntu"] * 2
+
+
+def test_changed_ld_library_path_invalidates_disk_cache(
+    resolver: FakeResolver, elf: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    utils.get_local_shared_libraries(str(elf))
+    new_process(monkeypatch)
+    monkeypatch.setenv("LD_LIBRARY_PATH", "/opt/lib")
+    utils.get_local_shared_libraries(str(elf))
+    assert resolver.resolved == [str(elf)] * 2
+    # the glibc list only depends on the OS image
+    assert resolver.glibc_queries == ["ubuntu"]
+
+
+def test_unreadable_disk_cache_is_ignored(
+    resolver: FakeResolver,
+    elf: Path,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    utils.get_local_shared_libraries(str(elf))
+    new_process(monkeypatch)
+    for entry in (tmp_path / utils.SHARED_LIBRARY_CACHE_DIR).iterdir():
+        entry.write_text("{truncated")
+    assert len(utils.get_local_shared_libraries(str(elf))) == 1
+    assert resolver.resolved == [str(elf)] * 2
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+from typing import Iterator, Set, Tuple
+
+import pytest
+
+from runtools.topology.core import FireSimTopology
+from runtools.topology.core_with_passes import FireSimTopologyWithPasses
+from runtools.topology.elements import FireSimServerNode, FireSimSwitchNode
+from runtools.topology.switching import _turnaround_switch, path_diversity_warnings
+
+
+class PathDiversityTopologies(FireSimTopology):
+    def uneven_leaves(self) -> None:
+        """2 roots, each linked to a leaf with 4 servers and a leaf with 1."""
+        roots = [FireSimSwitchNode() for _ in range(2)]
+        leaves = [FireSimSwitchNode() for _ in range(2)]
+        for root in roots:
+            root.add_downlinks(leaves)
+        leaves[0].add_downlinks([FireSimServerNode() for _ in range(4)])
+        leaves[1].add_downlinks([FireSimServerNode()])
+        self.roots = roots
+
+
+def build_tables(topology_name: str) -> FireSimTopology:
+    """Run the mac address and switching table passes on a topology."""
+    topology = PathDiversityTopologies(topology_name, 0)
+    owner = SimpleNamespace(firesimtopol=topology, uplink_routing="ecmp")
+    FireSimTopologyWithPasses.pass_assign_mac_addresses.__wrapped__(owner)  # type: ignore
+    FireSimTopologyWithPasses.pass_compute_switching_tables.__wrapped__(owner)  # type: ignore
+    return topology
+
+
+def leaf_turnarounds(
+    topology: FireSimTopology,
+) -> Iterator[Tuple[FireSimSwitchNode, Set[FireSimSwitchNode]]]:
+    """Yield each leaf switch and the switches its remote traffic turns around at."""
+    all_macs = [
+        server.get_mac_address().as_int_no_prefix()
+        for server in topology.get_dfs_order_servers()
+    ]
+    for switch in topology.get_dfs_order_switches():
+        if not switch.uplinks or not any(
+            isinstance(link.get_downlink_side(), FireSimServerNode)
+            for link in switch.downlinks
+        ):
+            continue
+        local_macs = set(mac.as_int_no_prefix() for mac in switch.downlinkmacs)
+        yield switch, set(
+            _turnaround_switch(switch, mac) for mac in all_macs if mac not in local_macs
+        )
+
+
+@pytest.mark.parametrize("topology_name", ["clos_2_8_2", "clos_8_8_16"])
+def test_clos_traffic_uses_every_root(topology_name: str) -> None:
+    topology = build_tables(topology_name)
+    for leaf, turnarounds in leaf_turnarounds(topology):
+        assert turnarounds == set(topology.roots)
+    assert path_diversity_warnings(topology.get_dfs_order_switches()) == []
+
+
+def test_fat_tree_traffic_uses_redundant_paths() -> None:
+    topology = build_tables("fat_tree_4ary")
+    for leaf, turnarounds in leaf_turnarounds(topology):
+        assert len(turnarounds) > 1
+    assert path_diversity_warnings(topology.get_dfs_order_switches()) == []
+
+
+def test_single_destination_is_not_a_path_diversity_problem() -> None:
+    # the leaf with 4 servers has 1 remote destination, which can only take
+    # one of its 2 paths
+    topology = build_tables("uneven_leaves")
+    assert path_diversity_warnings(topology.get_dfs_order_switches()) == []
+
+
+def test_single_uplink_tables_are_reported() -> None:
+    topology = build_tables("clos_2_8_2")
+    switches = topology.get_dfs_order_switches()
+    for switch in switches:
+        numdownlinks = len(switch.downlinks)
+        switch.switch_table = [min(port, numdownlinks) for port in switch.switch_table]
+    assert len(path_diversity_warnings(switches)) == 2
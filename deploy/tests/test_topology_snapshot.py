@@ -0,0 +1,66 @@
+import pprint
+from pathlib import Path
+from typing import Any, Dict, List
+
+import pytest
+
+from runtools import topology_snapshot
+from runtools.topology_snapshot import snapshot_key
+
+RUN_FARM_ARGS = {"run_farm_hosts_to_use": [{"f1.16xlarge": 1}], "always_expand": True}
+
+
+@pytest.fixture
+def sources(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Dict[str, Path]:
+    """A run farm recipe and a user_topologies.py to hash."""
+    recipe = tmp_path / "run-farm-recipe.yaml"
+    recipe.write_text("run_farm_type: AWSEC2F1\n")
+    topologies = tmp_path / "user_topologies.py"
+    topologies.write_text("def example_8config(self): pass\n")
+    monkeypatch.setattr(topology_snapshot, "TOPOLOGY_SOURCE_FILES", [str(topologies)])
+    monkeypatch.delenv("FIRESIM_RUNFARM_PREFIX", raising=False)
+    return {"recipe": recipe, "topologies": topologies}
+
+
+def key(sources: Dict[str, Path], run_farm_args: Any = RUN_FARM_ARGS) -> str:
+    extra_data: List[str] = [
+        "example_8config",
+        "AWSEC2F1",
+        pprint.pformat(run_farm_args),
+    ]
+    return snapshot_key([str(sources["recipe"])], extra_data)
+
+
+def test_key_is_stable(sources: Dict[str, Path]) -> None:
+    assert key(sources) == key(sources)
+
+
+@pytest.mark.parametrize("source", ["recipe", "topologies"])
+def test_key_covers_source_files(sources: Dict[str, Path], source: str) -> None:
+    before = key(sources)
+    with open(sources[source], "a") as f:
+        f.write("# changed\n")
+    assert key(sources) != before
+
+
+def test_key_covers_run_farm_args(sources: Dict[str, Path]) -> None:
+    changed = dict(RUN_FARM_ARGS, always_expand=False)
+    assert key(sources) != key(sources, changed)
+
+
+def test_key_covers_environment(
+    sources: Dict[str, Path], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    before = key(sources)
+    monkeypatch.setenv("FIRESIM_RUNFARM_PREFIX", "mine")
+    assert key(sources) != before
+
+
+def test_key_covers_snapshot_version(
+    sources: Dict[str, Path], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    before = key(sources)
+    monkeypatch.setattr(
+        topology_snapshot, "SNAPSHOT_VERSION", topology_snapshot.SNAPSHOT_VERSION + 1
+    )
+    assert key(sources) != before
@@ -0,0 +1,578 @@
+#!/usr/bin/env python3
+
+"""Measure the manager's own CPU and memory cost on large synthetic topologies.
+
+For each topology family and size, this builds a FireSimTopologyWithPasses
+against an externally provisioned run farm made of fake hosts, then emits the
+switch configs and boot commands for every switch/simulation (without
+contacting the hosts). Every case runs in its own process so that peak RSS
+and the global allocators (MAC addresses, node ids) are per-case.
+
+Wall time and peak RSS of each phase one pass and of the emission stages are
+written to a JSON file. Passing a previous JSON file with --baseline reports
+(and exits non-zero on) regressions, so changes to core_with_passes.py or
+elements.py show up in numbers. Needs the manager python environment (i.e.
+sourceme-manager.sh)."""
+
+import argparse
+import json
+import math
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import traceback
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+deploy_dir = os.path.abspath(os.path.join(script_dir, "..", "deploy"))
+
+FAMILIES = ["clos", "fat_tree", "supernode", "fireaxe"]
+BENCH_HWCONFIG = "benchmark_hwconfig"
+BENCH_WORKLOAD = "br-base-uniform.json"
+
+desc = """Benchmark the manager's topology passes on synthetic topologies."""
+parser = argparse.ArgumentParser(description=desc)
+parser.add_argument(
+    "-f",
+    "--families",
+    type=str,
+    nargs="+",
+    default=FAMILIES,
+    choices=FAMILIES,
+    help="topology families to benchmark",
+)
+parser.add_argument(
+    "-n",
+    "--sizes",
+    type=int,
+    nargs="+",
+    default=[8, 64, 512, 4096],
+    help="approximate number(s) of topology nodes (e.g. up to 100000)",
+)
+parser.add_argument(
+    "--host_mapping",
+    type=str,
+    default="greedy",
+    choices=["greedy", "min_cut"],
+    help="host mapping used for topologies without a custom mapper",
+)
+parser.add_argument(
+    "-o", "--output", type=str, default=None, help="JSON file to write the results to"
+)
+parser.add_argument(
+    "-b",
+    "--baseline",
+    type=str,
+    default=None,
+    help="JSON file from a previous run to compare against",
+)
+parser.add_argument(
+    "--threshold",
+    type=float,
+    default=0.2,
+    help="relative increase in time/peak RSS reported as a regression",
+)
+parser.add_argument(
+    "--min_seconds",
+    type=float,
+    default=0.05,
+    help="ignore time regressions of stages faster than this",
+)
+parser.add_argument(
+    "--timeout",
+    type=int,
+    default=1800,
+    help="seconds after which a single case is abandoned",
+)
+parser.add_argument(
+    "--memory_limit_gb",
+    type=float,
+    default=None,
+    help="optional address space limit per case",
+)
+parser.add_argument(
+    "--run_case",
+    type=str,
+    nargs=2,
+    default=None,
+    metavar=("FAMILY", "SIZE"),
+    help=argparse.SUPPRESS,
+)
+
+
+# --- topology families. the requested size is passed as no_net_num_nodes ---
+
+
+def clos_params(size):
+    """clos_m_n_r with 2 roots and 8 servers per leaf: 2 + 9 * r nodes."""
+    return 2, 8, max(1, (size - 2) // 9)
+
+
+def fat_tree_params(size):
+    """k-ary fat tree: k^3/4 servers and 5k^2/4 switches."""
+    k = 4
+    while k**3 // 4 + 5 * k * k // 4 < size:
+        k += 2
+    return k
+
+
+def supernode_params(size):
+    """leaf switches with 8 supernodes of 4 servers: 33 nodes per leaf."""
+    return max(1, round(size / 33))
+
+
+def fireaxe_params(size):
+    """a ring of partitions."""
+    return max(2, size)
+
+
+def benchmark_clos_config(self):
+    self.clos_m_n_r(*clos_params(self.no_net_num_nodes))
+
+
+def benchmark_fat_tree_config(self):
+    from runtools.topology.elements import FireSimServerNode, FireSimSwitchNode
+
+    k = fat_tree_params(self.no_net_num_nodes)
+    half = k // 2
+    cores = [FireSimSwitchNode() for _ in range(half * half)]
+    self.roots = cores
+    for pod in range(k):
+        aggrs = [FireSimSwitchNode() for _ in range(half)]
+        edges = [FireSimSwitchNode() for _ in range(half)]
+        for aggrno, aggr in enumerate(aggrs):
+            for coreno in range(half):
+                cores[aggrno * half + coreno].add_downlink(aggr)
+            aggr.add_downlinks(edges)
+        for edge in edges:
+            edge.add_downlinks([FireSimServerNode() for _ in range(half)])
+
+
+def benchmark_supernode_config(self):
+    from runtools.topology.elements import (
+        FireSimSuperNodeServerNode,
+        FireSimDummyServerNode,
+        FireSimSwitchNode,
+    )
+
+    level = []
+    for _ in range(supernode_params(self.no_net_num_nodes)):
+        leaf = FireSimSwitchNode()
+        leaf.add_downlinks(
+            self.supernode_flatten(
+                [
+                    [FireSimSuperNodeServerNode()]
+                    + [FireSimDummyServerNode() for _ in range(3)]
+                    for _ in range(8)
+                ]
+            )
+        )
+        level.append(leaf)
+    while len(level) > 1:
+        parents = []
+        for i in range(0, len(level), 8):
+            parent = FireSimSwitchNode()
+            parent.add_downlinks(level[i : i + 8])
+            parents.append(parent)
+        level = parents
+    self.roots = level
+
+
+def benchmark_fireaxe_config(self):
+    from runtools.simulation_configs.partition import (
+        FireAxeEdge,
+        FireAxeNodeBridgePair,
+        PartitionMode,
+    )
+
+    num_partitions = fireaxe_params(self.no_net_num_nodes)
+    hwdb_entries = {pidx: BENCH_HWCONFIG for pidx in range(num_partitions)}
+    edges = [
+        FireAxeEdge(
+            FireAxeNodeBridgePair(pidx, 0),
+            FireAxeNodeBridgePair((pidx + 1) % num_partitions, 1),
+        )
+        for pidx in range(num_partitions)
+    ]
+    self.fireaxe_topology_config(
+        hwdb_entries, edges, list(range(num_partitions)), PartitionMode.NOC_MODE
+    )
+
+
+def hosts_needed(family, size):
+    """Return (number of sim hosts, number of switch-only hosts, slots per sim host)."""
+    if family == "clos":
+        m, n, r = clos_params(size)
+        return r, m, n
+    if family == "fat_tree":
+        k = fat_tree_params(size)
+        return k * k // 2, 3 * k * k // 4, max(8, k // 2)
+    if family == "supernode":
+        leaves = supernode_params(size)
+        return leaves, leaves // 7 + 2, 8
+    if family == "fireaxe":
+        return math.ceil(fireaxe_params(size) / 8), 0, 8
+    raise Exception(f"Unknown family {family}")
+
+
+def run_farm_args(family, size):
+    num_sim_hosts, num_switch_hosts, slots = hosts_needed(family, size)
+    hosts = [{f"sim-host-{i}": "sim_host"} for i in range(num_sim_hosts)]
+    hosts += [{f"switch-host-{i}": "switch_host"} for i in range(num_switch_hosts)]
+    return {
+        "default_platform": "EC2InstanceDeployManager",
+        "default_simulation_dir": "/tmp/firesim-benchmark",
+        "run_farm_host_specs": [
+            {
+                "sim_host": {
+                    "num_fpgas": slots,
+                    "num_metasims": 0,
+                    "use_for_switch_only": False,
+                }
+            },
+            {
+                "switch_host": {
+                    "num_fpgas": 0,
+                    "num_metasims": 0,
+                    "use_for_switch_only": True,
+                }
+            },
+        ],
+        "run_farm_hosts_to_use": hosts,
+    }
+
+
+# --- measurement ---
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on linux, bytes on macos
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def stage_result(seconds, **extra):
+    res = {
+        "seconds": seconds,
+        "rss_bytes": rss_bytes(),
+        "peak_rss_bytes": peak_rss_bytes(),
+    }
+    res.update(extra)
+    return res
+
+
+def run_stage(stages, name, func):
+    start = time.perf_counter()
+    try:
+        func()
+    except Exception as e:
+        where = traceback.extract_tb(e.__traceback__)[-1]
+        error = f"{type(e).__name__}: {e} ({os.path.basename(where.filename)}:{where.lineno})"
+        stages[name] = stage_result(time.perf_counter() - start, error=error)
+        return
+    stages[name] = stage_result(time.perf_counter() - start)
+
+
+def run_case(family, size, host_mapping):
+    """Run a single case in this process and return its results."""
+    sys.path.insert(0, deploy_dir)
+    from absl import logging as absl_logging
+    import logging
+
+    absl_logging.set_verbosity(absl_logging.ERROR)
+    logging.getLogger().setLevel(logging.ERROR)
+
+    import runtools.utils
+    from runtools.runtime_hw_config import RuntimeHWConfig
+    from runtools.run_farms.externally_provisioned import ExternallyProvisioned
+    from runtools.topology.core_with_passes import FireSimTopologyWithPasses
+    from runtools.topology.diagram import TopologyDiagramConfig
+    from runtools.topology.pass_manager import PassManager
+    from runtools.topology.user_topologies import UserTopologies
+    from runtools.workload import WorkloadConfig
+    from runtools.simulation_configs.tracerv import TracerVConfig
+    from runtools.simulation_configs.autocounter import AutoCounterConfig
+    from runtools.simulation_configs.host_debug import HostDebugConfig
+    from runtools.simulation_configs.synth_print import SynthPrintConfig
+    from runtools.simulation_configs.partition import PartitionConfig
+
+    # is_on_aws() probes the instance metadata service once per process (with a
+    # timeout off of AWS), which measures the network instead of the manager
+    runtools.utils._on_aws = False
+
+    for name in FAMILIES:
+        setattr(
+            UserTopologies,
+            f"benchmark_{name}_config",
+            globals()[f"benchmark_{name}_config"],
+        )
+
+    class BenchHWDB:
+        """Every hardware config name resolves to the same prebuilt config."""
+
+        def __init__(self):
+            self.hwconfig = RuntimeHWConfig(
+                BENCH_HWCONFIG,
+                {
+                    "agfi": "agfi-benchmark",
+                    "deploy_quintuplet_override": "f1-firesim-FireSim-FireSimRocketConfig-BaseF1Config",
+                    "custom_runtime_config": None,
+                },
+                "benchmark",
+            )
+
+        def get_runtimehwconfig_from_name(self, name):
+            return self.hwconfig
+
+    stages = {}
+
+    class MeasuringPassManager(PassManager):
+        def run(self, owner, spec, func, *args, **kwargs):
+            start = time.perf_counter()
+            ret = super().run(owner, spec, func, *args, **kwargs)
+            stages[spec.name] = stage_result(
+                time.perf_counter() - start, skipped=self.timings[spec.name] is None
+            )
+            return ret
+
+    class BenchTopologyWithPasses(FireSimTopologyWithPasses):
+        def phase_one_passes(self):
+            stages["construct_topology"] = stage_result(
+                time.perf_counter() - construct_start
+            )
+            self.pass_manager = MeasuringPassManager()
+            super().phase_one_passes()
+
+    result = {
+        "family": family,
+        "requested_size": size,
+        "host_mapping": host_mapping,
+        "stages": stages,
+    }
+
+    start = time.perf_counter()
+    run_farm = ExternallyProvisioned(run_farm_args(family, size), False)
+    stages["construct_run_farm"] = stage_result(time.perf_counter() - start)
+
+    # the workload and diagram paths are relative to the working directory
+    with tempfile.TemporaryDirectory() as workdir:
+        os.symlink(
+            os.path.join(deploy_dir, "workloads"), os.path.join(workdir, "workloads")
+        )
+        os.chdir(workdir)
+
+        construct_start = time.perf_counter()
+        topology = BenchTopologyWithPasses(
+            user_topology_name=f"benchmark_{family}_config",
+            no_net_num_nodes=size,
+            run_farm=run_farm,
+            hwdb=BenchHWDB(),
+            defaulthwconfig=BENCH_HWCONFIG,
+            workload=WorkloadConfig(BENCH_WORKLOAD, "benchmark", None),
+            defaultlinklatency=6405,
+            defaultswitchinglatency=10,
+            defaultnetbandwidth=200,
+            defaultprofileinterval=-1,
+            defaulttracervconfig=TracerVConfig({}),
+            defaultautocounterconfig=AutoCounterConfig({}),
+            defaulthostdebugconfig=HostDebugConfig({}),
+            defaultsynthprintconfig=SynthPrintConfig({}),
+            defaultpartitionconfig=PartitionConfig(),
+            terminateoncompletion=False,
+            build_recipes=None,
+            default_metasim_mode=False,
+            default_plusarg_passthrough="",
+            host_mapping=host_mapping,
+            # json only, so that the graphviz layout time isn't measured
+            diagram_config=TopologyDiagramConfig({"formats": ["json"]}),
+        )
+        result["total_phase_one_seconds"] = time.perf_counter() - construct_start
+
+        nodes = topology.firesimtopol.get_dfs_order()
+        switches = [n for n in nodes if type(n).__name__ == "FireSimSwitchNode"]
+        result["num_nodes"] = len(nodes)
+        result["num_switches"] = len(switches)
+        result["num_servers"] = len(topology.firesimtopol.get_dfs_order_servers())
+        hosts = run_farm.get_all_host_nodes()
+
+        run_stage(
+            stages, "pass_set_partition_configs", topology.pass_set_partition_configs
+        )
+
+        def emit_switch_configs():
+            for switch in switches:
+                switch.switch_builder.emit_switch_configfile()
+
+        def generate_boot_commands():
+            for host in hosts:
+                for switch in host.switch_slots:
+                    switch.get_switch_start_command()
+                for slotno, server in enumerate(host.sim_slots):
+                    server.get_sim_start_command(slotno, f"+slotid={slotno}")
+
+        run_stage(stages, "switch_config_emission", emit_switch_configs)
+        if family == "fireaxe":
+            # FireAxe partitions are not networked, so they have no MAC address
+            # to boot with
+            stages["boot_command_generation"] = stage_result(0.0, skipped=True)
+        else:
+            run_stage(stages, "boot_command_generation", generate_boot_commands)
+
+    result["peak_rss_bytes"] = peak_rss_bytes()
+    return result
+
+
+def spawn_case(family, size, args):
+    """Run a case in a child process."""
+    cmd = [
+        sys.executable,
+        os.path.abspath(__file__),
+        "--run_case",
+        family,
+        str(size),
+        "--host_mapping",
+        args.host_mapping,
+    ]
+    if args.memory_limit_gb is not None:
+        cmd += ["--memory_limit_gb", str(args.memory_limit_gb)]
+    start = time.perf_counter()
+    try:
+        proc = subprocess.run(cmd, capture_output=True, text=True, timeout=args.timeout)
+    except subprocess.TimeoutExpired:
+        return {
+            "family": family,
+            "requested_size": size,
+            "status": "timeout",
+            "wall_seconds": time.perf_counter() - start,
+        }
+    if proc.returncode != 0 or not proc.stdout.strip():
+        return {
+            "family": family,
+            "requested_size": size,
+            "status": "error",
+            "error": proc.stderr.strip().splitlines()[-20:],
+            "wall_seconds": time.perf_counter() - start,
+        }
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    errored = any("error" in res for res in result["stages"].values())
+    result["status"] = "stage_error" if errored else "ok"
+    result["wall_seconds"] = time.perf_counter() - start
+    return result
+
+
+def case_key(case):
+    return (case["family"], case["requested_size"], case.get("host_mapping"))
+
+
+def compare(results, baseline, threshold, min_seconds):
+    """Return a list of regression descriptions of results vs baseline."""
+    regressions = []
+    base_cases = {case_key(c): c for c in baseline["cases"]}
+    for case in results["cases"]:
+        base = base_cases.get(case_key(case))
+        if base is None or base.get("status") != "ok":
+            continue
+        name = f"{case['family']}/{case['requested_size']}"
+        if "stages" not in case:
+            regressions.append(f"{name}: {case['status']} (baseline was ok)")
+            continue
+        for stage, res in case["stages"].items():
+            base_res = base["stages"].get(stage)
+            if base_res is None:
+                continue
+            if "error" in res and "error" not in base_res:
+                regressions.append(f"{name} {stage}: {res['error']}")
+            if max(res["seconds"], base_res["seconds"]) >= min_seconds and res[
+                "seconds"
+            ] > base_res["seconds"] * (1 + threshold):
+                regressions.append(
+                    f"{name} {stage}: {base_res['seconds']:.3f}s -> {res['seconds']:.3f}s"
+                )
+        if case["peak_rss_bytes"] > base["peak_rss_bytes"] * (1 + threshold):
+            regressions.append(
+                f"{name} peak RSS: {base['peak_rss_bytes'] / 2**20:.1f} MiB -> {case['peak_rss_bytes'] / 2**20:.1f} MiB"
+            )
+    return regressions
+
+
+def print_case(case):
+    name = f"{case['family']}/{case['requested_size']}"
+    if "stages" not in case:
+        print(f"{name:>20}: {case['status']} after {case['wall_seconds']:.1f}s")
+        for line in case.get("error", []):
+            print(f"{'':>22}{line}")
+        return
+    print(
+        f"{name:>20}: {case['num_nodes']} nodes, phase one {case['total_phase_one_seconds']:.3f}s, "
+        f"peak RSS {case['peak_rss_bytes'] / 2**20:.1f} MiB, {case['status']}"
+    )
+    for stage, res in case["stages"].items():
+        status = " (skipped)" if res.get("skipped") else ""
+        if "error" in res:
+            status = f" ERROR {res['error']}"
+        print(
+            f"{'':>22}{stage:<36} {res['seconds']:9.3f}s {res['peak_rss_bytes'] / 2**20:9.1f} MiB{status}"
+        )
+
+
+def main():
+    args = parser.parse_args()
+
+    if args.run_case is not None:
+        if args.memory_limit_gb is not None:
+            limit = int(args.memory_limit_gb * 2**30)
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        try:
+            result = run_case(
+                args.run_case[0], int(args.run_case[1]), args.host_mapping
+            )
+        except Exception:
+            traceback.print_exc()
+            sys.exit(1)
+        print(json.dumps(result))
+        return
+
+    results = {
+        "version": 1,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "host_mapping": args.host_mapping,
+        "cases": [],
+    }
+    for family in args.families:
+        for size in args.sizes:
+            case = spawn_case(family, size, args)
+            results["cases"].append(case)
+            print_case(case)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Wrote results to {args.output}")
+
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold, args.min_seconds)
+        if regressions:
+            print(f"{len(regressions)} regression(s) vs {args.baseline}:")
+            for r in regressions:
+                print(f"  {r}")
+            sys.exit(1)
+        print(f"No regressions vs {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
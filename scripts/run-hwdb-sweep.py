@@ -22,6 +22,7 @@ parser.add_argument('-by', '--build_yaml', type=Path, help='build.yaml (must spe
 parser.add_argument('-sf', '--start_freq', type=int, help='min. freq. to sweep (inclusive)', required=True)
 parser.add_argument('-ef', '--end_freq', type=int, help='max. freq. to sweep (exclusive)', required=True)
 parser.add_argument('-n', '--max_build_parallelism', type=int, help='max # of build machines to use (must be <= amount specified in build_recipe.yaml)', required=True)
+parser.add_argument('-aw', '--abort_wns', type=float, help='abort builds once vivado estimates a WNS (ns) below this during place/route (they count as failing timing)', required=False)
 
 args = parser.parse_args()
 
@@ -218,8 +219,13 @@ def do_builds(freq_to_search):
 
     # build bitstream w/ those files
     print("Executing FireSim builds")
-    for l in execute([f'firesim buildbitstream -r {temp_dir}/tmp_bry.yaml -b {temp_dir}/tmp_by.yaml']):
-      print(l, end="")
+    abort_arg = f' --abortbuildwns={args.abort_wns}' if args.abort_wns is not None else ''
+    try:
+      for l in execute([f'firesim buildbitstream -r {temp_dir}/tmp_bry.yaml -b {temp_dir}/tmp_by.yaml{abort_arg}']):
+        print(l, end="")
+    except subprocess.CalledProcessError as exc:
+      # failed (e.g. aborted) builds have no hwdb entry, checked below
+      print(f"Some FireSim builds failed: {exc}")
     print("Done executing FireSim builds")
 
   # check to see if hwdb entry exists for files (if does, then double check by grepping violated in most recent build results)
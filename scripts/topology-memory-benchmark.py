@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+"""Measure the manager-side memory footprint of FireSim topology elements.
+
+Builds a synthetic two-level tree (root switch -> ToR switches -> servers)
+out of FireSimSwitchNode/FireSimServerNode/FireSimLink objects and records
+the bytes allocated per node with tracemalloc. Nothing is mapped or deployed,
+so this only needs the manager python environment (i.e. sourceme-manager.sh)."""
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(script_dir, "..", "deploy"))
+
+from runtools.topology.elements import (  # noqa: E402
+    FireSimServerNode,
+    FireSimSwitchNode,
+)
+
+desc = """Record the bytes per node used by a synthetic FireSim topology."""
+parser = argparse.ArgumentParser(description=desc)
+parser.add_argument(
+    "-n",
+    "--num_servers",
+    type=int,
+    nargs="+",
+    default=[1000, 10000, 100000],
+    help="number(s) of servers to build a topology for",
+)
+parser.add_argument(
+    "-f", "--fanout", type=int, default=32, help="number of servers per ToR switch"
+)
+parser.add_argument(
+    "-o",
+    "--output",
+    type=str,
+    default=None,
+    help="optional JSON file to write the results to",
+)
+args = parser.parse_args()
+
+
+def build_topology(num_servers, fanout):
+    """Build root switch -> ToR switches -> servers. Return (root, num_nodes)."""
+    root = FireSimSwitchNode()
+    num_tors = (num_servers + fanout - 1) // fanout
+    tors = [FireSimSwitchNode() for _ in range(num_tors)]
+    root.add_downlinks(tors)
+    remaining = num_servers
+    for tor in tors:
+        count = min(fanout, remaining)
+        tor.add_downlinks([FireSimServerNode() for _ in range(count)])
+        remaining -= count
+    return root, 1 + num_tors + num_servers
+
+
+def measure(num_servers, fanout):
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    start = time.perf_counter()
+    root, num_nodes = build_topology(num_servers, fanout)
+    elapsed = time.perf_counter() - start
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # read every link id once so the cost of formatting is also visible
+    start = time.perf_counter()
+    for tor_link in root.downlinks:
+        tor_link.get_global_link_id()
+        for server_link in tor_link.get_downlink_side().downlinks:
+            server_link.get_global_link_id()
+    link_id_elapsed = time.perf_counter() - start
+
+    return {
+        "num_servers": num_servers,
+        "num_nodes": num_nodes,
+        "num_links": num_nodes - 1,
+        "bytes_total": after - before,
+        "bytes_peak": peak - before,
+        "bytes_per_node": (after - before) / num_nodes,
+        "construct_seconds": elapsed,
+        "link_id_read_seconds": link_id_elapsed,
+    }
+
+
+results = []
+for n in args.num_servers:
+    res = measure(n, args.fanout)
+    results.append(res)
+    print(
+        f"{res['num_nodes']:>8} nodes: {res['bytes_per_node']:8.1f} bytes/node "
+        f"({res['bytes_total'] / 2**20:.1f} MiB, peak {res['bytes_peak'] / 2**20:.1f} MiB), "
+        f"construct {res['construct_seconds']:.3f}s, link ids {res['link_id_read_seconds']:.3f}s"
+    )
+
+if args.output is not None:
+    with open(args.output, "w") as f:
+        json.dump({"fanout": args.fanout, "results": results}, f, indent=2)
+    print(f"Wrote results to {args.output}")
@@ -61,6 +61,10 @@ void write_last_flit(uint8_t *send_buf, int tokenid, int is_last) {
   *lrv |= (((uint64_t)is_last) << bitoffset);
 }
 
+// mac2port entry for destinations that may be sent on any uplink. must match
+// ANY_UPLINK_PORT in deploy/runtools/topology/switching.py
+#define ANY_UPLINK (0xfffe)
+
 /* get dest mac from flit, then get port from mac */
 uint16_t get_port_from_flit(uint64_t flit, int current_port) {
   uint16_t is_multicast = (flit >> 16) & 0x1;
@@ -77,7 +81,7 @@ uint16_t get_port_from_flit(uint64_t flit, int current_port) {
   // so we can just look up the port in the mac2port table
   sendport = mac2port[sendport];
 
-  if (sendport == NUMDOWNLINKS) {
+  if (sendport == ANY_UPLINK) {
     // this has been mapped to "any uplink", so pick one
     int randval = rand() % NUMUPLINKS;
     sendport = randval + NUMDOWNLINKS;